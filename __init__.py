@@ -1,3 +1,5 @@
+import sys
+import time
 import random
 import shelve
 import os.path
@@ -17,6 +19,8 @@ from colors import *
 from player import *
 from logic import *
 from pathfinding import *
+from scheduler import *
+from inputs import *
 import socket
 import PodSixNet
 
@@ -46,13 +50,25 @@ class GameController(object):
     # Maximum number of players in a hotseat multiplayer game
     MAX_PLAYERS = 2 
     
-    def __init__(self):
+    def __init__(self, headless = False, script = ()):
+        '''
+        With headless set, runs without a window: nothing is drawn, input is
+        read from script (see inputs.ScriptedInput) instead of the keyboard,
+        and frames run as fast as they can instead of at LIMIT_FPS.
+        '''
     
         self.gui_wait = self.MAX_GUI_WAIT
         self.game_object = None
         self.prepare_to_quit = False
+        self.headless = headless
         
-        self.game_ui = GameUI(
+        if headless:
+            ui_class = HeadlessUI
+            self.input = ScriptedInput(script)
+        else:
+            ui_class = GameUI
+            self.input = KeyboardInput()
+        self.game_ui = ui_class(
             self.SCREEN_WIDTH, 
             self.SCREEN_HEIGHT, 
             self.SIDEMENU_WIDTH, 
@@ -65,23 +81,33 @@ class GameController(object):
         self.max_camera_width = self.SCREEN_WIDTH-2*self.MARGIN_WIDTH
         self.max_camera_height = self.SCREEN_HEIGHT-2*self.MARGIN_WIDTH
         
-        # Main libtcod console and parameters
-        libtcod.sys_set_fps(self.LIMIT_FPS)
+        # Main libtcod console and parameters. Frames are paced by the
+        # scheduler, which sleeps between them, rather than by libtcod's own
+        # frame limit, which only kicks in when the console is flushed.
+        if headless:
+            self.scheduler = FrameScheduler(0)
+        else:
+            libtcod.sys_set_fps(0)
+            self.scheduler = FrameScheduler(self.LIMIT_FPS)
+        self.game_ui.scheduler = self.scheduler
         
         
     # Starting game and running main loop
     def start_game(self):
         
-        while not libtcod.console_is_window_closed():
+        while not self.input.is_window_closed():
             
-            # Render the screen
-            self.game_ui.refresh_all(self.game_object, self.game_ui)
+            # Render the screen, if anything on it has changed
+            if self.scheduler.should_render():
+                self.game_ui.refresh_all(self.game_object, self.game_ui)
             
-            exit = game_controller.system_loop()
+            exit = self.system_loop()
             
             if exit:
                 print 'Thermonuclear Go closed gracefully.'
                 break
+                
+            self.scheduler.wait()
         
     
     CONSOLE_KEY_ACTIONS = {
@@ -90,7 +116,9 @@ class GameController(object):
         libtcod.KEY_LEFT: lambda self : self.arrow_key(-1, 0),
         libtcod.KEY_RIGHT: lambda self : self.arrow_key( 1 ,0),
         libtcod.KEY_ENTER: lambda self : self.action_key(),
-        libtcod.KEY_ESCAPE: lambda self : self.escape_key()
+        libtcod.KEY_ESCAPE: lambda self : self.escape_key(),
+        libtcod.KEY_PAGEUP: lambda self : self.scroll_messages( 1),
+        libtcod.KEY_PAGEDOWN: lambda self : self.scroll_messages(-1),
     }
 
     CHAR_KEY_ACTIONS = {
@@ -107,18 +135,23 @@ class GameController(object):
     # Handling input and dispatch periodic UI and game logic functions
     def system_loop(self):
         if self.game_ui.current_menu != None:
-            key = libtcod.console_wait_for_keypress(True)  # Loop waits for a key to be pressed
+            key = self.input.wait_for_keypress()  # Loop waits for a key to be pressed
             self.gui_wait = 0
             
         else:
-            key = libtcod.console_check_for_keypress() # Loop runs continuously
+            key = self.input.check_for_keypress() # Loop runs continuously
             if self.gui_wait > 0:
                 self.gui_wait -= 1
         
+        # Any input may change what's on screen
+        if key.vk != libtcod.KEY_NONE:
+            self.scheduler.mark_dirty()
+        
         # Handling console key input (i.e., non-character key input)
         for input, action in self.CONSOLE_KEY_ACTIONS.items():
-            if libtcod.console_is_key_pressed(input):
+            if self.input.is_key_pressed(input):
                 action(self)
+                self.scheduler.mark_dirty()
                 
         # Handling character key input (a-z keys and other printable chars, but
         # not numeric keys)
@@ -138,6 +171,11 @@ class GameController(object):
         
             self.game_ui.cycle()
             self.game_object.cycle()
+            if self.game_ui.loading:
+                self.game_ui.set_loading_progress(self.game_object.background.progress)
+            if self.game_object.load_error != None:
+                print 'Could not load: ' + self.game_object.load_error
+                self.return_to_main_menu()
             
                 
         return self.prepare_to_quit
@@ -149,14 +187,24 @@ class GameController(object):
             self.gui_wait = self.MAX_GUI_WAIT
             self.game_ui.camera.move(x , y, self.game_object.game_map.world_height)
     
+    # Scrolls the infobar back through old messages, or forward again, a page
+    # at a time, throttled like camera movement
+    def scroll_messages(self, direction):
+        if self.game_object != None and self.gui_wait <= 0 and self.game_ui.infobar.show:
+            self.gui_wait = self.MAX_GUI_WAIT
+            self.game_ui.infobar.scroll(direction*self.game_ui.infobar.max_messages)
+    
     # Dispatches load order and indicates to the UI and game state loading has begun
     def begin_load(self, ui, delay):
         self.game_ui.loading = True
         self.game_object.loading = True
         self.game_object.event_queue.add_event(delay, self.game_object.load_map, (ui,))
     
-    # Dispatches save order and indicates to the UI and game state saving has begun
+    # Dispatches save order and indicates to the UI and game state saving has begun,
+    # unless a save or load is already under way
     def begin_save(self, ui, delay):
+        if self.game_object.loading:
+            return
         self.game_ui.loading = True
         self.game_object.loading = True
         self.game_object.event_queue.add_event(delay, self.game_object.save_map, (ui,))
@@ -270,8 +318,45 @@ class GameController(object):
         
                     
                 
+def run_headless(script):
+    '''
+    Plays through an input script without a window, as fast as possible, and
+    returns the game controller afterwards
+    '''
+    controller = GameController(headless = True, script = script)
+    controller.start_game()
+    return controller
+    
 def main():
     global game_controller
+    # --debug turns on slow consistency checks
+    if '--debug' in sys.argv:
+        sys.argv.remove('--debug')
+        GameObject.DEBUG_COUNTERS = True
+    # python __init__.py --headless script.txt runs an input script (see
+    # inputs.parse_script) without a window, and python __init__.py --replay
+    # map_name.replay plays a recorded game through again, checking it
+    # hasn't diverged
+    if len(sys.argv) > 2 and sys.argv[1] == '--replay':
+        stats = replay_game(
+            GameObject(
+                GameController.SCREEN_WIDTH-GameController.MARGIN_WIDTH*2, 
+                GameController.MAX_PLAYERS, 
+                GameController.MAX_BACKGROUND_WAIT
+            ), 
+            sys.argv[2]
+        )
+        print 'Replayed %d actions over %d rounds in %.2f s; all %d round hashes match.' % (
+            stats['actions'], stats['rounds'], stats['seconds'], stats['rounds_checked']
+        )
+        return
+    if len(sys.argv) > 2 and sys.argv[1] == '--headless':
+        with open(sys.argv[2]) as script_file:
+            script = parse_script(script_file.read())
+        game_controller = run_headless(script)
+        stats = game_controller.scheduler.stats()
+        print 'Ran %d frames in %.2f s.' % (stats['frames'], time.time() - game_controller.scheduler.start_time)
+        return
     game_controller = GameController()
     game_controller.start_game()
     
@@ -0,0 +1,130 @@
+import sys
+import threading
+import Queue
+from collections import deque
+
+class BackgroundJob(object):
+    '''
+    A function run by a BackgroundWorker. Like a PathFuture, it's only
+    marked done on the main thread, by BackgroundWorker.deliver.
+    '''
+    def __init__(self, function, args, callback, callback_args):
+        self.function = function
+        self.args = args
+        self.callback = callback
+        self.callback_args = callback_args
+        self.finished = False
+        self.value = None
+        self.error = None
+
+    def done(self):
+        return self.finished
+
+    def result(self):
+        '''
+        What the job's function returned. If it raised an exception instead,
+        the exception is raised again here. Raises ValueError if the job
+        hasn't finished yet.
+        '''
+        if not self.finished:
+            raise ValueError('background job has not finished')
+        if self.error != None:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.value
+
+class BackgroundWorker(object):
+    '''
+    Runs slow jobs, like writing saves and reading maps, one at a time and
+    in the order they were submitted, on a thread of their own, so that they
+    never hold up a frame. Finished jobs pile up in an inbox until deliver,
+    called once a frame from GameObject.cycle, passes their callbacks on to
+    the event queue. The thread is started on first use.
+
+    A job's function is called as function(progress, *args), where
+    progress(fraction) can be called along the way to report how far it's
+    got; the main thread can read it from self.progress.
+    '''
+    def __init__(self, event_queue):
+        self.event_queue = event_queue
+        self.jobs = Queue.Queue()
+        # Finished jobs, appended to by the worker thread
+        self.inbox = deque()
+        self.pending = 0
+        self.progress = None
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target = self.run, name = 'background worker')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, function, args = (), callback = None, callback_args = ()):
+        '''
+        Queues function to be run on the worker thread. Once it's done,
+        callback, if given, is added to the event queue, and called with the
+        BackgroundJob followed by callback_args.
+        '''
+        if self.thread == None:
+            self.start()
+        job = BackgroundJob(function, args, callback, callback_args)
+        self.pending += 1
+        self.jobs.put(job)
+        return job
+
+    def set_progress(self, fraction):
+        self.progress = fraction
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job == None:
+                self.jobs.task_done()
+                return
+            self.progress = 0.0
+            try:
+                job.value = job.function(self.set_progress, *job.args)
+            except Exception:
+                job.error = sys.exc_info()
+            self.progress = None
+            self.inbox.append(job)
+            self.jobs.task_done()
+
+    def deliver(self):
+        '''
+        Hands out every job that's finished since the last call. Returns the
+        number of jobs delivered.
+        '''
+        delivered = 0
+        while self.inbox:
+            job = self.inbox.popleft()
+            job.finished = True
+            self.pending -= 1
+            if job.callback != None:
+                self.event_queue.add_event(0, job.callback, (job,) + job.callback_args)
+            elif job.error != None:
+                # Nobody is waiting on this job, so its error would otherwise
+                # go unnoticed
+                job.result()
+            delivered += 1
+        return delivered
+
+    def busy(self):
+        return self.pending > 0
+
+    def wait(self):
+        '''
+        Blocks until every job submitted so far has run, then delivers them
+        '''
+        if self.thread != None:
+            self.jobs.join()
+        self.deliver()
+
+    def close(self):
+        '''
+        Lets every queued job finish, then stops the worker thread
+        '''
+        if self.thread != None:
+            self.jobs.put(None)
+            self.thread.join()
+            self.thread = None
+        self.deliver()
@@ -0,0 +1,698 @@
+# Benchmarks for Thermonuclear Go. Run from the game directory as
+#     python benchmark.py [name ...]
+# to run the named benchmarks, or all of them if none are named.
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+from decimal import Decimal
+import numpy as np
+
+# The Doryen Library - Documentation:
+# http://roguecentral.org/doryen/data/libtcod/doc/1.5.1/index2.html
+import libtcodpy as libtcod
+
+# Thermonuclear Go modules
+from sphere import *
+from worldgen import *
+from mapping import *
+from pathfinding import *
+from supply import *
+from ui import *
+from ui_objects import *
+from scheduler import *
+from savegame import *
+from background import *
+from logic import *
+from spatial import *
+
+def timed(function, *args):
+    '''
+    Runs function once and returns its result and the time it took, in ms
+    '''
+    start = time.time()
+    result = function(*args)
+    return result, (time.time() - start)*1000
+
+def generate_cell(world_noise, resource_noise, x, y, world_width, world_height):
+    '''
+    Reference implementation of world generation for a single cell, the way
+    GridCoordinate used to do it; returns elevation and resource density
+    '''
+    la = ((Decimal(y)*180)/Decimal(world_height))-90
+    lo = ((Decimal(x)*360)/Decimal(world_width))-180
+    px, py, pz = spherical_to_cartesian(la, lo, GridCoordinate.LANDMASS_SIZE)
+    elevation = libtcod.noise_get_fbm(world_noise, [float(px), float(py), float(pz)], GridCoordinate.DETAIL)
+    resource_density = 0
+    if elevation > 0:
+        px, py, pz = spherical_to_cartesian(la, lo, GridCoordinate.RESOURCE_DISTRIBUTION)
+        resource_density = libtcod.noise_get(resource_noise, [float(px), float(py), float(pz)])
+    return elevation, resource_density
+
+def bench_worldgen():
+    '''
+    Times batched world generation at several map sizes, and checks it against
+    the per-cell reference on the default map size
+    '''
+    for world_width in (180, 720, 1440):
+        world_height = world_width/2
+        world_noise = libtcod.noise_new(3)
+        resource_noise = libtcod.noise_new(3)
+        terrain, ms = timed(
+            generate_terrain,
+            world_width,
+            world_height,
+            world_noise,
+            resource_noise,
+            GridCoordinate.LANDMASS_SIZE,
+            GridCoordinate.DETAIL,
+            GridCoordinate.RESOURCE_DISTRIBUTION,
+            GridCoordinate.ELEVATIONS
+        )
+        print 'worldgen %dx%d: %.0f ms' % (world_width, world_height, ms)
+
+        if world_width == 180:
+            start = time.time()
+            worst = 0
+            for x in xrange(world_width):
+                for y in xrange(world_height):
+                    elevation, resource_density = generate_cell(
+                        world_noise, resource_noise, x, y, world_width, world_height
+                    )
+                    worst = max(
+                        worst,
+                        abs(elevation - terrain['elevation'][x, y]),
+                        abs(resource_density - terrain['resource_density'][x, y])
+                    )
+            print 'worldgen %dx%d per cell: %.0f ms, max difference %g' % (
+                world_width, world_height, (time.time() - start)*1000, worst
+            )
+        libtcod.noise_delete(world_noise)
+        libtcod.noise_delete(resource_noise)
+
+class LegacyCell(object):
+    '''
+    Stand-in with the same attributes a GridCoordinate used to carry around
+    for every cell, for comparing memory use against the TerrainStore
+    '''
+    def __init__(self, x, y, world_width, world_height, elevation, resource_density, char, color):
+        self.x = x
+        self.y = y
+        self.la = ((Decimal(y)*180)/Decimal(world_height))-90
+        self.lo = ((Decimal(x)*360)/Decimal(world_width))-180
+        self.char = char
+        self.color = color
+        self.neighbors = {}
+        self.elevation = elevation
+        self.resource_density = resource_density
+
+def legacy_cell_size(cell):
+    '''
+    Bytes held by a single LegacyCell, not counting objects shared between
+    cells (colors, chars, the neighbor cells themselves)
+    '''
+    size = sys.getsizeof(cell) + sys.getsizeof(cell.__dict__)
+    for value in (cell.la, cell.lo, cell.elevation, cell.resource_density, cell.neighbors):
+        size += sys.getsizeof(value)
+    return size
+
+def bench_memory():
+    '''
+    Compares memory per cell of the old object-per-cell grid against the
+    TerrainStore and its on-demand cell views
+    '''
+    resources = set()
+    for world_width in (180, 1440):
+        game_map = GameMap(world_width, resources, use_cache = False)
+        cells = game_map.world_width*game_map.world_height
+        store_bytes = game_map.terrain.nbytes()
+
+        # A neighbor dict the way get_neighbors used to fill one in, with 8
+        # entries, for the old per-cell cost
+        legacy = LegacyCell(0, 0, world_width, world_width/2, 0.5, 0.0, 'n', WHITE)
+        for i in range(8):
+            legacy.neighbors[LegacyCell(i, 1, world_width, world_width/2, 0.5, 0.0, 'n', WHITE)] = 1
+        legacy_bytes = legacy_cell_size(legacy)
+
+        print 'memory %dx%d: %d bytes/cell before, %.1f bytes/cell after (%.1f MB total), %d bytes per cell view' % (
+            game_map.world_width,
+            game_map.world_height,
+            legacy_bytes,
+            float(store_bytes)/cells,
+            store_bytes/1e6,
+            sys.getsizeof(game_map.grid[0][0])
+        )
+
+class LegacyUnit(object):
+    '''
+    A unit the way they used to be stored, with every field in its own
+    instance dict, for comparison
+    '''
+    def __init__(self, x, y, player):
+        self.x = x
+        self.y = y
+        self.char = '&'
+        self.color = player.color
+        self.name = 'Army'
+        self.owner = player
+        self.movement = 100
+        self.movement_type = 'land'
+        self.order = None
+        self.wait = 5
+        self.supply_cost = 1
+        self.active = False
+        self.uid = 100000
+
+def bench_units(count = 10000):
+    '''
+    Compares memory per unit of the old dict-based units against handles
+    onto the unit store, and times resetting the movement of every unit
+    '''
+    player = Player(1, RED, 'Player 1')
+    legacy = [LegacyUnit(i, i, player) for i in xrange(count)]
+    legacy_bytes = sys.getsizeof(legacy[0]) + sys.getsizeof(legacy[0].__dict__)
+    for value in (legacy[0].x + 1000, legacy[0].uid):
+        legacy_bytes += sys.getsizeof(value)
+
+    store = Unit.store
+    Unit.store = UnitStore()
+    try:
+        armies = set()
+        units = [Army(i, i, armies, player) for i in xrange(count)]
+        store_bytes = float(Unit.store.nbytes())/count
+        print 'units: %d bytes/unit before, %d bytes/unit after (%d handle + %.0f in the store)' % (
+            legacy_bytes, sys.getsizeof(units[0]) + store_bytes, sys.getsizeof(units[0]), store_bytes
+        )
+
+        def legacy_reset():
+            for unit in legacy:
+                unit.movement = 100
+        _, loop_ms = timed(legacy_reset)
+        _, vector_ms = timed(Unit.store.reset_movement, player)
+        print 'units: resetting movement of %d units, %.2f ms one at a time, %.2f ms on the columns' % (
+            count, loop_ms, vector_ms
+        )
+    finally:
+        Unit.store = store
+
+def bench_wake(count = 5000):
+    '''
+    Times check_wake for a player with the given number of units, counting
+    up their movement every call as before, against the running counters
+    '''
+    game = GameObject(180, 2, 20)
+    player = Player(1, RED, 'Player 1')
+    armies = set()
+    for i in xrange(count):
+        Army(i % 180, i % 90, armies, player)
+
+    def legacy_check_wake():
+        moves_left = 0
+        for object in player.owned_objects:
+            moves_left += object.movement
+        return moves_left
+    _, scan_ms = timed(legacy_check_wake)
+    _, counter_ms = timed(game.check_wake, player)
+    print 'wake %d units: check_wake %.2f ms scanning, %.4f ms with counters' % (count, scan_ms, counter_ms)
+    for army in list(armies):
+        army.kill()
+
+def bench_index(count = 20000):
+    '''
+    Times finding whether a cell has a base on it, and composing the objects
+    in a camera view, by scanning every unit as before, against looking them
+    up in a SpatialIndex
+    '''
+    store = Unit.store
+    Unit.store = UnitStore()
+    try:
+        rng = random.Random(1)
+        world_width, world_height = 1440, 720
+        index = SpatialIndex(world_width, world_height)
+        Unit.store.subscribe(index)
+        player = Player(1, RED, 'Player 1')
+        bases = set()
+        for i in xrange(count):
+            Base(rng.randrange(world_width), rng.randrange(world_height), bases, player)
+
+        def legacy_find(x, y):
+            for unit in bases:
+                if x == unit.x and y == unit.y:
+                    return unit
+        _, scan_ms = timed(legacy_find, -1, -1)
+        _, index_ms = timed(index.find, 0, 0, Base)
+        print 'index %d bases: base placement check %.2f ms scanning, %.4f ms indexed' % (count, scan_ms, index_ms)
+
+        view = GameView(180, 90)
+        camera = GameCamera(720, 360, 178, 80)
+        _, scan_ms = timed(view.compose_overlay, camera, bases)
+        _, index_ms = timed(view.compose_overlay, camera, None, index)
+        print 'index %d bases: composing a %dx%d view %.1f ms scanning, %.1f ms indexed' % (
+            count, camera.width, camera.height, scan_ms, index_ms
+        )
+    finally:
+        Unit.store = store
+
+def bench_astar():
+    '''
+    Times cross-map A* searches over the sea graph of a 1440x720 map
+    '''
+    game_map = GameMap(1440, set(), use_cache = False)
+    graph = game_map.sea_graph
+    search, ms = timed(get_search, graph)
+    print 'astar setup: %.0f ms' % ms
+
+    # Pairs of sea cells half the world apart, so every path crosses the map
+    sea = np.flatnonzero(graph.passable)
+    random = np.random.RandomState(0)
+    times = []
+    while len(times) < 20:
+        start = int(random.choice(sea))
+        x, y = graph.coordinates(start)
+        goal = graph.index((x + game_map.world_width/2) % game_map.world_width, random.randint(game_map.world_height))
+        if not graph.passable[goal]:
+            continue
+        path, ms = timed(search.search, start, goal)
+        if path is not None:
+            times.append(ms)
+            print 'astar %s -> %s: %d steps, %d cells expanded, %.1f ms' % (
+                (x, y), graph.coordinates(goal), len(path), search.expanded, ms
+            )
+    print 'astar median: %.1f ms' % np.median(times)
+
+def bench_supply():
+    '''
+    Times building per-player distance fields from scratch, and updating them
+    incrementally as bases are built and lost
+    '''
+    random = np.random.RandomState(0)
+    for world_width in (180, 720):
+        game_map = GameMap(world_width, set(), use_cache = False)
+        land = np.flatnonzero(game_map.land_graph.passable)
+        for bases in (5, 50):
+            sources = [int(cell) for cell in random.choice(land, bases)]
+            field, ms = timed(DistanceField, game_map.land_graph, sources)
+            print 'supply %dx%d, %d bases: %.1f ms from scratch' % (
+                game_map.world_width, game_map.world_height, bases, ms
+            )
+            added = int(random.choice(land))
+            _, add_ms = timed(field.add_source, added)
+            _, remove_ms = timed(field.remove_source, added)
+            print 'supply %dx%d, %d bases: %.1f ms to add a base, %.1f ms to remove it' % (
+                game_map.world_width, game_map.world_height, bases, add_ms, remove_ms
+            )
+
+def bench_hpa():
+    '''
+    Compares hierarchical and flat searches over the land graph of a
+    1440x720 map, and times rebuilding after a terrain change
+    '''
+    game_map = GameMap(1440, set(), use_cache = False)
+    graph = game_map.land_graph
+    hierarchy, ms = timed(game_map.get_hierarchy, 'land')
+    print 'hpa build: %.0f ms, %d abstract nodes' % (ms, len(hierarchy.edges))
+
+    land = np.flatnonzero(graph.passable)
+    random = np.random.RandomState(0)
+    search = get_search(graph)
+    for i in range(10):
+        start, goal = [int(cell) for cell in random.choice(land, 2)]
+        path, hpa_ms = timed(hierarchy.search, start, goal)
+        flat_path, flat_ms = timed(search.search, start, goal)
+        if path is None:
+            print 'hpa %d -> %d: no path, %.1f ms, flat %.1f ms' % (start, goal, hpa_ms, flat_ms)
+        else:
+            print 'hpa %d -> %d: %.1f ms, %d steps, flat %.1f ms, %d steps' % (
+                start, goal, hpa_ms, len(path), flat_ms, len(flat_path)
+            )
+
+    x, y = graph.coordinates(int(land[0]))
+    _, ms = timed(game_map.set_elevation, x, y, -0.5)
+    print 'hpa terrain change: %.0f ms, including rebuilding the flat graphs' % ms
+
+def legacy_draw_map(view, gamemap, camera):
+    '''
+    The way GameView used to draw the map: two calls per cell, every frame
+    '''
+    for x in range(camera.width):
+        for y in range(camera.height):
+            pos_x, pos_y = view.camera_to_cartesian(x, y, camera)
+            if pos_y < 0 or pos_y >= gamemap.world_height:
+                libtcod.console_put_char(view.console, x, y, ' ', libtcod.BKGND_NONE)
+            else:
+                pos_x = pos_x % gamemap.world_width
+                libtcod.console_set_default_foreground(view.console, gamemap.grid[pos_x][pos_y].color)
+                libtcod.console_put_char(view.console, x, y, gamemap.grid[pos_x][pos_y].char, libtcod.BKGND_NONE)
+
+def bench_render():
+    '''
+    Frame times of the game view on a full-screen camera: redrawing the
+    whole map every frame as before, against the retained map layer on a
+    still frame, a cursor blink and a camera pan
+    '''
+    resources = set()
+    game_map = GameMap(180, resources, use_cache = False)
+    width, height = 180, 90
+    camera = GameCamera(0, height/2, width, height)
+    view = GameView(width, height)
+    cursor = Cursor(10, 10)
+    objects = resources | set([cursor])
+
+    times = [timed(legacy_draw_map, view, game_map, camera)[1] for i in range(10)]
+    print 'render before: %.1f ms per frame' % np.median(times)
+
+    view.refresh(game_map, camera, objects)
+    times = [timed(view.refresh, game_map, camera, objects)[1] for i in range(10)]
+    print 'render still frame: %.2f ms, %d cells drawn' % (np.median(times), view.cells_drawn)
+    cursor.char = ' '
+    _, ms = timed(view.refresh, game_map, camera, objects)
+    print 'render cursor blink: %.2f ms, %d cells drawn' % (ms, view.cells_drawn)
+    camera.move(1, 0, game_map.world_height)
+    _, ms = timed(view.refresh, game_map, camera, objects)
+    print 'render camera pan: %.2f ms, %d cells drawn' % (ms, view.cells_drawn)
+
+    _, ms = timed(view.draw_map_cells, game_map, camera, 0, width, 0, height)
+    print 'render full redraw, one cell at a time: %.1f ms' % ms
+    _, ms = timed(view.draw_map, game_map, camera)
+    print 'render full redraw, bulk fill: %.1f ms' % ms
+
+def bench_idle(seconds = 3):
+    '''
+    Processor use of an idle game at 20 FPS, with nothing happening but the
+    cursor blinking: redrawing everything every frame as before, against
+    drawing only the frames the scheduler says have changed. Runs without a
+    window, so only the cost of composing frames is measured.
+    '''
+    resources = set()
+    game_map = GameMap(180, resources, use_cache = False)
+    width, height = 180, 90
+    camera = GameCamera(0, height/2, width, height)
+    view = GameView(width, height)
+    cursor = Cursor(10, 10)
+    objects = resources | set([cursor])
+
+    for name, every_frame in (('before', True), ('after', False)):
+        scheduler = FrameScheduler(20)
+        end = time.time() + seconds
+        while time.time() < end:
+            char = cursor.char
+            cursor.blink()
+            if every_frame or cursor.char != char:
+                scheduler.mark_dirty()
+            if scheduler.should_render():
+                if every_frame:
+                    legacy_draw_map(view, game_map, camera)
+                else:
+                    view.refresh(game_map, camera, objects)
+            scheduler.wait()
+        stats = scheduler.stats()
+        print 'idle %s: %d of %d frames drawn, %.1f%% of a core' % (
+            name, stats['rendered_frames'], stats['frames'], stats['cpu_load']*100
+        )
+
+def bench_seed():
+    '''
+    Times generating a seeded 1440x720 map, then starting a game on the same
+    seed again, which loads the terrain from a scratch terrain cache
+    '''
+    cache = GameMap.TERRAIN_CACHE
+    GameMap.TERRAIN_CACHE = TerrainCache(tempfile.mkdtemp())
+    try:
+        first, generate_ms = timed(GameMap, 1440, set(), 1)
+        second, load_ms = timed(GameMap, 1440, set(), 1)
+        print 'seed 1440x720: %.0f ms to generate, %.0f ms from the cache, identical: %s' % (
+            generate_ms, load_ms, (first.elevation == second.elevation).all()
+        )
+    finally:
+        shutil.rmtree(GameMap.TERRAIN_CACHE.directory)
+        GameMap.TERRAIN_CACHE = cache
+
+def bench_save():
+    '''
+    Times saving and loading a 1440x720 game through the background worker:
+    how long the main thread is held up, against how long the whole job
+    takes on the worker
+    '''
+    directory = tempfile.mkdtemp()
+    try:
+        game_map = GameMap(1440, set(), use_cache = False)
+        game_map.name = directory + '/bench'
+        players = [Player(1, RED, 'Player 1'), Player(2, BLUE, 'Player 2')]
+        bases = set()
+        for i in xrange(200):
+            Base(i*7 % 1440, i*3 % 720, bases, players[i % 2])
+
+        class Game(object):
+            pass
+        game = Game()
+        game.players = players
+        game.active_player = players[0]
+        game.round = 0
+        game.armies, game.fleets, game.bases, game.missiles = set(), set(), bases, set()
+
+        worker = BackgroundWorker(EventQueue())
+        save_log = SaveLog.create(game_map.name + SAVE_LOG_EXTENSION, game_map.name + MAP_FILE_EXTENSION, 0)
+        start = time.time()
+        job = worker.submit(write_save, (save_log, capture_state(game), snapshot_terrain(game_map), True, True))
+        main_ms = (time.time() - start)*1000
+        worker.wait()
+        job.result()
+        print 'save 1440x720: %.1f ms on the main thread, %.0f ms in all' % (main_ms, (time.time() - start)*1000)
+        save_log.close()
+
+        start = time.time()
+        job = worker.submit(read_save, (game_map.name + SAVE_LOG_EXTENSION, 'bench'))
+        worker.wait()
+        total_ms = (time.time() - start)*1000
+        loaded_log, loaded_map, resource_cells, supply_service, state = job.result()
+        def finish_load():
+            loaded_map.spawn_resources(set(), resource_cells)
+            restore_state(game, state)
+        _, main_ms = timed(finish_load)
+        print 'load 1440x720: %.1f ms on the main thread, %.0f ms in all' % (main_ms, total_ms + main_ms)
+        loaded_log.close()
+        worker.close()
+    finally:
+        shutil.rmtree(directory)
+
+def bench_replay(rounds = 500):
+    '''
+    Plays a game of random moves over the given number of rounds, recording
+    a replay log, then times replaying it with the state checked at the end
+    of every round
+    '''
+    directory = tempfile.mkdtemp()
+    try:
+        path = directory + '/bench' + REPLAY_LOG_EXTENSION
+        rng = random.Random(1)
+        game = GameObject(180, 2, 20)
+        game.new_game(1)
+        game.replay_log = ReplayLog(path, 1, 180, 2)
+        cursor = Cursor(0, 0)
+        units = []
+        start = time.time()
+        while game.round < rounds:
+            for i in xrange(3):
+                cursor.x = rng.randrange(game.game_map.world_width)
+                cursor.y = rng.randrange(game.game_map.world_height)
+                game.update_cursor_data(cursor)
+                game.build_base(cursor)
+            x, y = rng.randrange(game.game_map.world_width), rng.randrange(game.game_map.world_height)
+            units.append(game.spawn_unit(rng.choice([Army, Fleet]), x, y, game.active_player))
+            game.order_unit(rng.choice(units), rng.choice(ORDERS[1:]))
+            game.pass_turn()
+        play_ms = (time.time() - start)*1000
+        game.replay_log.close()
+        game.path_service.close()
+
+        replayed = GameObject(180, 2, 20)
+        stats = replay_game(replayed, path)
+        replayed.path_service.close()
+        print 'replay %d rounds: played in %.0f ms, %d actions (%d bytes) replayed in %.0f ms, %d rounds checked' % (
+            rounds, play_ms, stats['actions'], os.path.getsize(path), stats['seconds']*1000, stats['rounds_checked']
+        )
+    finally:
+        shutil.rmtree(directory)
+
+def bench_events(count = 100000, span = 10000):
+    '''
+    Schedules the given number of events at random delays over span frames,
+    then times the frames it takes to run them all, on the EventQueue's
+    timing wheels against a list of events scanned every frame for the ones
+    that are due
+    '''
+    rng = random.Random(1)
+    delays = [rng.randrange(span) for i in xrange(count)]
+    fired = [0]
+    def event():
+        fired[0] += 1
+
+    legacy_queue = []
+    def legacy_add():
+        for delay in delays:
+            legacy_queue.append([delay, event])
+    _, legacy_add_ms = timed(legacy_add)
+    def legacy_tick():
+        due = []
+        for entry in legacy_queue:
+            entry[0] -= 1
+            if entry[0] < 0:
+                due.append(entry)
+        for entry in due:
+            legacy_queue.remove(entry)
+            entry[1]()
+    # Scanning is too slow to run to the end, so only a few frames are timed
+    frames = 20
+    _, legacy_ms = timed(lambda: [legacy_tick() for i in xrange(frames)])
+
+    queue = EventQueue()
+    def add():
+        for delay in delays:
+            queue.add_event(delay, event)
+    _, add_ms = timed(add)
+    fired[0] = 0
+    start = time.time()
+    ticks = 0
+    while len(queue) > 0:
+        queue.tick()
+        ticks += 1
+    wheel_ms = (time.time() - start)*1000
+    print 'events %d over %d frames: scheduling %.0f ms as a list, %.0f ms on wheels' % (count, span, legacy_add_ms, add_ms)
+    print 'events %d over %d frames: %.3f ms a frame scanning a list, %.3f ms a frame on wheels (%d run in %d frames)' % (
+        count, span, legacy_ms/frames, wheel_ms/ticks, fired[0], ticks
+    )
+
+def bench_messages(count = 100000, lines = 9):
+    '''
+    Times passing the given number of messages to an infobar that's been
+    hidden while they piled up, by taking them off the front of a list and
+    inserting them at the top of the infobar's own list as before, against
+    adding them to a MessageLog and catching a reader up; then times adding
+    them with a spill to disk, and scrolling back through all of them
+    '''
+    legacy_queue = []
+    legacy_messages = [['', WHITE]]*(lines + 1)
+    def legacy():
+        for i in xrange(count):
+            legacy_queue.append(('message %d' % i, WHITE))
+        for j in range(0, len(legacy_queue)):
+            legacy_messages.insert(0, legacy_queue.pop(0))
+        del legacy_messages[lines:]
+    _, legacy_ms = timed(legacy)
+
+    message_log = MessageLog()
+    reader = message_log.reader()
+    def add():
+        for i in xrange(count):
+            message_log.add_message('message %d' % i, WHITE)
+        reader.advance()
+    _, log_ms = timed(add)
+    print 'messages %d: %.0f ms through lists, %.0f ms through a ring buffer' % (count, legacy_ms, log_ms)
+
+    directory = tempfile.mkdtemp()
+    try:
+        message_log = MessageLog()
+        message_log.attach_spill(MessageSpill.create(directory + '/bench' + MESSAGE_SPILL_EXTENSION))
+        def add_spilled():
+            for i in xrange(count):
+                if i % 100 == 0:
+                    message_log.set_context(i / 700, i / 100 % 7 + 1)
+                message_log.add_message('message %d' % i, WHITE)
+        _, spill_ms = timed(add_spilled)
+        def scroll_back():
+            for latest in xrange(count - 1, lines, -lines):
+                for i in xrange(lines):
+                    message_log.get(latest - i)
+        _, scroll_ms = timed(scroll_back)
+        _, round_ms = timed(message_log.history, 70, 3)
+        print 'messages %d: %.0f ms with a spill, scrolling back through all of them %.0f ms (%.1f us a page), one turn\'s messages %.2f ms' % (
+            count, spill_ms, scroll_ms, scroll_ms*1000*lines/count, round_ms
+        )
+        message_log.close_spill()
+    finally:
+        shutil.rmtree(directory)
+
+def bench_deaths(count = 20000, radius = 12):
+    '''
+    Times killing every unit within a radius of a point among the given
+    number of units, looking for them unit by unit and taking each out of
+    its sets and the index as before, against kill_in_area's one pass over
+    the unit store and one sweep; then checks the sweep freed the rows for
+    reuse
+    '''
+    store = Unit.store
+    Unit.store = UnitStore()
+    try:
+        game = GameObject(180, 2, 20)
+        game.new_game(1)
+        world_width, world_height = game.game_map.world_width, game.game_map.world_height
+        x, y = world_width/2, world_height/2
+
+        def populate():
+            rng = random.Random(1)
+            for i in xrange(count):
+                game.spawn_unit(Army, rng.randrange(world_width), rng.randrange(world_height), game.players[i % 2])
+
+        def legacy_kill_in_area():
+            killed = []
+            for unit_list in game.persistent_objects:
+                for unit in unit_list:
+                    dx = (unit.x - x) % world_width
+                    dx = min(dx, world_width - dx)
+                    if dx*dx + (unit.y - y)**2 <= radius*radius:
+                        killed.append(unit)
+            for unit in killed:
+                unit.owner.update_movement(unit.movement, 0)
+                unit.owner.owned_objects.remove(unit)
+                unit.unit_list.remove(unit)
+                for listener in Unit.store.listeners:
+                    listener.remove(unit)
+            return killed
+
+        populate()
+        rows = Unit.store.size
+        legacy_killed, legacy_ms = timed(legacy_kill_in_area)
+        # Frees their rows, which the old way never did
+        Unit.store.kill(np.array([unit.id for unit in legacy_killed], dtype=np.intp))
+        game.clear_units()
+        populate()
+        killed, sweep_ms = timed(game.kill_in_area, x, y, radius)
+        print 'deaths %d of %d units: %.1f ms one at a time, %.1f ms in one sweep' % (
+            killed, count, legacy_ms, sweep_ms
+        )
+        print 'deaths: %d store rows in use for the first %d units, %d after killing and replacing them all' % (
+            rows, count, Unit.store.size
+        )
+        game.path_service.close()
+    finally:
+        Unit.store = store
+
+BENCHMARKS = [
+    ('worldgen', bench_worldgen),
+    ('memory', bench_memory),
+    ('units', bench_units),
+    ('index', bench_index),
+    ('wake', bench_wake),
+    ('astar', bench_astar),
+    ('supply', bench_supply),
+    ('hpa', bench_hpa),
+    ('render', bench_render),
+    ('idle', bench_idle),
+    ('seed', bench_seed),
+    ('save', bench_save),
+    ('replay', bench_replay),
+    ('events', bench_events),
+    ('messages', bench_messages),
+    ('deaths', bench_deaths),
+]
+
+def main():
+    names = sys.argv[1:]
+    for name, benchmark in BENCHMARKS:
+        if names == [] or name in names:
+            benchmark()
+
+if __name__ == '__main__':
+    main()
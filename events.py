@@ -0,0 +1,190 @@
+import time
+
+class TimingWheel(object):
+    '''
+    Hierarchical timing wheel: holds entries to come due at a given tick,
+    and hands back the ones due as time advances. Level 0 has a slot for
+    each of the next SLOTS ticks; each level above has a slot for each SLOTS
+    times as long a span, and when the level below comes round to its start
+    again, the entries in the next slot up are moved down into it. Adding an
+    entry and advancing a tick are O(1) amortized, however many entries
+    there are.
+
+    Entries are any object with a when attribute, the tick they're due on.
+    '''
+    SLOT_BITS = 8
+    SLOTS = 1 << SLOT_BITS
+    LEVELS = 4
+
+    def __init__(self):
+        self.now = 0
+        self.wheels = [[[] for i in xrange(self.SLOTS)] for level in xrange(self.LEVELS)]
+        # Entries further off than the top level reaches
+        self.overflow = []
+        # Entries that were already due when they were added
+        self.due = []
+
+    def insert(self, entry):
+        delta = entry.when - self.now
+        if delta <= 0:
+            self.due.append(entry)
+            return
+        for level in xrange(self.LEVELS):
+            if delta < 1 << (self.SLOT_BITS*(level+1)):
+                slot = (entry.when >> (self.SLOT_BITS*level)) & (self.SLOTS-1)
+                self.wheels[level][slot].append(entry)
+                return
+        self.overflow.append(entry)
+
+    def cascade(self, level):
+        '''
+        Moves the entries in the current slot of a level down to the levels
+        below, now that they're close enough
+        '''
+        if level == self.LEVELS:
+            entries, self.overflow = self.overflow, []
+        else:
+            slot = (self.now >> (self.SLOT_BITS*level)) & (self.SLOTS-1)
+            if slot == 0:
+                self.cascade(level+1)
+            entries = self.wheels[level][slot]
+            self.wheels[level][slot] = []
+        for entry in entries:
+            self.insert(entry)
+
+    def advance(self, ticks = 1):
+        '''
+        Moves time on by a number of ticks, returning every entry that's come
+        due
+        '''
+        due, self.due = self.due, []
+        wheel = self.wheels[0]
+        for i in xrange(ticks):
+            self.now += 1
+            slot = self.now & (self.SLOTS-1)
+            if slot == 0:
+                self.cascade(1)
+                # Entries cascaded down on the tick they're due on
+                if self.due:
+                    due.extend(self.due)
+                    self.due = []
+            if wheel[slot]:
+                due.extend(wheel[slot])
+                wheel[slot] = []
+        return due
+
+class EventHandle(object):
+    '''
+    An event on an EventQueue, returned by add_event. Cancelling it stops it
+    from running, or from running again, if it repeats.
+    '''
+    def __init__(self, event, args, when, priority, repeat, milliseconds, sequence):
+        self.event = event
+        self.args = args
+        self.when = when
+        self.priority = priority
+        self.repeat = repeat
+        self.milliseconds = milliseconds
+        self.sequence = sequence
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        if self.args != ():
+            self.event(*self.args)
+        elif self.event != None:
+            self.event()
+
+class EventQueue(object):
+    '''
+    Used to handle function calls that don't need to be immediately executed.
+    Each event has a delay of its own, in frames (ticks) or milliseconds, and
+    every event that's due runs on the next tick, highest priority first,
+    then in the order they were added. Events are kept on timing wheels,
+    one counting frames and one counting milliseconds, so each tick only
+    costs as much as the events that come due on it.
+    '''
+    def __init__(self, clock = time.time):
+        self.frames = TimingWheel()
+        self.milliseconds = TimingWheel()
+        self.clock = clock
+        self.last_time = clock()
+        self.sequence = 0
+        # Events added and not yet run or cancelled, including repeats
+        self.pending = 0
+
+    def __len__(self):
+        return self.pending
+
+    def add_event(self, delay, event, args = (), priority = 0, repeat = None, milliseconds = False):
+        '''
+        Runs event(*args) after delay frames, or after delay milliseconds if
+        milliseconds is set. A delay of 0 runs it on the next tick. With
+        repeat set, it runs again every repeat frames or milliseconds after
+        that, until it's cancelled. Returns an EventHandle.
+        '''
+        wheel = self.milliseconds if milliseconds else self.frames
+        # Frame events come due the tick after their delay runs out
+        when = wheel.now + delay + (0 if milliseconds else 1)
+        handle = EventHandle(event, args, when, priority, repeat, milliseconds, self.sequence)
+        self.sequence += 1
+        self.pending += 1
+        wheel.insert(handle)
+        return handle
+
+    def cancel(self, handle):
+        handle.cancel()
+
+    def tick(self):
+        '''
+        Moves on a frame, and runs every event that's come due since the last
+        tick. Returns the number of events run.
+        '''
+        now = self.clock()
+        elapsed = int((now - self.last_time)*1000)
+        if elapsed > 0:
+            # Whole milliseconds only; the remainder carries over
+            self.last_time += elapsed/1000.0
+        elif elapsed < 0:
+            self.last_time = now
+            elapsed = 0
+        due = self.frames.advance(1) + self.milliseconds.advance(elapsed)
+        if len(due) > 1:
+            due.sort(key = lambda handle: (-handle.priority, handle.sequence))
+        run = 0
+        for handle in due:
+            if handle.cancelled:
+                self.pending -= 1
+                continue
+            handle.run()
+            run += 1
+            if handle.repeat and not handle.cancelled:
+                handle.when += handle.repeat
+                if handle.milliseconds:
+                    self.milliseconds.insert(handle)
+                else:
+                    self.frames.insert(handle)
+            else:
+                self.pending -= 1
+        return run
+
+    def execute_all(self):
+        '''
+        Runs every pending event straight away, whatever its delay, soonest
+        first, and empties the queue. Repeating events only run once.
+        '''
+        handles = []
+        for wheel in (self.frames, self.milliseconds):
+            handles += wheel.due + wheel.overflow
+            for level in wheel.wheels:
+                for slot in level:
+                    handles += slot
+        self.frames = TimingWheel()
+        self.milliseconds = TimingWheel()
+        self.pending = 0
+        handles.sort(key = lambda handle: (handle.when, -handle.priority, handle.sequence))
+        for handle in handles:
+            if not handle.cancelled:
+                handle.run()
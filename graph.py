@@ -0,0 +1,83 @@
+import numpy as np
+from topology import *
+
+class PassabilityGraph(object):
+    '''
+    Movement graph over the cells one kind of unit can enter, stored in
+    compressed sparse row form: the neighbors of the cell with flat index i
+    are indices[indptr[i]:indptr[i+1]], and costs holds the cost of moving
+    to each of them. Cells that can't be entered have no neighbors, and are
+    never anyone's neighbor.
+    '''
+    def __init__(self, kind, world_width, world_height, passable, indptr, indices, costs):
+        self.kind = kind
+        self.world_width = world_width
+        self.world_height = world_height
+        self.passable = passable
+        self.indptr = indptr
+        self.indices = indices
+        self.costs = costs
+        # Search engine over this graph, created by pathfinding on first use
+        self.search = None
+
+    def __len__(self):
+        return self.world_width*self.world_height
+
+    @property
+    def num_edges(self):
+        return len(self.indices)
+
+    def nbytes(self):
+        return self.passable.nbytes + self.indptr.nbytes + self.indices.nbytes + self.costs.nbytes
+
+    def index(self, x, y):
+        return cell_index(x, y, self.world_height)
+
+    def coordinates(self, index):
+        return cell_coordinates(index, self.world_height)
+
+    def is_passable(self, x, y):
+        return bool(self.passable[self.index(x, y)])
+
+    def neighbors(self, index):
+        '''
+        Returns the flat indices of the neighbors of a cell, and the cost of
+        moving to each, as array views
+        '''
+        start, end = self.indptr[index], self.indptr[index+1]
+        return self.indices[start:end], self.costs[start:end]
+
+    def cost(self, current, next_node):
+        '''
+        Cost of moving between two adjacent cells, given as flat indices, or
+        None if the move isn't possible
+        '''
+        indices, costs = self.neighbors(current)
+        match = np.flatnonzero(indices == next_node)
+        if len(match) == 0:
+            return None
+        return float(costs[match[0]])
+
+def build_graph(kind, world_width, world_height, passable, neighbors, neighbor_costs):
+    '''
+    Builds a PassabilityGraph from a flat boolean array of passable cells and
+    the (cells, 8) neighbor array from topology.neighbor_arrays
+    '''
+    edges = passable[:, np.newaxis] & passable[neighbors]
+    indptr = np.zeros(len(passable)+1, dtype=np.int32)
+    np.cumsum(edges.sum(axis=1), out=indptr[1:])
+    indices = neighbors[edges].astype(np.int32)
+    costs = np.broadcast_to(neighbor_costs, neighbors.shape)[edges].astype(np.float32)
+    return PassabilityGraph(kind, world_width, world_height, passable, indptr, indices, costs)
+
+def build_passability_graphs(elevation):
+    '''
+    Builds independent land and sea graphs from an elevation array indexed
+    [x, y]. Land is anything above sea level, sea anything at or below it.
+    '''
+    world_width, world_height = elevation.shape
+    neighbors, neighbor_costs = neighbor_arrays(world_width, world_height)
+    land = np.ascontiguousarray(elevation > 0).ravel()
+    land_graph = build_graph('land', world_width, world_height, land, neighbors, neighbor_costs)
+    sea_graph = build_graph('sea', world_width, world_height, ~land, neighbors, neighbor_costs)
+    return land_graph, sea_graph
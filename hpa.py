@@ -0,0 +1,320 @@
+# Hierarchical pathfinding (HPA*), based on Botea, Mueller & Schaeffer, "Near
+# Optimal Hierarchical Path-Finding" (2004)
+import heapq
+import numpy as np
+from topology import *
+from pathfinding import *
+
+def hierarchical_search(gamemap, start, goal, land_or_sea = 'land'):
+    '''
+    Like a_star_search, but goes through the map's hierarchical pathfinder,
+    which is much faster for long paths on big maps
+    '''
+    graph = gamemap.get_graph(land_or_sea)
+    return gamemap.get_hierarchy(land_or_sea).search(graph.index(*start), graph.index(*goal))
+
+class HierarchicalPathfinder(object):
+    '''
+    Splits the map into square clusters and keeps an abstract graph on top of
+    a PassabilityGraph: wherever a run of passable cells crosses from one
+    cluster to another there's an entrance, with one pair of abstract nodes
+    (one cell on each side), and the abstract nodes inside each cluster are
+    joined by the cost of the cheapest path between them that stays inside
+    the cluster. Long paths are found by searching the abstract graph, then
+    filling in each step with a search confined to a single cluster.
+
+    Entrances are found from the graph's own edges, so clusters on the east
+    and west edges of the map, and clusters on either side of a pole, are
+    joined the same way as any others. Costs are in hundredths, like in
+    pathfinding.py.
+    '''
+    CLUSTER_SIZE = 32
+
+    def __init__(self, graph, cluster_size = CLUSTER_SIZE):
+        self.cluster_size = cluster_size
+        self.world_width = graph.world_width
+        self.world_height = graph.world_height
+        self.clusters_x = -(-self.world_width//cluster_size)
+        self.clusters_y = -(-self.world_height//cluster_size)
+        self.num_clusters = self.clusters_x*self.clusters_y
+
+        x, y = cell_coordinates(np.arange(len(graph), dtype=np.int32), self.world_height)
+        self.cluster_array = ((x//cluster_size)*self.clusters_y + y//cluster_size).astype(np.int32)
+        self.cluster_of = self.cluster_array.tolist()
+
+        # Entrances between each pair of clusters (lower numbered cluster
+        # first), as lists of (cell in first cluster, cell in second, cost)
+        self.entrances = {}
+        # Abstract nodes of each cluster
+        self.nodes = {}
+        # Abstract graph, as node : {neighbor node : cost}
+        self.edges = {}
+
+        self.set_graph(graph)
+        self.rebuild_clusters(range(self.num_clusters))
+
+    def set_graph(self, graph):
+        self.graph = graph
+        search = get_search(graph)
+        self.indptr = search.indptr
+        self.indices = search.indices
+        self.step_costs = search.step_costs
+
+    def find_entrances(self, clusters):
+        '''
+        Works out the entrances between every cluster in clusters and its
+        neighbors, replacing whatever was known about them before
+        '''
+        in_set = np.zeros(self.num_clusters, dtype=bool)
+        in_set[list(clusters)] = True
+        for pair in self.entrances.keys():
+            if in_set[pair[0]] or in_set[pair[1]]:
+                del self.entrances[pair]
+
+        # Every edge of the graph that crosses between clusters, once each
+        counts = np.diff(self.graph.indptr)
+        sources = np.repeat(np.arange(len(self.graph), dtype=np.int32), counts)
+        targets = self.graph.indices
+        source_clusters = self.cluster_array[sources]
+        target_clusters = self.cluster_array[targets]
+        crossing = (source_clusters < target_clusters) & (in_set[source_clusters] | in_set[target_clusters])
+        crossing = np.flatnonzero(crossing)
+
+        edges_by_pair = {}
+        for source, target, cost, pair in zip(
+            sources[crossing].tolist(),
+            targets[crossing].tolist(),
+            (self.graph.costs[crossing]*COST_SCALE).round().astype(np.int32).tolist(),
+            zip(source_clusters[crossing].tolist(), target_clusters[crossing].tolist())
+        ):
+            edges_by_pair.setdefault(pair, []).append((source, target, cost))
+
+        for pair, edges in edges_by_pair.items():
+            self.entrances[pair] = [self.pick_entrance(run) for run in self.entrance_runs(edges)]
+
+    def neighbor_cells(self, cell):
+        return self.indices[self.indptr[cell]:self.indptr[cell+1]]
+
+    def entrance_runs(self, edges):
+        '''
+        Groups the crossing edges between two clusters into runs: edges are
+        in the same run if they start from the same or adjacent cells and end
+        at the same or adjacent cells
+        '''
+        parent = range(len(edges))
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        by_source = {}
+        for i, (source, target, cost) in enumerate(edges):
+            by_source.setdefault(source, []).append(i)
+        for i, (source, target, cost) in enumerate(edges):
+            near_targets = set(self.neighbor_cells(target))
+            near_targets.add(target)
+            for cell in list(self.neighbor_cells(source)) + [source]:
+                for j in by_source.get(cell, ()):
+                    if edges[j][1] in near_targets:
+                        parent[find(j)] = find(i)
+
+        runs = {}
+        for i in xrange(len(edges)):
+            runs.setdefault(find(i), []).append(edges[i])
+        return runs.values()
+
+    def pick_entrance(self, run):
+        '''
+        Picks the edge in the middle of a run to stand for it, preferring
+        straight moves over diagonal ones
+        '''
+        run = sorted(run)
+        straight = [edge for edge in run if edge[2] == ORTHOGONAL_STEP]
+        if straight != []:
+            run = straight
+        return run[len(run)/2]
+
+    def rebuild_clusters(self, clusters):
+        '''
+        Recomputes entrances, abstract nodes and abstract edges for the given
+        clusters, plus any neighboring clusters whose entrances with them
+        changed
+        '''
+        clusters = set(clusters)
+        old_pairs = set(pair for pair in self.entrances if pair[0] in clusters or pair[1] in clusters)
+        self.find_entrances(clusters)
+        new_pairs = set(pair for pair in self.entrances if pair[0] in clusters or pair[1] in clusters)
+        for pair in old_pairs | new_pairs:
+            clusters.update(pair)
+
+        # Drop every abstract node in the clusters being rebuilt, along with
+        # all edges to and from them
+        for cluster in clusters:
+            for node in self.nodes.pop(cluster, ()):
+                for neighbor in self.edges.pop(node, {}):
+                    if neighbor in self.edges:
+                        self.edges[neighbor].pop(node, None)
+
+        for (first, second), entrances in self.entrances.items():
+            if first not in clusters and second not in clusters:
+                continue
+            for source, target, cost in entrances:
+                if first in clusters:
+                    self.nodes.setdefault(first, set()).add(source)
+                if second in clusters:
+                    self.nodes.setdefault(second, set()).add(target)
+                self.edges.setdefault(source, {})[target] = cost
+                self.edges.setdefault(target, {})[source] = cost
+
+        for cluster in clusters:
+            nodes = self.nodes.get(cluster, set())
+            for node in nodes:
+                distance, _ = self.cluster_search(node, cluster)
+                for other in nodes:
+                    if other != node and other in distance:
+                        self.edges[node][other] = distance[other]
+
+    def terrain_changed(self, graph, cells):
+        '''
+        Updates the abstract graph after the terrain of the given cells (flat
+        indices) has changed, rebuilding only the clusters they affect.
+        graph is the updated PassabilityGraph.
+        '''
+        self.set_graph(graph)
+        cells = np.asarray(list(cells), dtype=np.int32)
+        neighbors, _ = neighbor_arrays(self.world_width, self.world_height, cells)
+        touched = np.concatenate([cells, neighbors.ravel()])
+        self.rebuild_clusters(set(self.cluster_array[touched].tolist()))
+
+    def cluster_search(self, start, cluster, goal = None):
+        '''
+        Search from start that never leaves cluster: Dijkstra out to the
+        whole cluster, or A* if a goal is given, stopping once it's reached.
+        Returns dicts of cell : cost and cell : previous cell.
+        '''
+        indptr = self.indptr
+        indices = self.indices
+        step_costs = self.step_costs
+        cluster_of = self.cluster_of
+        world_width = self.world_width
+        world_height = self.world_height
+        if goal is not None:
+            goal_xy = divmod(goal, world_height)
+        distance = {start: 0}
+        came_from = {start: -1}
+        closed = set()
+        frontier = [(0, start)]
+        while frontier:
+            _, current = heapq.heappop(frontier)
+            if current in closed:
+                continue
+            closed.add(current)
+            if current == goal:
+                break
+            current_distance = distance[current]
+            for i in xrange(indptr[current], indptr[current+1]):
+                next_node = indices[i]
+                if cluster_of[next_node] != cluster:
+                    continue
+                new_distance = current_distance + step_costs[i]
+                if next_node not in distance or new_distance < distance[next_node]:
+                    distance[next_node] = new_distance
+                    came_from[next_node] = current
+                    priority = new_distance
+                    if goal is not None:
+                        priority += heuristic(divmod(next_node, world_height), goal_xy, world_width, world_height)
+                    heapq.heappush(frontier, (priority, next_node))
+        return distance, came_from
+
+    def cluster_path(self, start, goal):
+        '''
+        Cheapest path between two cells of the same cluster that stays inside
+        it, as a list of cells, or None
+        '''
+        distance, came_from = self.cluster_search(start, self.cluster_of[start], goal)
+        if goal not in came_from:
+            return None
+        path = []
+        current = goal
+        while current != -1:
+            path.append(current)
+            current = came_from[current]
+        path.reverse()
+        return path
+
+    def search(self, start, goal):
+        '''
+        Finds a path between two flat cell indices. Returns it as an int32
+        array of cell indices, start and goal included, or None if the goal
+        can't be reached. Paths are close to, but not always exactly, the
+        cheapest.
+        '''
+        if not (self.graph.passable[start] and self.graph.passable[goal]):
+            return None
+        if start == goal:
+            return np.array([start], dtype=np.int32)
+
+        start_cluster = self.cluster_of[start]
+        goal_cluster = self.cluster_of[goal]
+        if start_cluster == goal_cluster:
+            path = self.cluster_path(start, goal)
+            if path is not None:
+                return np.array(path, dtype=np.int32)
+
+        # Temporarily join start and goal to the abstract nodes of their
+        # clusters
+        extra_edges = {start: {}, goal: {}}
+        for cell, cluster in ((start, start_cluster), (goal, goal_cluster)):
+            distance, _ = self.cluster_search(cell, cluster)
+            for node in self.nodes.get(cluster, ()):
+                if node in distance:
+                    extra_edges[cell][node] = distance[node]
+                    extra_edges.setdefault(node, {})[cell] = distance[node]
+
+        abstract_path = self.abstract_search(start, goal, extra_edges)
+        if abstract_path is None:
+            return None
+
+        # Fill in each step of the abstract path
+        path = [start]
+        for current, next_node in zip(abstract_path[:-1], abstract_path[1:]):
+            if self.cluster_of[current] != self.cluster_of[next_node]:
+                path.append(next_node)
+            else:
+                path += self.cluster_path(current, next_node)[1:]
+        return np.array(path, dtype=np.int32)
+
+    def abstract_search(self, start, goal, extra_edges):
+        '''
+        A* over the abstract graph plus extra_edges. Returns the list of
+        abstract nodes from start to goal, or None.
+        '''
+        world_width = self.world_width
+        world_height = self.world_height
+        goal_xy = divmod(goal, world_height)
+        edges = self.edges
+        cost_so_far = {start: 0}
+        came_from = {start: None}
+        frontier = [(0, start)]
+        while frontier:
+            _, current = heapq.heappop(frontier)
+            if current == goal:
+                break
+            neighbors = edges.get(current, {}).items() + extra_edges.get(current, {}).items()
+            for next_node, cost in neighbors:
+                new_cost = cost_so_far[current] + cost
+                if next_node not in cost_so_far or new_cost < cost_so_far[next_node]:
+                    cost_so_far[next_node] = new_cost
+                    came_from[next_node] = current
+                    priority = new_cost + heuristic(divmod(next_node, world_height), goal_xy, world_width, world_height)
+                    heapq.heappush(frontier, (priority, next_node))
+        if goal not in came_from:
+            return None
+        path = []
+        current = goal
+        while current is not None:
+            path.append(current)
+            current = came_from[current]
+        path.reverse()
+        return path
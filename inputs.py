@@ -0,0 +1,98 @@
+# The Doryen Library - Documentation:
+# http://roguecentral.org/doryen/data/libtcod/doc/1.5.1/index2.html
+import libtcodpy as libtcod
+
+class KeyboardInput(object):
+    '''
+    Input from the keyboard and window, through libtcod
+    '''
+    def check_for_keypress(self):
+        return libtcod.console_check_for_keypress()
+
+    def wait_for_keypress(self):
+        return libtcod.console_wait_for_keypress(True)
+
+    def is_key_pressed(self, key_code):
+        return libtcod.console_is_key_pressed(key_code)
+
+    def is_window_closed(self):
+        return libtcod.console_is_window_closed()
+
+class ScriptedKey(object):
+    '''
+    Stands in for a libtcod key event: vk is the key code, and c the
+    character code for character keys
+    '''
+    def __init__(self, vk = libtcod.KEY_NONE, c = 0):
+        self.vk = vk
+        self.c = c
+
+class ScriptedInput(object):
+    '''
+    Input read from a script instead of the keyboard, one entry per frame.
+    Entries are key names (see KEY_NAMES) or single characters, or None for
+    a frame with no input. The window counts as closed once the script runs
+    out.
+    '''
+    KEY_NAMES = {
+        'up': libtcod.KEY_UP,
+        'down': libtcod.KEY_DOWN,
+        'left': libtcod.KEY_LEFT,
+        'right': libtcod.KEY_RIGHT,
+        'enter': libtcod.KEY_ENTER,
+        'escape': libtcod.KEY_ESCAPE,
+        'pageup': libtcod.KEY_PAGEUP,
+        'pagedown': libtcod.KEY_PAGEDOWN,
+    }
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.position = 0
+        self.key = ScriptedKey()
+
+    def next_key(self):
+        if self.position < len(self.script):
+            entry = self.script[self.position]
+            self.position += 1
+        else:
+            entry = None
+        if entry == None:
+            self.key = ScriptedKey()
+        elif entry in self.KEY_NAMES:
+            self.key = ScriptedKey(self.KEY_NAMES[entry])
+        else:
+            self.key = ScriptedKey(libtcod.KEY_CHAR, ord(entry))
+        return self.key
+
+    def check_for_keypress(self):
+        return self.next_key()
+
+    def wait_for_keypress(self):
+        # Nothing to wait for; frames without input are skipped instead
+        key = self.next_key()
+        while key.vk == libtcod.KEY_NONE and self.position < len(self.script):
+            key = self.next_key()
+        return key
+
+    def is_key_pressed(self, key_code):
+        return self.key.vk == key_code
+
+    def is_window_closed(self):
+        return self.position >= len(self.script)
+
+def parse_script(text):
+    '''
+    Reads an input script from text, with one entry per line: a key name or
+    character, or 'wait N' for N frames with no input. Blank lines and lines
+    starting with # are ignored.
+    '''
+    script = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line == '' or line.startswith('#'):
+            continue
+        if line.startswith('wait '):
+            script += [None]*int(line.split()[1])
+        else:
+            script.append(line)
+    return script
@@ -1,7 +1,7 @@
 import random
-import shelve
 import os.path
 import math
+import numpy as np
 from decimal import *
 
 # The Doryen Library - Documentation:
@@ -15,6 +15,15 @@ from ui_objects import *
 from mapping import *
 from colors import *
 from player import *
+from supply import *
+from pathservice import *
+from mapfile import *
+from savegame import *
+from background import *
+from replay import *
+from spatial import *
+from events import *
+from messagelog import *
 
 class GameObject(object):
     '''
@@ -22,16 +31,34 @@ class GameObject(object):
     state of the game.
     '''
     BASE_BUILD_COST = 5
+    # Check the players' running unit counters against a full count of
+    # their units every frame; slow, for debugging
+    DEBUG_COUNTERS = False
     
     def __init__(self, mapsize, max_players, cleanup_interval):
     
         # Game map data
         self.mapsize = mapsize
         self.game_map = None
+        # Travel cost from every cell to each player's nearest base
+        self.supply_service = None
+        # Runs path searches for units off the main loop
+        self.path_service = None
+        # Log of saved game states, autosaved to every turn, and the terrain
+        # version last written to the map file
+        self.save_log = None
+        self.saved_terrain_version = None
+        # Log of every action taken since the game started, for replays
+        self.replay_log = None
+        # Units by the cell they're on
+        self.unit_index = None
         
         # Game state control
         self.paused = False
         self.loading = False
+        # Why the last load failed, if it did, for the controller to go back
+        # to the main menu
+        self.load_error = None
         self.active_player = None
         
         # Tracking game elements
@@ -50,7 +77,9 @@ class GameObject(object):
         self.cleanup_interval = cleanup_interval
         self.cleanup_timer = cleanup_interval
         self.event_queue = EventQueue()
-        self.message_queue = MessageQueue()
+        self.message_log = MessageLog()
+        # Writes saves and reads maps off the main thread
+        self.background = BackgroundWorker(self.event_queue)
         
         # Used for tracking and updating UIs
         self.game_uis = []
@@ -67,11 +96,48 @@ class GameObject(object):
         
     def clean_dead_objects(self):
         '''
-        Actual cleanup of objects marked for deletion
+        Actual cleanup of objects marked for deletion. Every unit killed
+        since the last cleanup is swept out of the unit store in one pass
+        (see UnitStore.sweep), then out of the unit lists and the players'
+        objects a whole set at a time, however many died.
         '''
-        for object in self.active_player.owned_objects:
-            if object.char == " " and object.name == "DEAD":
-                self.active_player.owned_objects.remove(object)
+        dead = Unit.store.tombstoned()
+        if len(dead) == 0:
+            return
+        dead = set(dead)
+        # Bases' positions can only be read until they're swept
+        if self.supply_service != None:
+            for base in self.bases & dead:
+                self.supply_service.remove_base(base)
+        Unit.store.sweep()
+        for unit_list in self.persistent_objects + [self.resources]:
+            unit_list -= dead
+        for player in self.players + [no_player]:
+            player.owned_objects -= dead
+            
+    def clear_units(self):
+        '''
+        Kills and sweeps every unit and resource node of the game, so their
+        rows in the unit store, and its players' codes, can be reused
+        '''
+        ids = [unit.id for unit_list in self.persistent_objects + [self.resources] for unit in unit_list]
+        Unit.store.kill(np.array(ids, dtype=np.intp))
+        self.clean_dead_objects()
+        Unit.store.release_players(self.players)
+        
+    def kill_in_area(self, x, y, radius):
+        '''
+        Kills every player's units within radius cells of x, y, found with
+        one pass over the unit store, and sweeps them up straight away.
+        Returns the number of units killed.
+        '''
+        ids = Unit.store.in_area(x, y, radius, self.game_map.world_width, self.players)
+        killed = Unit.store.kill(ids)
+        Unit.position_version += 1
+        if self.replay_log != None:
+            self.replay_log.kill_area(x, y, radius)
+        self.clean_dead_objects()
+        return killed
         
     def update_cursor_cartesian(self, cursor):
        '''
@@ -102,56 +168,108 @@ class GameObject(object):
     def save_map(self, ui):
         '''
         Saves all data associated with the current gamemap and all 
-        persistent objects but not anything to do with the interface)
-        '''
-        savefile = shelve.open(str(self.game_map.name), 'n')
-        savefile['game_map'] = self.game_map
-        savefile['players'] = self.players
-        savefile['active_player'] = self.active_player
-        savefile['armies'] = self.armies
-        savefile['fleets'] = self.fleets
-        savefile['bases'] = self.bases
-        savefile['missiles'] = self.missiles
-        savefile.close()
-        self.event_queue.add_event(0, self.clear_loading, (ui,))
+        persistent objects but not anything to do with the interface). The
+        terrain is in a map file of its own (see mapfile.py), only written
+        again if it's changed, and the game state goes in the save log as a
+        full snapshot (see savegame.py). Only copying the state happens here;
+        the files are written on the background worker, and loading is
+        cleared once they're safely on disk.
+        '''
+        # Units killed since the last cleanup aren't saved
+        self.clean_dead_objects()
+        terrain = None
+        if self.game_map.terrain_version != self.saved_terrain_version:
+            terrain = snapshot_terrain(self.game_map)
+            self.saved_terrain_version = self.game_map.terrain_version
+            # The map file is about to be replaced, which Windows won't
+            # allow while it's still mapped
+            self.game_map.terrain.detach()
+        self.background.submit(
+            write_save, 
+            (self.save_log, capture_state(self), terrain, True, True), 
+            self.finish_save, 
+            (ui,)
+        )
+        
+    def finish_save(self, job, ui):
+        if job.error != None:
+            # Write the terrain again next time, in case that's what failed
+            self.saved_terrain_version = None
+            self.message_log.add_message('Could not save: '+str(job.error[1]))
+        self.clear_loading(ui)
+        
+    def start_save_log(self):
+        '''
+        Starts a save log for a new game, and has the background worker write
+        its terrain to the map file and a snapshot of the starting state
+        '''
+        name = str(self.game_map.name)
+        self.saved_terrain_version = self.game_map.terrain_version
+        self.save_log = SaveLog.create(name + SAVE_LOG_EXTENSION, name + MAP_FILE_EXTENSION, self.game_map.seed)
+        self.background.submit(
+            write_save, 
+            (self.save_log, capture_state(self), snapshot_terrain(self.game_map))
+        )
                 
     def load_map(self, ui, map='map_name'):
         '''
         Loads all saved map data from the specified file, including persistent
-        objects, and updates the UI if necessary
+        objects, and updates the UI if necessary. The files are read on the
+        background worker, with its progress shown on the loading badge, and
+        the game is set up from them in finish_load once they're done.
         '''
         
         if ui.camera == None:
             ui.camera = GameCamera(0, ui.max_camera_height/2, ui.max_camera_width, ui.max_camera_height)
             
-        loadfile = shelve.open(map, 'r')
-        self.game_map = loadfile['gamemap']
-        self.players = loadfile['players']
-        self.active_player = loadfile['active_player']
-        self.armies = loadfile['armies']
-        self.fleets = loadfile['fleets']
-        self.bases = loadfile['bases']
-        self.missiles = loadfile['missiles']
+        self.background.submit(
+            read_save, 
+            (map + SAVE_LOG_EXTENSION, map), 
+            self.finish_load, 
+            (ui,)
+        )
+        
+    def finish_load(self, job, ui):
+        if job.error != None:
+            self.load_error = str(job.error[1])
+            self.message_log.add_message('Could not load: '+self.load_error)
+            self.clear_loading(ui)
+            return
+        # Units of any game already loaded go first
+        self.clear_units()
+        self.save_log, self.game_map, resource_cells, self.supply_service, state = job.result()
+        self.resources = set()
+        self.game_map.spawn_resources(self.resources, resource_cells)
+        self.saved_terrain_version = self.game_map.terrain_version
+        # Units restored from the save are indexed as they're created
+        self.start_unit_index()
+        restore_state(self, state)
         if ui.cursor == None:
             ui.cursor = Cursor(0,0)
             self.interface_objects.add(ui.cursor)
-        loadfile.close()
-        self.event_queue.add_event(0, self.clear_loading, (ui,))
+        self.path_service = PathService(self.game_map, self.event_queue)
+        # Message history carries on from where the saved game left it
+        self.message_log.attach_spill(MessageSpill.open(str(self.game_map.name) + MESSAGE_SPILL_EXTENSION))
+        self.message_log.set_context(self.round, self.active_player.number)
+        self.clear_loading(ui)
         self.game_uis.append(ui)
         for ui in self.game_uis:
             ui.game_object = self
-            ui.infobar.message_queue = self.message_queue
+            ui.infobar.set_message_log(self.message_log)
         
-    def gen_map(self, ui):
+    def gen_map(self, ui, seed = None):
         '''
         Generates a new map, UI objects, and player list in preparation for 
-        a new game.
+        a new game. The map is generated from seed if one is given, or
+        loaded from the terrain cache if it was generated before.
         '''
-        self.armies = set()
-        self.fleets = set()
-        self.bases = set()
-        self.missiles = set()
-        self.game_map = GameMap(self.mapsize, self.resources)
+        self.new_game(seed)
+        self.replay_log = ReplayLog(
+            str(self.game_map.name) + REPLAY_LOG_EXTENSION, 
+            self.game_map.seed, 
+            self.mapsize, 
+            self.max_players
+        )
         ui.cursor = Cursor(0, 0)
         self.interface_objects.add(ui.cursor)
         ui.camera = GameCamera(
@@ -160,18 +278,53 @@ class GameObject(object):
             ui.max_camera_width, 
             ui.max_camera_height
         )
-        self.players = self.create_players(self.max_players)
-        self.active_player = self.players[0]
+        self.start_save_log()
+        self.message_log.attach_spill(MessageSpill.create(str(self.game_map.name) + MESSAGE_SPILL_EXTENSION))
         self.event_queue.add_event(0, self.clear_loading, (ui,))
         self.game_uis.append(ui)
         for ui in self.game_uis:
             ui.game_object = self
-            ui.infobar.message_queue = self.message_queue
-            ui.infobar.message_queue.add_message('Round 1', C_SYS)
-            ui.infobar.message_queue.add_message(
-                'Player 1\'s turn', 
-                self.players[0].color
-            )
+            ui.infobar.set_message_log(self.message_log)
+        self.message_log.add_message('Round 1', C_SYS)
+        self.message_log.add_message(
+            'Player 1\'s turn', 
+            self.players[0].color
+        )
+    
+    def new_game(self, seed = None):
+        '''
+        Sets up the map, players and services for a new game, without
+        touching any UI; gen_map does the rest. Replays start from here.
+        '''
+        self.armies = set()
+        self.fleets = set()
+        self.bases = set()
+        self.missiles = set()
+        self.persistent_objects = [self.armies, self.bases, self.missiles, self.fleets]
+        self.game_map = GameMap(self.mapsize, self.resources, seed)
+        self.start_unit_index()
+        self.supply_service = DistanceFieldService(self.game_map)
+        self.path_service = PathService(self.game_map, self.event_queue)
+        self.players = self.create_players(self.max_players)
+        self.active_player = self.players[0]
+        self.message_log.set_context(self.round, self.active_player.number)
+    
+    def start_unit_index(self):
+        '''
+        Indexes every unit and resource node on the map by cell, and keeps
+        the index up to date from then on
+        '''
+        self.stop_unit_index()
+        self.unit_index = SpatialIndex(self.game_map.world_width, self.game_map.world_height)
+        for unit_list in self.persistent_objects + [self.resources]:
+            for unit in unit_list:
+                self.unit_index.add(unit)
+        Unit.store.subscribe(self.unit_index)
+        
+    def stop_unit_index(self):
+        if self.unit_index != None:
+            Unit.store.unsubscribe(self.unit_index)
+        self.unit_index = None
     
     def unload_map(self, ui):
         '''
@@ -179,7 +332,22 @@ class GameObject(object):
         preparation for exiting the game (but not necessarily the entire 
         program)
         '''
+        self.clear_units()
         self.game_map = None
+        self.supply_service = None
+        self.stop_unit_index()
+        # Saves still being written are finished first
+        self.background.close()
+        if self.save_log != None:
+            self.save_log.close()
+        self.save_log = None
+        if self.replay_log != None:
+            self.replay_log.close()
+        self.replay_log = None
+        self.message_log.close_spill()
+        if self.path_service != None:
+            self.path_service.close()
+        self.path_service = None
         ui.camera = None
         ui.cursor = None
         self.interface_objects = set()
@@ -222,17 +390,30 @@ class GameObject(object):
             # equal to the current player number; no reason to subtract 1
             # then add it again.
             self.active_player = self.players[self.active_player.number]
+            self.message_log.set_context(self.round, self.active_player.number)
         else:
             self.active_player = self.players[0]
             self.round += 1
-            self.message_queue.add_message('Round '+str(self.round+1), WHITE)
+            self.message_log.set_context(self.round, self.active_player.number)
+            self.message_log.add_message('Round '+str(self.round+1), WHITE)
             for player in self.players:
                 player.power_projection += 1
         self.wake_player()
-        self.message_queue.add_message(
+        self.message_log.add_message(
             'Player '+str(self.active_player.number)+'\'s turn', 
             self.active_player.color
         )
+        if self.replay_log != None or self.save_log != None:
+            self.clean_dead_objects()
+            state = capture_state(self)
+        self.message_log.flush()
+        if self.replay_log != None:
+            self.replay_log.pass_turn()
+            if self.active_player == self.players[0]:
+                self.replay_log.round_hash(state)
+        # Autosave: a small delta on top of the last recorded state
+        if self.save_log != None:
+            self.background.submit(write_save, (self.save_log, state))
             
     def  cycle(self):
         '''
@@ -241,45 +422,71 @@ class GameObject(object):
         if self.game_map != None:
             self.run_cleanup()
             self.check_wake(self.active_player)
+            self.supply_service.update()
+            self.path_service.deliver()
+        self.background.deliver()
             
         self.event_queue.tick()
         
+    def request_paths(self, requests, callback = None):
+        '''
+        Finds paths for a batch of (unit, goal) pairs in the background; see
+        PathService.submit. callback is called with the list of PathFutures
+        from the event queue once they're all done.
+        '''
+        return self.path_service.submit(requests, callback)
+        
     def build_base(self, cursor):
         '''
         Spawns a base at cursor x, y, if player has enough power projection
-        and action points left (and the location is valid).
+        and action points left (and the location is valid). Returns the base,
+        or None if none was built.
         '''
-        # Check for valid location
+        # Check for valid location, with at most one base to a cell
         if self.game_map.grid[cursor.x][cursor.y].elevation > 0:
-            if len(self.bases) > 0:
-                for unit in self.bases:
-                    if cursor.x == unit.x and cursor.y == unit.y:
-                        return
-                else:
-                    # Check for sufficient power projection and actions
-                    if self.active_player.actions > 0 and self.active_player.power_projection >= self.BASE_BUILD_COST:
-                        self.active_player.actions -= 1
-                        self.active_player.power_projection -= self.BASE_BUILD_COST
-                        base = Base(cursor.x, cursor.y, self.bases, self.active_player)
-                        self.message_queue.add_message(
-                            'Player '+str(self.active_player.number)+
-                            ' built a base at '+str(cursor.la)+' '+str(cursor.lo)+'.', 
-                            self.active_player.color
-                        )
-            else:
-                if self.active_player.actions > 0 and self.active_player.power_projection >= self.BASE_BUILD_COST:
-                    self.active_player.actions -= 1
-                    self.active_player.power_projection -= self.BASE_BUILD_COST
-                    base = Base(cursor.x, cursor.y, self.bases, self.active_player)
-                    self.message_queue.add_message(
-                        'Player '+str(self.active_player.number)+
-                        ' built a base at '+str(cursor.la)+' '+str(cursor.lo)+'.', 
-                        self.active_player.color
-                    )
+            if self.unit_index.find(cursor.x, cursor.y, Base) != None:
+                return
+            # Check for sufficient power projection and actions
+            if self.active_player.actions > 0 and self.active_player.power_projection >= self.BASE_BUILD_COST:
+                self.active_player.actions -= 1
+                self.active_player.power_projection -= self.BASE_BUILD_COST
+                base = Base(cursor.x, cursor.y, self.bases, self.active_player)
+                self.supply_service.add_base(base)
+                self.message_log.add_message(
+                    'Player '+str(self.active_player.number)+
+                    ' built a base at '+str(cursor.la)+' '+str(cursor.lo)+'.', 
+                    self.active_player.color
+                )
+                if self.replay_log != None:
+                    self.replay_log.build_base(base)
+                return base
+                
+    def spawn_unit(self, unit_class, x, y, player):
+        '''
+        Puts a new unit of the given class on the map for a player, such as
+        an Army or Fleet, and returns it
+        '''
+        unit_lists = {Army: self.armies, Fleet: self.fleets, Base: self.bases}
+        unit = unit_class(x, y, unit_lists.get(unit_class, self.missiles), player)
+        if unit_class == Base:
+            self.supply_service.add_base(unit)
+        if self.replay_log != None:
+            self.replay_log.spawn(unit)
+        return unit
+        
+    def order_unit(self, unit, order):
+        '''
+        Gives a unit an order: 'attack', 'defend', 'support', 'move', 'hold'
+        or 'wait'
+        '''
+        unit.set_order(order)
+        if self.replay_log != None:
+            self.replay_log.order(unit, order)
                 
     def clear_loading(self, ui):
         self.loading = False
         ui.loading = False
+        ui.loading_progress = None
         
     def check_wake(self, player):
         '''
@@ -288,79 +495,35 @@ class GameObject(object):
         automatically via the action key. The turn can always be passed 
         manually as well.
         '''
-        moves_left = 0
-        if player.owned_objects != []:
-            for object in player.owned_objects:
-                moves_left += object.movement
+        if self.DEBUG_COUNTERS:
+            self.check_counters(player)
+        moves_left = player.movement_left
         if player.actions > 0:
             if player.power_projection >= self.BASE_BUILD_COST or player.supply > player.supply_used:
                 moves_left += player.actions
         if moves_left <= 0:
             player.wake = False
             
+    def check_counters(self, player):
+        '''
+        Checks a player's unit counters against a full count of their units,
+        raising AssertionError if they've drifted
+        '''
+        counted = player.count_units()
+        if counted != (player.movement_left, player.idle_units):
+            raise AssertionError(
+                'Player '+str(player.number)+' counters are '+
+                str((player.movement_left, player.idle_units))+
+                ', but counting gives '+str(counted)
+            )
+            
     def wake_player(self):
         '''
-        Used to wake the active player at the start of their turn.
+        Used to wake the active player at the start of their turn, with their
+        actions and their units' movement back to full.
         '''
         self.active_player.wake = True
         self.active_player.actions = self.active_player.MAX_ACTIONS
-
-class EventQueue(object):
-    '''
-    Used to handle function calls that don't need to be immediately executed.
-    '''
-    def __init__(self):
-        self.queue = []
-        self.delay = 0
-        
-    def add_event(self, delay, event, args = ()):
-        self.queue.append([event, args])
-        self.add_delay(delay)
-        
-    def execute_event(self):
-        if self.queue != []:
-            function, args = self.queue[0]
-            if args != ():
-                function(*args)
-            elif function != None:
-                function()
-            self.queue.pop(0)
-        else:
-            pass
-        
-    def execute_all(self):
-        if self.queue != False:
-            for function, args in self.queue:
-                if args != ():
-                    function(args)
-                else:
-                    function()
-            self.queue = []
-                
-    def add_delay(self, i):
-        self.delay = i
-        
-    def tick(self):
-        if self.delay == 0:
-            self.execute_event()
-        elif self.delay > 0:
-            self.delay -= 1
-        
-class MessageQueue(object):
-    '''
-    Messages are passed to the MessageQueue, which stores them and passes them
-    to the infobar to be displayed. Each message is stored with a color (uses
-    default message color unless specified otherwise) in which it is displayed.
-    '''
-    def __init__(self):
-        self.queue = []
-        
-    def add_message(self, text, color = C_SYS):
-        self.queue.append((text, color))
-    
-    def retrieve_latest(self):
-        message = self.queue.pop(0)
-        return message
-        
-    def clear_queue(self):
-        self.queue = []
\ No newline at end of file
+        Unit.store.reset_movement(self.active_player)
+        self.active_player.movement_left, self.active_player.idle_units = \
+            Unit.store.movement_counters(self.active_player)
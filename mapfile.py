@@ -0,0 +1,203 @@
+import os
+import mmap
+import struct
+import numpy as np
+
+# The Doryen Library - Documentation:
+# http://roguecentral.org/doryen/data/libtcod/doc/1.5.1/index2.html
+import libtcodpy as libtcod
+from terrain import *
+from worldgen import *
+from mapping import *
+
+# Binary map files hold the terrain of a GameMap as raw arrays, so they can
+# be memory-mapped and used in place instead of unpickled. A map file is:
+#
+#   header          HEADER_FORMAT, starting with MAP_MAGIC and the version
+#   palette         palette size * 3 bytes, r, g, b per color
+#   array table     one ARRAY_FORMAT entry per array
+#   arrays          raw contiguous arrays, indexed [x, y], each starting on
+#                   a multiple of ARRAY_ALIGNMENT bytes
+#
+# All numbers are little-endian.
+MAP_MAGIC = 'TGOMAP\x00\x00'
+MAP_FILE_EXTENSION = '.map'
+MAP_FORMAT_VERSION = 1
+# Magic, format version, world width, world height, seed, terrain version,
+# palette size, number of arrays
+HEADER_FORMAT = '<8sHIIqIHH'
+# Array name, dtype, offset from the start of the file, and size in bytes
+ARRAY_FORMAT = '<16s8sQQ'
+ARRAY_ALIGNMENT = 64
+MAP_ARRAYS = ('elevation', 'resource_density', 'glyphs', 'color_index')
+
+class MapFileError(Exception):
+    '''
+    Raised for files that aren't map files, or are from an unknown version
+    of the format
+    '''
+    pass
+
+def align(offset):
+    return -(-offset//ARRAY_ALIGNMENT)*ARRAY_ALIGNMENT
+
+def snapshot_terrain(game_map, copy = True):
+    '''
+    Takes what save_map_file needs from a GameMap, as a dict. With copy set,
+    the arrays are copies, so the snapshot can be written out on another
+    thread while the game carries on changing the map.
+    '''
+    terrain = game_map.terrain
+    arrays = terrain.arrays()
+    if copy:
+        arrays = dict((name, arrays[name].copy()) for name in MAP_ARRAYS)
+    return {
+        'world_width': game_map.world_width,
+        'world_height': game_map.world_height,
+        'seed': game_map.seed,
+        'terrain_version': game_map.terrain_version,
+        'palette': terrain.palette_array().astype(np.uint8),
+        'arrays': arrays,
+    }
+
+def save_map_file(game_map, path):
+    '''
+    Writes the terrain of a GameMap to a binary map file
+    '''
+    write_map_file(snapshot_terrain(game_map, False), path)
+
+def write_map_file(snapshot, path, sync = False):
+    '''
+    Writes a snapshot_terrain snapshot to a binary map file. The file is
+    written under a temporary name first, so an interrupted save never leaves
+    a half-written map behind. With sync set, the file is flushed to disk
+    before it replaces the old one.
+    '''
+    arrays = snapshot['arrays']
+    palette = snapshot['palette']
+
+    header_size = struct.calcsize(HEADER_FORMAT) + palette.nbytes + struct.calcsize(ARRAY_FORMAT)*len(MAP_ARRAYS)
+    table = []
+    offset = align(header_size)
+    for name in MAP_ARRAYS:
+        array = arrays[name]
+        table.append(struct.pack(ARRAY_FORMAT, name, array.dtype.str, offset, array.nbytes))
+        offset = align(offset + array.nbytes)
+
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as map_file:
+        map_file.write(struct.pack(
+            HEADER_FORMAT,
+            MAP_MAGIC,
+            MAP_FORMAT_VERSION,
+            snapshot['world_width'],
+            snapshot['world_height'],
+            snapshot['seed'],
+            snapshot['terrain_version'],
+            len(palette),
+            len(MAP_ARRAYS)
+        ))
+        map_file.write(palette.tostring())
+        map_file.write(''.join(table))
+        for name in MAP_ARRAYS:
+            map_file.seek(align(map_file.tell()))
+            map_file.write(np.ascontiguousarray(arrays[name]).tostring())
+        if sync:
+            map_file.flush()
+            os.fsync(map_file.fileno())
+    # Windows can't rename over an existing file, nor remove one that's
+    # still mapped, so a GameMap loaded from path has to be detached from it
+    # first (see TerrainStore.detach)
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(temporary_path, path)
+
+def read_map_arrays(path):
+    '''
+    Memory-maps a map file. Returns its header fields as a dict, the palette
+    as a list of colors, and the arrays by name, as numpy views straight
+    onto the mapped file. The mapping is copy-on-write: the arrays can be
+    changed, but changes never reach the file.
+    '''
+    with open(path, 'rb') as map_file:
+        data = mmap.mmap(map_file.fileno(), 0, access = mmap.ACCESS_COPY)
+
+    header_size = struct.calcsize(HEADER_FORMAT)
+    if len(data) < header_size:
+        raise MapFileError(path + ' is not a map file')
+    magic, version, world_width, world_height, seed, terrain_version, palette_size, array_count = \
+        struct.unpack_from(HEADER_FORMAT, data)
+    if magic != MAP_MAGIC:
+        raise MapFileError(path + ' is not a map file')
+    if version != MAP_FORMAT_VERSION:
+        raise MapFileError(path + ' is map format version ' + str(version) + ', expected ' + str(MAP_FORMAT_VERSION))
+
+    offset = header_size
+    rgb = np.frombuffer(data, dtype=np.uint8, count=palette_size*3, offset=offset).reshape(palette_size, 3)
+    palette = [libtcod.Color(int(r), int(g), int(b)) for r, g, b in rgb]
+    offset += palette_size*3
+
+    arrays = {}
+    for i in range(array_count):
+        name, dtype, array_offset, nbytes = struct.unpack_from(ARRAY_FORMAT, data, offset)
+        offset += struct.calcsize(ARRAY_FORMAT)
+        dtype = np.dtype(dtype.rstrip('\x00'))
+        if array_offset + nbytes > len(data) or nbytes != world_width*world_height*dtype.itemsize:
+            raise MapFileError(path + ' is truncated or damaged')
+        arrays[name.rstrip('\x00')] = np.frombuffer(
+            data,
+            dtype=dtype,
+            count=nbytes//dtype.itemsize,
+            offset=array_offset
+        ).reshape(world_width, world_height)
+    for name in MAP_ARRAYS:
+        if name not in arrays:
+            raise MapFileError(path + ' has no ' + name + ' array')
+
+    header = {
+        'version': version,
+        'world_width': world_width,
+        'world_height': world_height,
+        'seed': seed,
+        'terrain_version': terrain_version,
+    }
+    return header, palette, arrays
+
+def page_in(arrays, progress, chunk_columns = 64):
+    '''
+    Reads every page of a set of memory-mapped arrays, a block of columns at
+    a time, calling progress(fraction) after each block
+    '''
+    total = sum(array.shape[0] for array in arrays) or 1
+    done = 0
+    for array in arrays:
+        for x in xrange(0, array.shape[0], chunk_columns):
+            array[x:x+chunk_columns].max()
+            done += len(array[x:x+chunk_columns])
+            progress(float(done)/total)
+
+def load_map_file(path, resources, name = 'map_name', progress = None):
+    '''
+    Loads a GameMap from a binary map file, spawning its resource nodes
+    into resources, unless it's None. The terrain arrays stay on the mapped
+    file rather than being read into memory up front, unless progress is
+    given: then they're read in as they would be on first use, a block at a
+    time, with progress(fraction) called along the way. That's for loading
+    on a background thread, where it saves the main thread from stalling on
+    page faults later.
+    '''
+    header, palette, arrays = read_map_arrays(path)
+    if progress != None:
+        page_in([arrays[array_name] for array_name in MAP_ARRAYS], progress)
+    terrain = TerrainStore(
+        header['world_width'],
+        header['world_height'],
+        arrays['elevation'],
+        arrays['resource_density'],
+        grid_latitudes(header['world_height']),
+        grid_longitudes(header['world_width']),
+        arrays['glyphs'],
+        arrays['color_index'],
+        palette
+    )
+    return GameMap.from_terrain(terrain, resources, header['seed'], name, header['terrain_version'])
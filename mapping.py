@@ -1,8 +1,15 @@
+import random
 import libtcodpy as libtcod
+import numpy as np
 from decimal import Decimal
 from colors import *
 from sphere import *
 from unit import *
+from worldgen import *
+from terrain import *
+from graph import *
+from pathfinding import *
+from hpa import *
 
 # A latitude-longitude grid with height data
 class GameMap(object):
@@ -12,64 +19,229 @@ class GameMap(object):
     # Radius in km; determines distances on the surface
     WORLD_RADIUS = 5000
     
-    def __init__(self, mapsize, resources):
+    # Where generated terrain is cached; see worldgen.TerrainCache
+    TERRAIN_CACHE = TerrainCache()
+    
+    def __init__(self, mapsize, resources, seed = None, use_cache = True):
+        '''
+        Generates a map mapsize cells wide. Maps are generated from a seed,
+        random if none is given, and the same seed and size always give the
+        same terrain. Unless use_cache is False, terrain that's been
+        generated before is loaded from the terrain cache instead.
+        '''
         self.world_width = mapsize
         self.world_height = self.world_width/2
-        self.grid = []
-        self.world_noise = libtcod.noise_new(3)
-        self.resource_noise = libtcod.noise_new(3)
+        if seed == None:
+            seed = random.randint(0, 2**31-1)
+        self.seed = seed
         self.name = 'map_name'
-        for x in xrange(self.world_width):
-            row = []
-            for y in xrange(self.world_height):
-                row.append(GridCoordinate(x, y, self.world_width, self.world_height, self.world_noise, self.resource_noise))
-            self.grid.append(row)
-        libtcod.noise_delete(self.world_noise)
-        libtcod.noise_delete(self.resource_noise)
-        for x in xrange(self.world_width):
-            for y in xrange(self.world_height):
-                self.grid[x][y].neighbors = get_neighbors(self, x, y)
+        # Bumped on every change to the terrain
+        self.terrain_version = 0
+        
+        # Terrain for the whole grid, as arrays indexed [x, y]
+        parameters = self.generation_parameters()
+        cached = None
+        if use_cache:
+            cached = self.TERRAIN_CACHE.load(parameters)
+        if cached != None:
+            terrain = finish_terrain(cached[0], cached[1], GridCoordinate.ELEVATIONS)
+        else:
+            world_noise, resource_noise, rng = new_noise(seed)
+            terrain = generate_terrain(
+                self.world_width, 
+                self.world_height, 
+                world_noise, 
+                resource_noise, 
+                GridCoordinate.LANDMASS_SIZE, 
+                GridCoordinate.DETAIL, 
+                GridCoordinate.RESOURCE_DISTRIBUTION, 
+                GridCoordinate.ELEVATIONS
+            )
+            libtcod.noise_delete(world_noise)
+            libtcod.noise_delete(resource_noise)
+            libtcod.random_delete(rng)
+            if use_cache:
+                self.TERRAIN_CACHE.store(parameters, terrain['elevation'], terrain['resource_density'])
+        self.init_terrain(
+            TerrainStore(
+                self.world_width, 
+                self.world_height, 
+                terrain['elevation'], 
+                terrain['resource_density'], 
+                grid_latitudes(self.world_height), 
+                grid_longitudes(self.world_width), 
+                terrain['glyphs'], 
+                terrain['color_index'], 
+                terrain['palette']
+            ), 
+            resources
+        )
+        
+    @classmethod
+    def from_terrain(cls, terrain, resources, seed, name = 'map_name', terrain_version = 0):
+        '''
+        Makes a map around an existing TerrainStore, e.g. one loaded from a
+        map file, instead of generating one. If resources is None, no
+        resource nodes are spawned; see spawn_resources.
+        '''
+        game_map = cls.__new__(cls)
+        game_map.world_width = terrain.world_width
+        game_map.world_height = terrain.world_height
+        game_map.seed = seed
+        game_map.name = name
+        game_map.terrain_version = terrain_version
+        game_map.init_terrain(terrain, resources)
+        return game_map
+        
+    def init_terrain(self, terrain, resources):
+        '''
+        Sets up everything that depends on the terrain: cell views, resource
+        nodes (unless resources is None) and pathfinding
+        '''
+        self.terrain = terrain
+        
+        # Cells are looked up through lightweight views over the terrain
+        # arrays, created on demand, so existing code can keep doing
+        # grid[x][y].elevation
+        self.grid = TerrainGrid(self)
                 
-        # Spawn resource nodes where the resource density is sufficiently high
-        for x in xrange(self.world_width):
-            for y in xrange(self.world_height):
-                if self.grid[x][y].resource_density > self.RESOURCE_THRESHHOLD:
-                    new_node = ResourceNode(x, y, resources)
-                    print x, y
-        
-        # Pathfinding graph for all land tiles; remove sea tiles and delete
-        # neighbor, cost entry in the neighbors list
-        self.land_graph = self.grid
-        for x in xrange(self.world_width):
-            for y in xrange(self.world_height):
-                cell = self.land_graph[x][y]
-                if cell.elevation >= 0:
-                    cell.neighbors = {}
-                for key in cell.neighbors.copy():
-                    if key.elevation >= 0:
-                        if key in cell.neighbors:
-                            del cell.neighbors[key]
-        
-        # Pathfinding graph for all sea tiles
-        self.sea_graph = self.grid
-        for x in xrange(self.world_width):
-            for y in xrange(self.world_height):
-                cell = self.sea_graph[x][y]
-                if cell.elevation > 0:
-                    cell.neighbors = {}
-                for key in cell.neighbors.copy():
-                    if key.elevation > 0:
-                        if key in cell.neighbors:
-                            del cell.neighbors[key]
+        if resources != None:
+            self.spawn_resources(resources)
+        
+        # Pathfinding graphs for all land tiles and all sea tiles, built the
+        # first time they're needed
+        self.graphs = None
+        self.path_cache = PathCache()
+        # Hierarchical pathfinders for each graph, built the first time
+        # they're needed
+        self.hierarchies = {}
+        
+    def resource_cells(self):
+        '''
+        x, y of every cell where the resource density is sufficiently high
+        for a resource node, as an array of pairs
+        '''
+        return np.argwhere(self.resource_density.astype(np.float64) > self.RESOURCE_THRESHHOLD)
+        
+    def spawn_resources(self, resources, cells = None):
+        '''
+        Spawns resource nodes into resources, at cells if given, or else at
+        resource_cells(). Units can only be created on the main thread, so
+        maps loaded in the background work out the cells there and spawn
+        the nodes later.
+        '''
+        if cells is None:
+            cells = self.resource_cells()
+        for x, y in cells:
+            new_node = ResourceNode(int(x), int(y), resources)
+        
+    def generation_parameters(self):
+        '''
+        Everything the terrain of this map was generated from
+        '''
+        return (
+            self.seed, 
+            self.world_width, 
+            self.world_height, 
+            GridCoordinate.LANDMASS_SIZE, 
+            GridCoordinate.DETAIL, 
+            GridCoordinate.RESOURCE_DISTRIBUTION, 
+            self.RESOURCE_THRESHHOLD
+        )
+        
+    @property
+    def version(self):
+        '''
+        Changes whenever a path found before might no longer be right. Paths
+        only depend on the terrain, since units never block movement, so
+        this is the terrain version.
+        '''
+        return self.terrain_version
+        
+    def set_elevation(self, x, y, elevation):
+        '''
+        Changes the elevation of a single cell, updating its appearance and
+        the pathfinding graphs to match
+        '''
+        self.elevation[x, y] = elevation
+        bands, palette = build_palette(GridCoordinate.ELEVATIONS)
+        glyphs, color_index = classify_elevation(self.elevation[x:x+1, y:y+1], bands)
+        self.glyphs[x, y] = glyphs[0, 0]
+        self.color_index[x, y] = color_index[0, 0]
+        self.graphs = build_passability_graphs(self.elevation)
+        for land_or_sea, hierarchy in self.hierarchies.items():
+            hierarchy.terrain_changed(self.get_graph(land_or_sea), [self.land_graph.index(x, y)])
+        self.terrain_version += 1
+        
+    @property
+    def elevation(self):
+        return self.terrain.elevation
+        
+    @property
+    def resource_density(self):
+        return self.terrain.resource_density
+        
+    @property
+    def latitude(self):
+        return self.terrain.latitude
+        
+    @property
+    def longitude(self):
+        return self.terrain.longitude
+        
+    @property
+    def glyphs(self):
+        return self.terrain.glyphs
+        
+    @property
+    def color_index(self):
+        return self.terrain.color_index
+        
+    @property
+    def palette(self):
+        return self.terrain.palette
                         
+    @property
+    def land_graph(self):
+        if self.graphs == None:
+            self.graphs = build_passability_graphs(self.elevation)
+        return self.graphs[0]
+        
+    @property
+    def sea_graph(self):
+        if self.graphs == None:
+            self.graphs = build_passability_graphs(self.elevation)
+        return self.graphs[1]
+        
+    def get_graph(self, land_or_sea):
+        '''
+        Gets the pathfinding graph for 'land' or 'sea' movement
+        '''
+        if land_or_sea == 'land':
+            return self.land_graph
+        elif land_or_sea == 'sea':
+            return self.sea_graph
+        
+    def get_hierarchy(self, land_or_sea):
+        '''
+        Gets the hierarchical pathfinder for 'land' or 'sea' movement
+        '''
+        if land_or_sea not in self.hierarchies:
+            self.hierarchies[land_or_sea] = HierarchicalPathfinder(self.get_graph(land_or_sea))
+        return self.hierarchies[land_or_sea]
+        
     def get_cost(self, graph, current_node, next_node):
         '''
         Gets the cost to move from the current node to a given neighbor node
         '''
-        return graph[current.x][current.y].neighbors[next_node]
+        return graph.cost(current_node, next_node)
             
 class GridCoordinate(object):
     '''
+    A view of a single cell of the grid. Doesn't hold any terrain data of its
+    own; every attribute is looked up in the GameMap's TerrainStore, so views
+    are cheap to create and throw away.
+    
     Elevation parameters, can be freely altered. Max elevation will affect
     what appears as mountains; min elevation what appears as deep sea.
     LANDMASS_SIZE is actually the radius of the spherical surface used to
@@ -112,41 +284,105 @@ class GridCoordinate(object):
         },
     }
     
-    def __init__(self, x, y, world_width, world_height, world_noise, resource_noise):
-        
+    __slots__ = ('grid', 'x', 'y')
+    
+    def __init__(self, grid, x, y):
+        self.grid = grid
         self.x = x
         self.y = y
-        self.la = ((Decimal(self.y)*180)/Decimal(world_height))-90
-        self.lo = ((Decimal(self.x)*360)/Decimal(world_width))-180
-        self.char = '#'
-        self.color = WHITE
-        self.neighbors = {}
-        
-        # Sampling 3d noise to get the shape of the landmasses
-        x, y, z = spherical_to_cartesian(self.la, self.lo, self.LANDMASS_SIZE)
-        self.elevation = libtcod.noise_get_fbm(world_noise,[
-            float(x),
-            float(y),
-            float(z)
-        ],self.DETAIL)
-        
-        # Sampling 3d noise to find out where to spawn resource nodes
-        x, y, z = spherical_to_cartesian(self.la, self.lo, self.RESOURCE_DISTRIBUTION)
-        if self.elevation > 0:
-            self.resource_density = libtcod.noise_get(resource_noise,[
-                float(x),
-                float(y),
-                float(z)
-        ])
-        else:
-            self.resource_density = 0
         
-        for elev_range, elev_info in self.ELEVATIONS.items():
-            max_, min_ = elev_range
-            if max_ >= self.elevation > min_:
-                self.color = elev_info['color']
-                self.char = elev_info['char']
-    
-    def get_neighbors(self):
+    def __eq__(self, other):
+        return (
+            isinstance(other, GridCoordinate) and 
+            self.x == other.x and 
+            self.y == other.y and 
+            self.grid.game_map is other.grid.game_map
+        )
+        
+    def __ne__(self, other):
+        return not self == other
+        
+    def __hash__(self):
+        return hash((self.x, self.y))
+        
+    @property
+    def elevation(self):
+        return float(self.grid.game_map.terrain.elevation[self.x, self.y])
+        
+    @property
+    def resource_density(self):
+        return float(self.grid.game_map.terrain.resource_density[self.x, self.y])
+        
+    @property
+    def char(self):
+        return chr(self.grid.game_map.terrain.glyphs[self.x, self.y])
+        
+    @property
+    def color(self):
+        terrain = self.grid.game_map.terrain
+        return terrain.palette[terrain.color_index[self.x, self.y]]
+        
+    @property
+    def la(self):
+        return ((Decimal(self.y)*180)/Decimal(self.grid.game_map.world_height))-90
+        
+    @property
+    def lo(self):
+        return ((Decimal(self.x)*360)/Decimal(self.grid.game_map.world_width))-180
+        
+    @property
+    def neighbors(self):
+        '''
+        Neighboring cells and the cost of moving to each, worked out on demand
+        '''
+        neighbors = {}
+        for x, y, cost in cell_neighbors(self.x, self.y, self.grid.world_width, self.grid.world_height):
+            neighbors[GridCoordinate(self.grid, x, y)] = cost
         return neighbors
-
+        
+    def get_neighbors(self):
+        return self.neighbors
+        
+class TerrainGrid(object):
+    '''
+    Stands in for a list of columns of GridCoordinates, so that grid[x][y]
+    gives a view of the cell at x, y.
+    '''
+    def __init__(self, game_map):
+        self.game_map = game_map
+        self.world_width = game_map.world_width
+        self.world_height = game_map.world_height
+        
+    def __len__(self):
+        return self.world_width
+        
+    def __getitem__(self, x):
+        if not -self.world_width <= x < self.world_width:
+            raise IndexError('grid index out of range')
+        return TerrainColumn(self, x % self.world_width)
+        
+    def __iter__(self):
+        for x in xrange(self.world_width):
+            yield TerrainColumn(self, x)
+        
+class TerrainColumn(object):
+    '''
+    A single column of a TerrainGrid
+    '''
+    __slots__ = ('grid', 'x')
+    
+    def __init__(self, grid, x):
+        self.grid = grid
+        self.x = x
+        
+    def __len__(self):
+        return self.grid.world_height
+        
+    def __getitem__(self, y):
+        if not -self.grid.world_height <= y < self.grid.world_height:
+            raise IndexError('grid index out of range')
+        return GridCoordinate(self.grid, self.x, y % self.grid.world_height)
+        
+    def __iter__(self):
+        for y in xrange(self.grid.world_height):
+            yield GridCoordinate(self.grid, self.x, y)
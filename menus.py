@@ -158,41 +158,54 @@ class Infobar(Menu):
         
         self.show = False
         
-        # Where to retrieve messages for display
-        self.message_queue = None
+        # Where to retrieve messages for display, and how far this infobar
+        # has read
+        self.message_log = None
+        self.reader = None
         
-        # Where to store messages being displayed
-        self.messages = []
-        self.max_messages = self.height
-        for i in range(0, self.max_messages):
-            self.messages.append(["", WHITE])
+        # Number of lines of messages shown, and how many messages back from
+        # the latest the bottom line is scrolled
+        self.max_messages = self.height - 1
+        self.scrollback = 0
+        
+    def set_message_log(self, message_log):
+        if self.reader != None:
+            self.reader.close()
+        self.message_log = message_log
+        self.reader = message_log.reader()
+        self.scrollback = 0
 
     def refresh(self):
         super(Infobar, self).refresh()
-        if self.message_queue != None:
+        if self.message_log != None:
             self.update_infobar_text()
-            for i in range(0, len(self.messages)):
-                libtcod.console_set_default_foreground(self.console, self.messages[i][1])
-                libtcod.console_print(self.console, 0, (self.height-2)-i, self.LINE_START + self.messages[i][0])
+            latest = self.message_log.count - 1 - self.scrollback
+            for i in xrange(self.max_messages):
+                message = self.message_log.get(latest - i)
+                if message == None:
+                    break
+                libtcod.console_set_default_foreground(self.console, message[1])
+                libtcod.console_print(self.console, 0, (self.height-2)-i, self.LINE_START + message[0])
         
-    def update_infobar_text(self, step_or_all = 'all'):
+    def update_infobar_text(self):
         '''
-        Takes messages off the front of the message queue and adds them to the
-        front of self.text. Can either do it with one message ('step') or with
-        all messages. Default behavior is all.
+        Catches up with the messages added to the log since the last refresh.
+        Messages are drawn straight from the log, so there's nothing to copy;
+        if the infobar is scrolled back, it stays on the same messages.
         '''
-        queue = self.message_queue.queue
-        if step_or_all == 'all':
-            for i in range(0, len(queue)):
-                message = self.message_queue.retrieve_latest()
-                self.messages.insert(0, message)
-        elif step_or_all == 'step':
-                message = self.message_queue.retrieve_latest()
-                self.messages.insert(0, message)
-        else:
-            print 'Please specify \'step\' or \'all\' for Infobar.update_infobar_text()'
+        new = self.reader.advance()
+        if self.scrollback > 0:
+            self.scroll(new)
+            
+    def scroll(self, i):
+        '''
+        Scrolls back through older messages by i lines, or forward towards
+        the latest if i is negative
+        '''
+        if self.message_log == None:
             return
-        del self.messages[self.max_messages - 1:]
+        furthest = max(0, self.message_log.count - self.message_log.oldest() - self.max_messages)
+        self.scrollback = min(max(self.scrollback + i, 0), furthest)
 
            
 class SideMenu(Menu):
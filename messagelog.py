@@ -0,0 +1,305 @@
+import os.path
+import struct
+
+import libtcodpy as libtcod
+
+from colors import *
+
+# A message spill file holds every message added to a MessageLog, in the
+# order they were added, as records of:
+#
+#   header          MESSAGE_RECORD_FORMAT
+#   text            the message, as many bytes as the header says
+#
+# All numbers are little-endian.
+MESSAGE_SPILL_EXTENSION = '.messages'
+# Round, player number, red, green, blue, length of the text in bytes
+MESSAGE_RECORD_FORMAT = '<IBBBBH'
+MESSAGE_RECORD_SIZE = struct.calcsize(MESSAGE_RECORD_FORMAT)
+
+class MessageSpill(object):
+    '''
+    Full message history of a game, on disk, so messages that have fallen
+    out of a MessageLog can still be read back. Only a little is kept in
+    memory: the offset of every BLOCK-th message, for reading back a
+    message by its sequence number, and the first and last sequence number
+    of the messages from each round and player, for reading back a round.
+    '''
+    BLOCK = 256
+
+    def __init__(self, path, spill_file):
+        self.path = path
+        self.spill_file = spill_file
+        # Number of messages in the file, and its size in bytes
+        self.count = 0
+        self.size = 0
+        self.block_offsets = []
+        # (round, player number) : [first sequence number, last sequence number]
+        self.index = {}
+        # The last block read back, as (block, count when read, messages)
+        self.cached_block = None
+        # Whether the file has been read from since the last write, and so
+        # has to be moved back to the end before the next one
+        self.moved = False
+
+    @classmethod
+    def create(cls, path):
+        return cls(path, open(path, 'w+b'))
+
+    @classmethod
+    def open(cls, path):
+        '''
+        Opens a spill file to carry on adding to it, or creates it if there
+        isn't one. The index is rebuilt by reading through the file, and a
+        record cut off part way through writing is dropped.
+        '''
+        if not os.path.exists(path):
+            return cls.create(path)
+        spill = cls(path, open(path, 'r+b'))
+        data = spill.spill_file.read()
+        offset = 0
+        while offset + MESSAGE_RECORD_SIZE <= len(data):
+            round, player, r, g, b, length = struct.unpack_from(MESSAGE_RECORD_FORMAT, data, offset)
+            if offset + MESSAGE_RECORD_SIZE + length > len(data):
+                break
+            spill.index_message(round, player, offset)
+            offset += MESSAGE_RECORD_SIZE + length
+            spill.size = offset
+        spill.spill_file.truncate(spill.size)
+        spill.moved = True
+        return spill
+
+    def close(self):
+        if self.spill_file != None:
+            self.spill_file.close()
+            self.spill_file = None
+
+    def flush(self):
+        self.spill_file.flush()
+
+    def index_message(self, round, player, offset):
+        if self.count % self.BLOCK == 0:
+            self.block_offsets.append(offset)
+        span = self.index.get((round, player))
+        if span == None:
+            self.index[(round, player)] = [self.count, self.count]
+        else:
+            span[1] = self.count
+        self.count += 1
+
+    def write(self, round, player, text, color):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        self.index_message(round, player, self.size)
+        if self.moved:
+            self.spill_file.seek(self.size)
+            self.moved = False
+        self.spill_file.write(struct.pack(
+            MESSAGE_RECORD_FORMAT, round, player, color.r, color.g, color.b, len(text)
+        ) + text)
+        self.size += MESSAGE_RECORD_SIZE + len(text)
+
+    def read_block(self, block):
+        '''
+        Messages in a block, as a list of (text, color, round, player)
+        '''
+        if self.cached_block != None and self.cached_block[0] == block and self.cached_block[1] == self.count:
+            return self.cached_block[2]
+        start = self.block_offsets[block]
+        if block + 1 < len(self.block_offsets):
+            end = self.block_offsets[block + 1]
+        else:
+            end = self.size
+        self.spill_file.seek(start)
+        self.moved = True
+        data = self.spill_file.read(end - start)
+        messages = []
+        offset = 0
+        while offset < len(data):
+            round, player, r, g, b, length = struct.unpack_from(MESSAGE_RECORD_FORMAT, data, offset)
+            offset += MESSAGE_RECORD_SIZE
+            messages.append((data[offset:offset + length], libtcod.Color(r, g, b), round, player))
+            offset += length
+        self.cached_block = (block, self.count, messages)
+        return messages
+
+    def get(self, sequence):
+        '''
+        Message with the given sequence number, as (text, color, round,
+        player), or None if there's no such message
+        '''
+        if sequence < 0 or sequence >= self.count:
+            return None
+        return self.read_block(sequence / self.BLOCK)[sequence % self.BLOCK]
+
+    def history(self, round, player = None):
+        '''
+        Every message from a round, or only those from while it was a
+        player's turn, as a list of (text, color)
+        '''
+        spans = [
+            span for (span_round, span_player), span in self.index.items()
+            if span_round == round and (player == None or span_player == player)
+        ]
+        if spans == []:
+            return []
+        messages = []
+        for sequence in xrange(min(span[0] for span in spans), max(span[1] for span in spans) + 1):
+            text, color, message_round, message_player = self.get(sequence)
+            if message_round == round and (player == None or message_player == player):
+                messages.append((text, color))
+        return messages
+
+class MessageReader(object):
+    '''
+    Cursor onto a MessageLog, holding the sequence number of the next
+    message it hasn't read. Each reader, like the infobar of each UI, gets
+    every message, however far the others have got.
+    '''
+    def __init__(self, message_log, sequence):
+        self.message_log = message_log
+        self.sequence = sequence
+        # Messages overwritten before this reader got to them
+        self.missed = 0
+
+    def pending(self):
+        return self.message_log.count - self.sequence
+
+    def close(self):
+        '''
+        Stops the log from keeping track of this reader
+        '''
+        if self in self.message_log.readers:
+            self.message_log.readers.remove(self)
+
+    def advance(self):
+        '''
+        Marks every message as read, without reading them. Returns how many
+        there were.
+        '''
+        new = self.pending()
+        self.sequence = self.message_log.count
+        return new
+
+    def read(self):
+        '''
+        Messages added since the last read, as a list of (text, color)
+        '''
+        start = self.message_log.oldest()
+        if self.sequence < start:
+            self.missed += start - self.sequence
+            self.sequence = start
+        messages = [self.message_log.get(sequence) for sequence in xrange(self.sequence, self.message_log.count)]
+        self.sequence = self.message_log.count
+        return messages
+
+class MessageLog(object):
+    '''
+    Messages are passed to the MessageLog, which stores them for the infobar
+    to display. Each message is stored with a color (uses default message
+    color unless specified otherwise) in which it is displayed.
+
+    The log is a ring buffer holding the last CAPACITY messages, so adding a
+    message never allocates or moves any others, and messages are read
+    through MessageReaders rather than being taken off the log. Each message
+    gets the next sequence number as it's added. With a spill attached,
+    every message is also written to disk, stamped with the round and the
+    player whose turn it was (see set_context), and messages too old for
+    the ring are read back from there.
+    '''
+    CAPACITY = 4096
+
+    def __init__(self, capacity = CAPACITY):
+        self.capacity = capacity
+        self.texts = [''] * capacity
+        self.colors = [C_SYS] * capacity
+        # Number of messages ever added, and so the next sequence number
+        self.count = 0
+        # Sequence number of the first message added to the ring
+        self.first = 0
+        # Round and player number new messages are stamped with
+        self.round = 0
+        self.player = 0
+        self.spill = None
+        self.readers = []
+
+    def __len__(self):
+        return self.count - self.start()
+
+    def set_context(self, round, player):
+        self.round = round
+        self.player = player
+
+    def reader(self):
+        '''
+        New MessageReader, starting from the next message added
+        '''
+        reader = MessageReader(self, self.count)
+        self.readers.append(reader)
+        return reader
+
+    def attach_spill(self, spill):
+        '''
+        Writes every message from now on to spill as well. The ring is
+        emptied, and sequence numbers carry on from the last message in the
+        spill, so the whole of its history can be read back.
+        '''
+        self.close_spill()
+        self.spill = spill
+        self.count = self.first = spill.count
+        for reader in self.readers:
+            reader.sequence = self.count
+
+    def close_spill(self):
+        if self.spill != None:
+            self.spill.close()
+        self.spill = None
+
+    def add_message(self, text, color = C_SYS):
+        slot = self.count % self.capacity
+        self.texts[slot] = text
+        self.colors[slot] = color
+        self.count += 1
+        if self.spill != None:
+            self.spill.write(self.round, self.player, text, color)
+
+    def flush(self):
+        if self.spill != None:
+            self.spill.flush()
+
+    def start(self):
+        '''
+        Sequence number of the oldest message still in the ring
+        '''
+        return max(self.first, self.count - self.capacity)
+
+    def oldest(self):
+        '''
+        Sequence number of the oldest message that can be read back
+        '''
+        if self.spill != None:
+            return 0
+        return self.start()
+
+    def get(self, sequence):
+        '''
+        Message with the given sequence number, as (text, color), or None if
+        it's too old to have been kept
+        '''
+        if sequence >= self.count or sequence < 0:
+            return None
+        if sequence >= self.start():
+            slot = sequence % self.capacity
+            return self.texts[slot], self.colors[slot]
+        if self.spill != None:
+            return self.spill.get(sequence)[:2]
+        return None
+
+    def history(self, round, player = None):
+        '''
+        Every message from a round, or from one player's turn in it, as a
+        list of (text, color); see MessageSpill.history. Needs a spill.
+        '''
+        if self.spill == None:
+            return []
+        return self.spill.history(round, player)
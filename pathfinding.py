@@ -1,53 +1,315 @@
 # Implementation of A* pathfinding based on http://www.redblobgames.com/pathfinding/a-star/implementation.html
 import heapq
+from array import array
+from collections import OrderedDict
+import numpy as np
+from topology import *
 
-# Nodes, start, and goal are graph nodes (see mapping.py)
+# Nodes, start, and goal are flat cell indices into a PassabilityGraph (see
+# graph.py and mapping.py)
+
+# During a search, move costs are kept as whole numbers of hundredths, which
+# keeps the usual costs (1 and 1.41) exact and lets the priority queue hold
+# plain ints instead of tuples
+COST_SCALE = 100
+ORTHOGONAL_STEP = int(round(ORTHOGONAL_COST*COST_SCALE))
+DIAGONAL_STEP = int(round(DIAGONAL_COST*COST_SCALE))
 
 def a_star_search(gamemap, start, goal, land_or_sea = 'land'):
-    frontier = PriorityQueue()
-    frontier.put(start, 0)
-    
-    if land_or_sea == 'land':
-        graph = gamemap.land_graph
-    elif land_or_sea == 'sea':
-        graph = gamemap.sea_graph
-        
-    came_from = {} # Dict of node : previous node
-    cost_so_far = {} # Dict of node : cost to get there
-    came_from[start] = None
-    cost_so_far[start] = 0 # And in the eeeeeend it doesn't even maaatter
-    # wait no, that's "come so far"
-    
-    while not frontier.is_empty():
-        current = frontier.get()
-        
-        if current == goal:
-            break
-        
-        for next_node in graph[current.x][current.y].neighbors:
-            new_cost = cost_so_far[current] + gamemap.get_cost(graph, current_node, next_node)
-            if next_node not in cost_so_far or new_cost < cost_so_far[next_node]:
-                cost_so_far[next_node] = new_cost
-                priority = new_cost + heuristic(goal, next_node)
-                frontier.put(next_node, priority)
-                came_from[next_node] = current
-        
-    return came_from, cost_so_far
-    
-class PriorityQueue:
-    def __init__(self):
-        self.elements = []
-        
-    def is_empty(self):
-        return len(self.elements) == 0
-    
-    def put(self, node, priority):
-        heapq.heappush(self.elements, (priority, node))
-        
-    def get_next_node(self):
-        return heapq.heappop(self.elements)[1]
-        
-def heuristic(a, b):
+    '''
+    Searches the land or sea graph of gamemap for the cheapest path between
+    two x, y coordinates. Returns the path as an array of flat cell indices,
+    start and goal included, or None if there isn't one.
+    '''
+    graph = gamemap.get_graph(land_or_sea)
+    return get_search(graph).search(graph.index(*start), graph.index(*goal))
+
+def find_path(gamemap, start, goal, land_or_sea = 'land'):
+    '''
+    Same as a_star_search, but goes through the map's path cache
+    '''
+    return gamemap.path_cache.find_path(gamemap, start, goal, land_or_sea)
+
+def get_search(graph):
+    '''
+    Gets the A* engine for a graph, creating it the first time it's needed
+    '''
+    if graph.search is None:
+        graph.search = AStarSearch(graph)
+    return graph.search
+
+def path_coordinates(path, world_height):
+    '''
+    Turns a path of flat cell indices into a list of x, y coordinates
+    '''
+    x, y = cell_coordinates(path, world_height)
+    return zip(x.tolist(), y.tolist())
+
+def octile_distance(dx, dy):
+    '''
+    Cheapest cost of moving dx, dy cells on an open grid, in hundredths
+    '''
+    if dx > dy:
+        return ORTHOGONAL_STEP*dx + (DIAGONAL_STEP-ORTHOGONAL_STEP)*dy
+    return ORTHOGONAL_STEP*dy + (DIAGONAL_STEP-ORTHOGONAL_STEP)*dx
+
+def heuristic(a, b, world_width, world_height):
+    '''
+    Estimates the cost of moving between cells a and b, given as x, y. Takes
+    the east/west wraparound into account, as well as going over either
+    pole, so it never overestimates. Returns hundredths, like the costs used
+    during a search.
+    '''
     (x1, y1) = a
     (x2, y2) = b
-    return abs(x1 - x2) + abs(y1 - y2)
+    dx = abs(x1 - x2)
+    dx = min(dx, world_width - dx)
+    # Going over a pole lands halfway around the world
+    pole_dx = abs(dx - world_width/2)
+    return min(
+        octile_distance(dx, abs(y1 - y2)),
+        octile_distance(pole_dx, y1 + y2 + 1),
+        octile_distance(pole_dx, 2*world_height - y1 - y2 - 1)
+    )
+
+class AStarSearch(object):
+    '''
+    A* search over the flat cell indices of a PassabilityGraph. The graph is
+    copied into compact arrays once, and the score arrays are allocated once
+    and reused for every search: instead of clearing them, each search gets
+    a new generation number, and entries stamped with an older generation
+    are treated as unset.
+    '''
+    # Searches before the generation stamps have to be wiped and restarted
+    MAX_GENERATION = 2**31-1
+
+    def __init__(self, graph):
+        self.graph = graph
+        self.world_width = graph.world_width
+        self.world_height = graph.world_height
+        size = len(graph)
+
+        self.indptr = array('i', graph.indptr.astype(np.int32).tostring())
+        self.indices = array('i', graph.indices.astype(np.int32).tostring())
+        self.step_costs = array('i', np.rint(graph.costs*COST_SCALE).astype(np.int32).tostring())
+        self.passable = array('b', graph.passable.astype(np.int8).tostring())
+
+        self.g_score = array('i', [0])*size
+        self.came_from = array('i', [-1])*size
+        self.visited = array('i', [0])*size
+        self.closed = array('i', [0])*size
+        self.generation = 0
+
+        # Heap entries are priority << index_bits | cell index
+        self.index_bits = max(1, (size-1).bit_length())
+
+        # Number of cells taken off the frontier during the last search
+        self.expanded = 0
+
+    def next_generation(self):
+        self.generation += 1
+        if self.generation >= self.MAX_GENERATION:
+            size = len(self.graph)
+            self.visited = array('i', [0])*size
+            self.closed = array('i', [0])*size
+            self.generation = 1
+        return self.generation
+
+    def search(self, start, goal):
+        '''
+        Finds the cheapest path between two flat cell indices. Returns it as
+        an int32 array of cell indices, start and goal included, or None if
+        the goal can't be reached.
+        '''
+        if not (self.passable[start] and self.passable[goal]):
+            return None
+        if start == goal:
+            return np.array([start], dtype=np.int32)
+
+        generation = self.next_generation()
+        indptr = self.indptr
+        indices = self.indices
+        step_costs = self.step_costs
+        g_score = self.g_score
+        came_from = self.came_from
+        visited = self.visited
+        closed = self.closed
+        heappush = heapq.heappush
+        heappop = heapq.heappop
+
+        world_width = self.world_width
+        world_height = self.world_height
+        half_width = world_width/2
+        double_height = 2*world_height - 1
+        straight = ORTHOGONAL_STEP
+        extra = DIAGONAL_STEP - ORTHOGONAL_STEP
+        index_bits = self.index_bits
+        mask = (1 << index_bits) - 1
+        goal_x, goal_y = divmod(goal, world_height)
+
+        g_score[start] = 0
+        came_from[start] = -1
+        visited[start] = generation
+        frontier = [start]
+        expanded = 0
+        found = False
+
+        while frontier:
+            current = heappop(frontier) & mask
+            if closed[current] == generation:
+                continue
+            closed[current] = generation
+            expanded += 1
+            if current == goal:
+                found = True
+                break
+
+            current_g = g_score[current]
+            for i in xrange(indptr[current], indptr[current+1]):
+                next_node = indices[i]
+                new_g = current_g + step_costs[i]
+                if visited[next_node] == generation:
+                    if new_g >= g_score[next_node]:
+                        continue
+                else:
+                    visited[next_node] = generation
+                g_score[next_node] = new_g
+                came_from[next_node] = current
+
+                # Same as heuristic(), written out here since this is the
+                # innermost loop of the search
+                x, y = divmod(next_node, world_height)
+                dx = abs(x - goal_x)
+                if dx > half_width:
+                    dx = world_width - dx
+                dy = abs(y - goal_y)
+                h = straight*dx + extra*dy if dx > dy else straight*dy + extra*dx
+                pole_dx = abs(dx - half_width)
+                dy = y + goal_y + 1
+                if straight*dy < h:
+                    h = min(h, straight*pole_dx + extra*dy if pole_dx > dy else straight*dy + extra*pole_dx)
+                dy = double_height - y - goal_y
+                if straight*dy < h:
+                    h = min(h, straight*pole_dx + extra*dy if pole_dx > dy else straight*dy + extra*pole_dx)
+
+                heappush(frontier, ((new_g + h) << index_bits) | next_node)
+
+        self.expanded = expanded
+        if not found:
+            return None
+
+        path = []
+        current = goal
+        while current != -1:
+            path.append(current)
+            current = came_from[current]
+        path.reverse()
+        return np.array(path, dtype=np.int32)
+
+    def path_cost(self, path):
+        '''
+        Total cost of a path found by search, in the graph's own units
+        '''
+        total = 0
+        for current, next_node in zip(path[:-1], path[1:]):
+            total += self.graph.cost(current, next_node)
+        return total
+
+class PathCache(object):
+    '''
+    Least recently used cache of paths found by a_star_search, keyed on
+    graph kind, start and goal, and limited to a total size in bytes. The
+    whole cache is dropped whenever the map's version changes, i.e. when
+    the terrain is edited.
+    '''
+    # Default size limit, in bytes
+    MAX_BYTES = 4*1024*1024
+    # Rough size of a cache entry apart from the path itself: the key tuple
+    # and its ints, and the entry in the ordered dict
+    ENTRY_OVERHEAD = 250
+
+    def __init__(self, max_bytes = MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.version = None
+
+        # Counters for tuning the cache size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def entry_size(self, path):
+        if path is None:
+            return self.ENTRY_OVERHEAD
+        return self.ENTRY_OVERHEAD + path.nbytes
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def check_version(self, version):
+        '''
+        Drops every entry if version doesn't match what they were found with
+        '''
+        if version != self.version:
+            if self.entries:
+                self.invalidations += 1
+            self.clear()
+            self.version = version
+
+    def get(self, key):
+        '''
+        Looks up a path, returning (True, path) on a hit and (False, None) on
+        a miss. Paths that don't exist are cached too, as None.
+        '''
+        if key in self.entries:
+            path = self.entries.pop(key)
+            self.entries[key] = path
+            self.hits += 1
+            return True, path
+        self.misses += 1
+        return False, None
+
+    def put(self, key, path):
+        if key in self.entries:
+            self.nbytes -= self.entry_size(self.entries.pop(key))
+        size = self.entry_size(path)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = path
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last = False)
+            self.nbytes -= self.entry_size(evicted)
+            self.evictions += 1
+
+    def find_path(self, gamemap, start, goal, land_or_sea = 'land'):
+        '''
+        Looks up the path between two x, y coordinates, searching for it
+        with a_star_search if it isn't cached. Returned paths are shared
+        with the cache and must not be modified.
+        '''
+        self.check_version(gamemap.version)
+        key = (land_or_sea, tuple(start), tuple(goal))
+        hit, path = self.get(key)
+        if not hit:
+            path = a_star_search(gamemap, start, goal, land_or_sea)
+            if path is not None:
+                path.setflags(write = False)
+            self.put(key, path)
+        return path
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'bytes': self.nbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
@@ -0,0 +1,270 @@
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+from graph import *
+from pathfinding import *
+
+# Searches run in worker processes, which each see the land and sea graphs
+# through shared memory instead of getting a copy pickled with every request.
+# These are the graphs and search engines of the current worker process.
+worker_graphs = {}
+
+def share_array(values):
+    '''
+    Copies a numpy array into a block of shared memory, returning the
+    shared block along with the dtype and length needed to view it again
+    '''
+    shared = RawArray('b', values.nbytes)
+    np.frombuffer(shared, dtype=np.int8)[:] = values.view(np.int8)
+    return shared, values.dtype.str, len(values)
+
+def view_shared(shared):
+    '''
+    Read-only numpy view of an array shared with share_array
+    '''
+    block, dtype, length = shared
+    values = np.frombuffer(block, dtype=np.dtype(dtype), count=length)
+    values.setflags(write = False)
+    return values
+
+def share_graph(graph):
+    return (
+        graph.kind,
+        graph.world_width,
+        graph.world_height,
+        share_array(graph.passable),
+        share_array(graph.indptr),
+        share_array(graph.indices),
+        share_array(graph.costs),
+    )
+
+def attach_graphs(shared_graphs):
+    '''
+    Worker process initializer: rebuilds the graphs over the shared buffers
+    '''
+    worker_graphs.clear()
+    for kind, world_width, world_height, passable, indptr, indices, costs in shared_graphs:
+        worker_graphs[kind] = PassabilityGraph(
+            kind,
+            world_width,
+            world_height,
+            view_shared(passable),
+            view_shared(indptr),
+            view_shared(indices),
+            view_shared(costs)
+        )
+
+def search_batch(batch):
+    '''
+    Worker process task: runs every (kind, start, goal) search in a batch,
+    start and goal being flat cell indices, and returns the paths in order
+    '''
+    paths = []
+    for kind, start, goal in batch:
+        paths.append(get_search(worker_graphs[kind]).search(start, goal))
+    return paths
+
+def search_paths(game_map, futures):
+    '''
+    Runs the searches for a list of PathFutures on the calling thread
+    '''
+    paths = []
+    for future in futures:
+        graph = game_map.get_graph(future.land_or_sea)
+        paths.append(get_search(graph).search(future.start, future.goal_index))
+    return paths
+
+class PathFuture(object):
+    '''
+    Result of a path request made through a PathService. The path is filled
+    in on the main thread, by PathService.deliver, once the search is done.
+    '''
+    def __init__(self, unit, goal, land_or_sea, start, goal_index):
+        self.unit = unit
+        self.goal = goal
+        self.land_or_sea = land_or_sea
+        self.start = start
+        self.goal_index = goal_index
+        self.finished = False
+        self.path = None
+
+    def done(self):
+        return self.finished
+
+    def result(self):
+        '''
+        The path found, as an array of flat cell indices, or None if there
+        isn't one. Raises ValueError if the search hasn't finished yet.
+        '''
+        if not self.finished:
+            raise ValueError('path search has not finished')
+        return self.path
+
+    def set_result(self, path):
+        self.path = path
+        self.finished = True
+
+class PathService(object):
+    '''
+    Runs batches of path searches on a pool of worker processes, so that
+    moving hundreds of units at the end of a turn doesn't hold up the frame
+    it happens in. Requests go in through submit, which returns a PathFuture
+    for each; deliver, called once a frame from GameObject.cycle, checks for
+    batches that have finished, fills in their futures and passes them on
+    to the event queue. A batch that fails in the pool is searched again on
+    the main thread instead.
+
+    The worker pool is started on first use, and restarted with fresh
+    shared graphs whenever the terrain changes. Searches already running
+    over the old terrain are sent again. With processes = 0, searches run
+    straight away on the calling thread instead.
+    '''
+    # Requests per task sent to a worker
+    BATCH_SIZE = 32
+
+    def __init__(self, game_map, event_queue, processes = None):
+        self.game_map = game_map
+        self.event_queue = event_queue
+        if processes is None:
+            processes = max(1, multiprocessing.cpu_count()-1)
+        self.processes = processes
+        self.pool = None
+        self.terrain_version = None
+        # Batches sent to the pool and not yet delivered, as (futures,
+        # callback, futures still to search, AsyncResult) by batch id
+        self.pending = {}
+        self.next_batch = 0
+
+    def start_pool(self):
+        '''
+        Starts the worker pool over the current graphs, replacing any pool
+        running over older terrain
+        '''
+        self.close()
+        self.terrain_version = self.game_map.terrain_version
+        shared_graphs = [share_graph(self.game_map.land_graph), share_graph(self.game_map.sea_graph)]
+        self.pool = multiprocessing.Pool(self.processes, attach_graphs, (shared_graphs,))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+    def check_terrain(self):
+        '''
+        If the terrain has changed since the pool was started, restarts it and
+        sends every undelivered batch again
+        '''
+        if self.pool is None or self.game_map.terrain_version == self.terrain_version:
+            return
+        self.start_pool()
+        pending = [self.pending[batch_id] for batch_id in sorted(self.pending)]
+        self.pending = {}
+        for futures, callback, missing, result in pending:
+            self.send(futures, callback)
+
+    def make_future(self, unit, goal):
+        land_or_sea = unit.movement_type
+        if land_or_sea is None:
+            raise ValueError(unit.name + ' units can\'t move')
+        graph = self.game_map.get_graph(land_or_sea)
+        start = graph.index(unit.x % graph.world_width, unit.y % graph.world_height)
+        goal_index = graph.index(goal[0] % graph.world_width, goal[1] % graph.world_height)
+        return PathFuture(unit, goal, land_or_sea, start, goal_index)
+
+    def submit(self, requests, callback = None):
+        '''
+        Requests paths for a batch of (unit, goal) pairs, goal being an x, y
+        coordinate, searching over the land or sea graph depending on the
+        unit's movement type. Returns a list of PathFutures in the same
+        order. Paths already in the map's path cache are filled in straight
+        away. Once every path in the batch has been found, callback, if
+        given, is added to the event queue with the list of futures.
+        '''
+        futures = [self.make_future(unit, goal) for unit, goal in requests]
+        cache = self.game_map.path_cache
+        cache.check_version(self.game_map.version)
+        missing = []
+        for future in futures:
+            hit, path = cache.get(self.cache_key(future))
+            if hit:
+                future.set_result(path)
+            else:
+                missing.append(future)
+
+        if missing == []:
+            self.finish(futures, callback)
+        elif self.processes == 0:
+            self.store(missing, search_paths(self.game_map, missing))
+            self.finish(futures, callback)
+        else:
+            self.send(futures, callback)
+        return futures
+
+    def send(self, futures, callback):
+        if self.pool is None:
+            self.start_pool()
+        else:
+            self.check_terrain()
+        batch_id = self.next_batch
+        self.next_batch += 1
+
+        missing = [future for future in futures if not future.done()]
+        tasks = [
+            [(future.land_or_sea, future.start, future.goal_index) for future in missing[i:i+self.BATCH_SIZE]]
+            for i in xrange(0, len(missing), self.BATCH_SIZE)
+        ]
+        # Python 2's map_async has no error callback, so deliver polls the
+        # result instead, to notice batches that failed as well as those
+        # that finished
+        result = self.pool.map_async(search_batch, tasks, chunksize = 1)
+        self.pending[batch_id] = (futures, callback, missing, result)
+
+    def store(self, futures, paths):
+        '''
+        Fills in futures with the paths found for them, and caches the paths
+        '''
+        cache = self.game_map.path_cache
+        cache.check_version(self.game_map.version)
+        for future, path in zip(futures, paths):
+            if path is not None:
+                path.setflags(write = False)
+            future.set_result(path)
+            cache.put(self.cache_key(future), path)
+
+    def finish(self, futures, callback):
+        if callback is not None:
+            self.event_queue.add_event(0, callback, (futures,))
+
+    def cache_key(self, future):
+        graph = self.game_map.get_graph(future.land_or_sea)
+        return (
+            future.land_or_sea,
+            graph.coordinates(future.start),
+            graph.coordinates(future.goal_index)
+        )
+
+    def deliver(self):
+        '''
+        Hands out every batch that's finished since the last call. Returns
+        the number of batches delivered.
+        '''
+        self.check_terrain()
+        delivered = 0
+        for batch_id in sorted(self.pending):
+            futures, callback, missing, result = self.pending[batch_id]
+            if not result.ready():
+                continue
+            del self.pending[batch_id]
+            if result.successful():
+                paths = [path for batch_paths in result.get() for path in batch_paths]
+            else:
+                paths = search_paths(self.game_map, missing)
+            self.store(missing, paths)
+            self.finish(futures, callback)
+            delivered += 1
+        return delivered
+
+    def busy(self):
+        return self.pending != {}
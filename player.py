@@ -21,6 +21,33 @@ class Player:
         self.active = True # active = True at the beginning; if the player did 
         # at least one thing during their turn, or it's the start of the game, 
         # active = True. If for all players active = False, the game ends.
+        # Running totals over the player's units, kept up to date as units
+        # are created, killed and use up movement, so they never need
+        # counting up: total movement left, and number of units with any
+        # movement left
+        self.movement_left = 0
+        self.idle_units = 0
+        
+    def update_movement(self, old, new):
+        '''
+        Updates the unit counters for one of the player's units going from
+        old to new movement; a new unit goes from 0, a dead one to 0
+        '''
+        self.movement_left += new - old
+        self.idle_units += (new > 0) - (old > 0)
+        
+    def count_units(self):
+        '''
+        Works the unit counters out from scratch, the slow way, as
+        (movement_left, idle_units)
+        '''
+        movement_left = 0
+        idle_units = 0
+        for unit in self.owned_objects:
+            movement_left += unit.movement
+            if unit.movement > 0:
+                idle_units += 1
+        return movement_left, idle_units
 
 # Dummy player variable used for unowned objects
 no_player = Player(0, WHITE, 'No Player')
\ No newline at end of file
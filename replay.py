@@ -0,0 +1,209 @@
+import time
+import struct
+import hashlib
+
+from unit import *
+from player import *
+from ui_objects import *
+from savegame import *
+
+# Replay logs record every action that changes the game state, from the
+# start of a game, so the game can be played through again from its world
+# seed without a window. A replay log is:
+#
+#   header          REPLAY_HEADER_FORMAT
+#   records         an action code, then that action's fields; see
+#                   RECORD_FORMATS
+#
+# At the end of every round, a ROUND_HASH record holds a hash of the game
+# state, which a replay checks its own state against. All numbers are
+# little-endian.
+REPLAY_MAGIC = 'TGORPLY\x00'
+REPLAY_FORMAT_VERSION = 1
+REPLAY_LOG_EXTENSION = '.replay'
+# Magic, format version, world seed, map size, number of players
+REPLAY_HEADER_FORMAT = '<8sHqIB'
+
+BUILD_BASE = 1
+PASS_TURN = 2
+ORDER = 3
+SPAWN = 4
+ROUND_HASH = 5
+KILL_AREA = 6
+RECORD_FORMATS = {
+    # x, y, uid of the base built
+    BUILD_BASE: '<BiiI',
+    PASS_TURN: '<B',
+    # Unit uid, order code (see savegame.ORDERS)
+    ORDER: '<BIB',
+    # Unit uid, kind (see savegame.UNIT_KINDS), x, y, owner
+    SPAWN: '<BIBiiB',
+    # Round, state hash
+    ROUND_HASH: '<BI8s',
+    # x, y, radius
+    KILL_AREA: '<Biii',
+}
+
+class ReplayError(Exception):
+    '''
+    Raised for files that aren't replay logs, or are from an unknown version
+    of the format
+    '''
+    pass
+
+class ReplayDesync(Exception):
+    '''
+    Raised when a replay stops matching the game it was recorded from
+    '''
+    pass
+
+def state_hash(state):
+    '''
+    Hash of a state dict, as 8 bytes. Units are hashed without their uids,
+    which depend on how many units the process has made before, and players
+    without their wake flag, which is only a hint to the UI and is worked out
+    again every frame.
+    '''
+    players = dict(
+        (number, fields[:6] + (False,) + fields[7:])
+        for number, fields in state['players'].items()
+    )
+    parts = pack_players(players)
+    for fields in sorted(state['units'].values()):
+        parts.append(struct.pack(UNIT_FORMAT, 0, *fields))
+    parts.append(struct.pack('<IB', state['round'], state['active_player']))
+    return hashlib.sha1(''.join(parts)).digest()[:8]
+
+class ReplayLog(object):
+    '''
+    Replay log being recorded. Records are buffered, and flushed to disk at
+    the end of every turn.
+    '''
+    def __init__(self, path, seed, mapsize, max_players):
+        self.path = path
+        self.seed = seed
+        self.mapsize = mapsize
+        self.max_players = max_players
+        self.log_file = open(path, 'wb')
+        self.log_file.write(struct.pack(
+            REPLAY_HEADER_FORMAT, REPLAY_MAGIC, REPLAY_FORMAT_VERSION, seed, mapsize, max_players
+        ))
+
+    def close(self):
+        if self.log_file != None:
+            self.log_file.close()
+            self.log_file = None
+
+    def write(self, action, *fields):
+        self.log_file.write(struct.pack(RECORD_FORMATS[action], action, *fields))
+
+    def build_base(self, base):
+        self.write(BUILD_BASE, base.x, base.y, base.uid)
+
+    def pass_turn(self):
+        self.write(PASS_TURN)
+        self.log_file.flush()
+
+    def order(self, unit, order):
+        self.write(ORDER, unit.uid, ORDERS.index(order))
+
+    def spawn(self, unit):
+        self.write(SPAWN, unit.uid, UNIT_KINDS.index(type(unit)), unit.x, unit.y, unit.owner.number)
+
+    def kill_area(self, x, y, radius):
+        self.write(KILL_AREA, x, y, radius)
+
+    def round_hash(self, state):
+        self.write(ROUND_HASH, state['round'], state_hash(state))
+        self.log_file.flush()
+
+def read_replay(path):
+    '''
+    Reads a replay log. Returns its header fields as a dict, and its records
+    as a list of tuples, each starting with the action code. A record cut off
+    part way through writing is left out.
+    '''
+    with open(path, 'rb') as replay_file:
+        data = replay_file.read()
+    header_size = struct.calcsize(REPLAY_HEADER_FORMAT)
+    if len(data) < header_size:
+        raise ReplayError(path + ' is not a replay log')
+    magic, version, seed, mapsize, max_players = struct.unpack_from(REPLAY_HEADER_FORMAT, data)
+    if magic != REPLAY_MAGIC:
+        raise ReplayError(path + ' is not a replay log')
+    if version != REPLAY_FORMAT_VERSION:
+        raise ReplayError(path + ' is replay format version ' + str(version) + ', expected ' + str(REPLAY_FORMAT_VERSION))
+
+    sizes = dict((action, struct.calcsize(record_format)) for action, record_format in RECORD_FORMATS.items())
+    records = []
+    offset = header_size
+    while offset < len(data):
+        action = ord(data[offset])
+        if action not in RECORD_FORMATS:
+            raise ReplayError(path + ' has an unknown action ' + str(action) + ' at byte ' + str(offset))
+        if offset + sizes[action] > len(data):
+            break
+        records.append(struct.unpack_from(RECORD_FORMATS[action], data, offset))
+        offset += sizes[action]
+
+    header = {
+        'version': version,
+        'seed': seed,
+        'mapsize': mapsize,
+        'max_players': max_players,
+    }
+    return header, records
+
+def replay_game(game_object, path, check = True):
+    '''
+    Plays a replay log through on a fresh GameObject, as fast as it'll go,
+    with no UI. With check set, the state is checked against the log's hash
+    at the end of every round, raising ReplayDesync if they differ. Returns
+    a dict of statistics about the run.
+    '''
+    header, records = read_replay(path)
+    start = time.time()
+    # The game is played on a world like the one recorded
+    game_object.mapsize = header['mapsize']
+    game_object.max_players = header['max_players']
+    game_object.new_game(header['seed'])
+    # Units by the uid they had when the log was recorded
+    units = {}
+    players = dict((player.number, player) for player in game_object.players)
+    players[no_player.number] = no_player
+    cursor = Cursor(0, 0)
+    rounds_checked = 0
+
+    for record in records:
+        action = record[0]
+        if action == BUILD_BASE:
+            _, cursor.x, cursor.y, uid = record
+            game_object.update_cursor_data(cursor)
+            base = game_object.build_base(cursor)
+            if base == None:
+                raise ReplayDesync('round ' + str(game_object.round+1) + ': no base could be built at ' + str((cursor.x, cursor.y)))
+            units[uid] = base
+        elif action == PASS_TURN:
+            game_object.pass_turn()
+        elif action == ORDER:
+            _, uid, order = record
+            game_object.order_unit(units[uid], ORDERS[order])
+        elif action == SPAWN:
+            _, uid, kind, x, y, owner = record
+            units[uid] = game_object.spawn_unit(UNIT_KINDS[kind], x, y, players[owner])
+        elif action == KILL_AREA:
+            _, x, y, radius = record
+            game_object.kill_in_area(x, y, radius)
+        elif action == ROUND_HASH:
+            _, state_round, digest = record
+            if check:
+                if state_hash(capture_state(game_object)) != digest:
+                    raise ReplayDesync('state differs from the recorded game at the end of round ' + str(state_round))
+                rounds_checked += 1
+
+    return {
+        'actions': len(records),
+        'rounds': game_object.round,
+        'rounds_checked': rounds_checked,
+        'seconds': time.time() - start,
+    }
@@ -0,0 +1,424 @@
+import os
+import struct
+
+# The Doryen Library - Documentation:
+# http://roguecentral.org/doryen/data/libtcod/doc/1.5.1/index2.html
+import libtcodpy as libtcod
+from unit import *
+from player import *
+from mapfile import *
+from supply import *
+
+# Game state is saved separately from the terrain, which is written once to
+# a map file (see mapfile.py). The state goes in an append-only save log:
+#
+#   header          SAVE_HEADER_FORMAT, then the map file path
+#   records         RECORD_FORMAT, then the record's payload
+#
+# A record is either a snapshot of the whole game state or a delta holding
+# only what's changed since the record before it. A delta is appended every
+# time the turn passes, with a fresh snapshot every SNAPSHOT_INTERVAL rounds,
+# so the state as of any turn can be rebuilt from the nearest snapshot
+# before it and the deltas that follow. All numbers are little-endian.
+#
+# In memory, game state is a dict:
+#   'round'           round number
+#   'active_player'   number of the active player
+#   'players'         player number : PLAYER_FIELDS tuple
+#   'units'           unit uid : UNIT_FIELDS tuple
+SAVE_MAGIC = 'TGOSAVE\x00'
+SAVE_FORMAT_VERSION = 1
+SAVE_LOG_EXTENSION = '.save'
+# Magic, format version, world seed, length of the map file path
+SAVE_HEADER_FORMAT = '<8sHqH'
+# Record kind, round, active player, payload length
+RECORD_FORMAT = '<BIBI'
+SNAPSHOT = 1
+DELTA = 2
+
+PLAYER_FIELDS = ('name', 'color', 'power_projection', 'supply', 'supply_used', 'actions', 'wake', 'active')
+# Number, r, g, b, power projection, supply, supply used, actions, wake,
+# active, length of name
+PLAYER_FORMAT = '<BBBBiiihBBB'
+UNIT_FIELDS = ('kind', 'unit_list', 'x', 'y', 'owner', 'movement', 'order')
+# Uid, kind, unit list, x, y, owner, movement, order
+UNIT_FORMAT = '<IBBiiBiB'
+
+# Unit classes and the GameObject sets units are kept in, by the codes
+# they're saved as. Orders are saved as their code in unitstore.ORDERS.
+UNIT_KINDS = [Unit, Base, Army, Fleet]
+UNIT_LISTS = ['armies', 'fleets', 'bases', 'missiles']
+
+class SaveLogError(Exception):
+    '''
+    Raised for files that aren't save logs, or are from an unknown version of
+    the format
+    '''
+    pass
+
+def capture_state(game_object):
+    '''
+    Takes the current game state of a GameObject, as a state dict
+    '''
+    players = {}
+    for player in game_object.players:
+        players[player.number] = (
+            player.name,
+            (player.color.r, player.color.g, player.color.b),
+            player.power_projection,
+            player.supply,
+            player.supply_used,
+            player.actions,
+            player.wake,
+            player.active,
+        )
+    units = {}
+    for list_code, list_name in enumerate(UNIT_LISTS):
+        for unit in getattr(game_object, list_name):
+            units[unit.uid] = (
+                UNIT_KINDS.index(type(unit)) if type(unit) in UNIT_KINDS else 0,
+                list_code,
+                unit.x,
+                unit.y,
+                unit.owner.number,
+                unit.movement,
+                ORDERS.index(unit.order),
+            )
+    return {
+        'round': game_object.round,
+        'active_player': game_object.active_player.number,
+        'players': players,
+        'units': units,
+    }
+
+def restore_state(game_object, state):
+    '''
+    Replaces the players and units of a GameObject with those of a state dict
+    '''
+    players = []
+    by_number = {}
+    for number in sorted(state['players']):
+        name, color, power_projection, supply, supply_used, actions, wake, active = state['players'][number]
+        player = Player(number, libtcod.Color(*color), name)
+        player.power_projection = power_projection
+        player.supply = supply
+        player.supply_used = supply_used
+        player.actions = actions
+        player.wake = wake
+        player.active = active
+        players.append(player)
+        by_number[number] = player
+    by_number[no_player.number] = no_player
+
+    for list_name in UNIT_LISTS:
+        setattr(game_object, list_name, set())
+    for uid in sorted(state['units']):
+        kind, list_code, x, y, owner, movement, order = state['units'][uid]
+        unit_list = getattr(game_object, UNIT_LISTS[list_code])
+        unit = UNIT_KINDS[kind](x, y, unit_list, by_number.get(owner, no_player))
+        unit.uid = uid
+        unit.movement = movement
+        if order != 0:
+            unit.set_order(ORDERS[order])
+        Unit.next_uid = max(Unit.next_uid, uid+1)
+
+    game_object.players = players
+    game_object.round = state['round']
+    game_object.active_player = by_number[state['active_player']]
+    game_object.persistent_objects = [game_object.armies, game_object.bases, game_object.missiles, game_object.fleets]
+
+def pack_players(players):
+    parts = [struct.pack('<H', len(players))]
+    for number, fields in sorted(players.items()):
+        name, color, power_projection, supply, supply_used, actions, wake, active = fields
+        parts.append(struct.pack(
+            PLAYER_FORMAT, number, color[0], color[1], color[2],
+            power_projection, supply, supply_used, actions, wake, active, len(name)
+        ))
+        parts.append(name)
+    return parts
+
+def unpack_players(payload, offset):
+    players = {}
+    count, = struct.unpack_from('<H', payload, offset)
+    offset += 2
+    size = struct.calcsize(PLAYER_FORMAT)
+    for i in range(count):
+        number, r, g, b, power_projection, supply, supply_used, actions, wake, active, name_length = \
+            struct.unpack_from(PLAYER_FORMAT, payload, offset)
+        offset += size
+        name = payload[offset:offset+name_length]
+        offset += name_length
+        players[number] = (name, (r, g, b), power_projection, supply, supply_used, actions, bool(wake), bool(active))
+    return players, offset
+
+def pack_units(units):
+    parts = [struct.pack('<I', len(units))]
+    for uid, fields in sorted(units.items()):
+        parts.append(struct.pack(UNIT_FORMAT, uid, *fields))
+    return parts
+
+def unpack_units(payload, offset):
+    units = {}
+    count, = struct.unpack_from('<I', payload, offset)
+    offset += 4
+    size = struct.calcsize(UNIT_FORMAT)
+    for i in range(count):
+        fields = struct.unpack_from(UNIT_FORMAT, payload, offset)
+        offset += size
+        units[fields[0]] = fields[1:]
+    return units, offset
+
+def encode_snapshot(state):
+    return ''.join(pack_players(state['players']) + pack_units(state['units']))
+
+def decode_snapshot(payload, state_round, active_player):
+    players, offset = unpack_players(payload, 0)
+    units, offset = unpack_units(payload, offset)
+    return {
+        'round': state_round,
+        'active_player': active_player,
+        'players': players,
+        'units': units,
+    }
+
+def encode_delta(old, new):
+    '''
+    Encodes what's changed between two state dicts: players and units that
+    are new or different, followed by the uids of units that are gone
+    '''
+    players = dict(
+        (number, fields) for number, fields in new['players'].items()
+        if old['players'].get(number) != fields
+    )
+    units = dict(
+        (uid, fields) for uid, fields in new['units'].items()
+        if old['units'].get(uid) != fields
+    )
+    removed = [uid for uid in old['units'] if uid not in new['units']]
+    parts = pack_players(players) + pack_units(units)
+    parts.append(struct.pack('<I%dI' % len(removed), len(removed), *removed))
+    return ''.join(parts)
+
+def apply_delta(state, payload, state_round, active_player):
+    '''
+    Returns a new state dict with a delta applied on top of state
+    '''
+    players, offset = unpack_players(payload, 0)
+    units, offset = unpack_units(payload, offset)
+    count, = struct.unpack_from('<I', payload, offset)
+    removed = struct.unpack_from('<%dI' % count, payload, offset+4)
+
+    new_players = dict(state['players'])
+    new_players.update(players)
+    new_units = dict(state['units'])
+    new_units.update(units)
+    for uid in removed:
+        new_units.pop(uid, None)
+    return {
+        'round': state_round,
+        'active_player': active_player,
+        'players': new_players,
+        'units': new_units,
+    }
+
+class SaveLog(object):
+    '''
+    Append-only log of game states for one game, on top of a map file
+    holding its terrain. record appends a delta against the last recorded
+    state, or a snapshot when one is due, and state_at rebuilds the state as
+    of any recorded turn.
+    '''
+    # Rounds between snapshots
+    SNAPSHOT_INTERVAL = 10
+
+    def __init__(self, path, map_file, seed):
+        self.path = path
+        self.map_file = map_file
+        self.seed = seed
+        # (kind, round, active player, payload offset, payload length) for
+        # every record, in order
+        self.records = []
+        # Last state recorded, and the round of the last snapshot
+        self.last_state = None
+        self.last_snapshot_round = None
+        self.log_file = None
+
+    @classmethod
+    def create(cls, path, map_file, seed):
+        '''
+        Starts a new, empty save log, replacing any existing one at path
+        '''
+        save_log = cls(path, map_file, seed)
+        save_log.log_file = open(path, 'w+b')
+        save_log.log_file.write(struct.pack(SAVE_HEADER_FORMAT, SAVE_MAGIC, SAVE_FORMAT_VERSION, seed, len(map_file)))
+        save_log.log_file.write(map_file)
+        save_log.log_file.flush()
+        return save_log
+
+    @classmethod
+    def open(cls, path):
+        '''
+        Opens an existing save log to read from and append to. Only the
+        record headers are read; payloads are read when they're needed.
+        '''
+        log_file = open(path, 'r+b')
+        header_size = struct.calcsize(SAVE_HEADER_FORMAT)
+        header = log_file.read(header_size)
+        if len(header) < header_size:
+            raise SaveLogError(path + ' is not a save log')
+        magic, version, seed, path_length = struct.unpack(SAVE_HEADER_FORMAT, header)
+        if magic != SAVE_MAGIC:
+            raise SaveLogError(path + ' is not a save log')
+        if version != SAVE_FORMAT_VERSION:
+            raise SaveLogError(path + ' is save format version ' + str(version) + ', expected ' + str(SAVE_FORMAT_VERSION))
+        save_log = cls(path, log_file.read(path_length), seed)
+        save_log.log_file = log_file
+
+        record_size = struct.calcsize(RECORD_FORMAT)
+        end = os.fstat(log_file.fileno()).st_size
+        offset = log_file.tell()
+        while offset + record_size <= end:
+            log_file.seek(offset)
+            kind, state_round, active_player, length = struct.unpack(RECORD_FORMAT, log_file.read(record_size))
+            if offset + record_size + length > end:
+                # A record cut off part way through writing is ignored, and
+                # written over by the next one
+                break
+            save_log.records.append((kind, state_round, active_player, offset + record_size, length))
+            if kind == SNAPSHOT:
+                save_log.last_snapshot_round = state_round
+            offset += record_size + length
+        log_file.seek(offset)
+        log_file.truncate()
+        if save_log.records != []:
+            save_log.last_state = save_log.state_at_record(len(save_log.records)-1)
+        return save_log
+
+    def close(self):
+        if self.log_file != None:
+            self.log_file.close()
+            self.log_file = None
+
+    def append(self, kind, state_round, active_player, payload, sync = False):
+        offset = self.log_file.tell()
+        self.log_file.write(struct.pack(RECORD_FORMAT, kind, state_round, active_player, len(payload)))
+        self.log_file.write(payload)
+        self.log_file.flush()
+        if sync:
+            os.fsync(self.log_file.fileno())
+        self.records.append((kind, state_round, active_player, offset + struct.calcsize(RECORD_FORMAT), len(payload)))
+
+    def record(self, state, snapshot = False, sync = False):
+        '''
+        Appends a state dict to the log, as a delta against the last one
+        recorded, or as a snapshot if snapshot is set, there's nothing to
+        take a delta against, or the last snapshot is SNAPSHOT_INTERVAL
+        rounds old. With sync set, the record is flushed to disk before
+        returning. Returns the number of bytes written.
+        '''
+        if (snapshot or self.last_state == None or
+            state['round'] - self.last_snapshot_round >= self.SNAPSHOT_INTERVAL):
+            kind = SNAPSHOT
+            payload = encode_snapshot(state)
+            self.last_snapshot_round = state['round']
+        else:
+            kind = DELTA
+            payload = encode_delta(self.last_state, state)
+        self.append(kind, state['round'], state['active_player'], payload, sync)
+        self.last_state = state
+        return len(payload) + struct.calcsize(RECORD_FORMAT)
+
+    def read_payload(self, index):
+        kind, state_round, active_player, offset, length = self.records[index]
+        position = self.log_file.tell()
+        self.log_file.seek(offset)
+        payload = self.log_file.read(length)
+        self.log_file.seek(position)
+        return payload
+
+    def state_at_record(self, index):
+        '''
+        Rebuilds the state as of a record, from the nearest snapshot at or
+        before it
+        '''
+        start = index
+        while self.records[start][0] != SNAPSHOT:
+            start -= 1
+        kind, state_round, active_player, offset, length = self.records[start]
+        state = decode_snapshot(self.read_payload(start), state_round, active_player)
+        for i in range(start+1, index+1):
+            kind, state_round, active_player, offset, length = self.records[i]
+            state = apply_delta(state, self.read_payload(i), state_round, active_player)
+        return state
+
+    def state_at(self, state_round, player_number = None):
+        '''
+        Rebuilds the state as of the given round, at the start of the given
+        player's turn, or at the end of the round if no player is given.
+        Returns None if nothing was recorded by then.
+        '''
+        found = None
+        for index, (kind, record_round, active_player, offset, length) in enumerate(self.records):
+            if record_round < state_round or (
+                record_round == state_round and (player_number == None or active_player <= player_number)
+            ):
+                found = index
+            else:
+                break
+        if found == None:
+            return None
+        return self.state_at_record(found)
+
+    def latest_state(self):
+        return self.last_state
+
+# Jobs for a BackgroundWorker (see background.py). Saves are handed state
+# that's already been copied off the game on the main thread, so the game can
+# carry on while they're written.
+
+def write_save(progress, save_log, state, terrain = None, snapshot = False, sync = False):
+    '''
+    Writes a snapshot_terrain snapshot to the save log's map file, if one is
+    given, then appends a state dict to the log
+    '''
+    if terrain != None:
+        write_map_file(terrain, save_log.map_file, sync)
+        progress(0.5)
+    save_log.record(state, snapshot, sync)
+    progress(1.0)
+
+def read_save(progress, path, name):
+    '''
+    Opens the save log at path and loads its map, reading in the terrain and
+    building the pathfinding graphs and each player's supply distance field
+    along the way. Returns the save log, the map, the cells for the map's
+    resource nodes, the supply service and the latest saved state, for
+    finish_load and restore_state to put in place on the main thread. No
+    units are created here, since the unit store is only ever changed from
+    the main thread.
+    '''
+    save_log = SaveLog.open(path)
+    progress(0.1)
+    game_map = load_map_file(
+        save_log.map_file, 
+        None, 
+        name, 
+        lambda fraction: progress(0.1 + 0.5*fraction)
+    )
+    # Builds both graphs
+    game_map.get_graph('land')
+    progress(0.7)
+
+    state = save_log.latest_state()
+    bases = dict((number, []) for number in state['players'])
+    for kind, list_code, x, y, owner, movement, order in state['units'].values():
+        if UNIT_KINDS[kind] == Base and owner in bases:
+            bases[owner].append((x, y))
+    supply_service = DistanceFieldService(game_map)
+    for i, number in enumerate(sorted(bases)):
+        supply_service.build_field(number, bases[number])
+        progress(0.7 + 0.3*(i+1)/len(bases))
+    resource_cells = game_map.resource_cells()
+    progress(1.0)
+    return save_log, game_map, resource_cells, supply_service, state
@@ -0,0 +1,83 @@
+import os
+import time
+
+def cpu_time():
+    '''
+    Processor time used by this process so far, in seconds
+    '''
+    times = os.times()
+    return times[0] + times[1]
+
+class FrameScheduler(object):
+    '''
+    Paces the main loop and decides which frames get drawn. Game logic still
+    runs once every frame, since a frame is the basic unit of in-game time,
+    but the screen is only composed and flushed on frames where something
+    visible has changed: anything that changes what's on screen calls
+    mark_dirty, and every other frame is skipped. Between frames the loop
+    sleeps until the next one is due, instead of spinning. With fps = 0 the
+    loop isn't paced at all, and runs frames as fast as it can.
+    '''
+    def __init__(self, fps):
+        self.fps = fps
+        self.frame_time = 1.0/fps if fps else 0
+        self.next_frame = time.time()
+        # Start dirty, so the first frame is always drawn
+        self.dirty = True
+
+        # Statistics since the last reset_stats
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.frames = 0
+        self.rendered_frames = 0
+        self.sleep_time = 0.0
+        self.start_time = time.time()
+        self.start_cpu = cpu_time()
+
+    def mark_dirty(self):
+        '''
+        Asks for the next frame to be drawn
+        '''
+        self.dirty = True
+
+    def should_render(self):
+        '''
+        Whether this frame needs drawing; clears the dirty mark
+        '''
+        self.frames += 1
+        if self.dirty:
+            self.dirty = False
+            self.rendered_frames += 1
+            return True
+        return False
+
+    def wait(self):
+        '''
+        Sleeps until the next frame is due. If the loop has fallen more than a
+        frame behind, it starts counting again from now rather than running
+        frames back to back to catch up.
+        '''
+        if self.frame_time == 0:
+            return
+        self.next_frame += self.frame_time
+        now = time.time()
+        if self.next_frame > now:
+            time.sleep(self.next_frame - now)
+            self.sleep_time += self.next_frame - now
+        elif now - self.next_frame > self.frame_time:
+            self.next_frame = now
+
+    def stats(self):
+        '''
+        Frame counts and processor use since the last reset_stats. cpu_load is
+        the share of one core used over that time.
+        '''
+        elapsed = max(time.time() - self.start_time, 1e-9)
+        return {
+            'frames': self.frames,
+            'rendered_frames': self.rendered_frames,
+            'skipped_frames': self.frames - self.rendered_frames,
+            'sleep_time': self.sleep_time,
+            'cpu_load': (cpu_time() - self.start_cpu)/elapsed,
+        }
@@ -0,0 +1,102 @@
+class SpatialIndex(object):
+    '''
+    Units by the map cell they're on, so finding what's in a cell doesn't
+    mean looking through every unit, and finding what's in a rectangle, like
+    the part of the map the camera can see, only looks at that rectangle.
+    Positions wrap east/west the same way the map does.
+
+    The index keeps itself up to date by subscribing to the unit store (see
+    UnitStore.subscribe), which tells it whenever a unit is created, moves
+    or is killed.
+    '''
+    def __init__(self, world_width, world_height):
+        self.world_width = world_width
+        self.world_height = world_height
+        # (x, y) : list of units in that cell, with x and y on the map
+        self.cells = {}
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def key(self, x, y):
+        return (x % self.world_width, y % self.world_height)
+
+    def add(self, unit):
+        key = self.key(unit.x, unit.y)
+        units = self.cells.get(key)
+        if units == None:
+            units = self.cells[key] = []
+        units.append(unit)
+        self.count += 1
+
+    def remove(self, unit, x = None, y = None):
+        '''
+        Takes a unit out of the index, from the cell at x, y if given, or
+        else from the cell it's in now. Units that aren't in the index, like
+        ones from before it subscribed to the unit store, are ignored.
+        '''
+        if x == None:
+            x, y = unit.x, unit.y
+        key = self.key(x, y)
+        units = self.cells.get(key)
+        if units == None or unit not in units:
+            return
+        units.remove(unit)
+        if units == []:
+            del self.cells[key]
+        self.count -= 1
+
+    def move(self, unit, old_x, old_y):
+        '''
+        Moves a unit from the cell at old_x, old_y to the one it's in now
+        '''
+        if self.key(old_x, old_y) != self.key(unit.x, unit.y):
+            self.remove(unit, old_x, old_y)
+            self.add(unit)
+
+    def at(self, x, y):
+        '''
+        List of the units in the cell at x, y
+        '''
+        return list(self.cells.get(self.key(x, y), ()))
+
+    def find(self, x, y, unit_class = None):
+        '''
+        First living unit in the cell at x, y, of the given class if there
+        is one, or None if there's no such unit there
+        '''
+        for unit in self.cells.get(self.key(x, y), ()):
+            if (unit_class == None or isinstance(unit, unit_class)) and unit.alive:
+                return unit
+        return None
+
+    def in_rect(self, left, top, width, height):
+        '''
+        Every unit in the rectangle with its top left corner at left, top,
+        as (x, y, unit), with x and y relative to the corner. The rectangle
+        wraps east/west, and rows off the top or bottom of the map are
+        empty. Takes time in proportion to the area of the rectangle, or to
+        the number of occupied cells, whichever is smaller.
+        '''
+        found = []
+        width = min(width, self.world_width)
+        top_row = max(top, 0)
+        bottom_row = min(top + height, self.world_height)
+        if top_row >= bottom_row:
+            return found
+        cells = self.cells
+        if width*(bottom_row - top_row) <= len(cells):
+            for y in xrange(top_row, bottom_row):
+                for x in xrange(width):
+                    units = cells.get(((left + x) % self.world_width, y))
+                    if units != None:
+                        for unit in units:
+                            found.append((x, y - top, unit))
+        else:
+            for (cell_x, cell_y), units in cells.iteritems():
+                x = (cell_x - left) % self.world_width
+                if x < width and top_row <= cell_y < bottom_row:
+                    for unit in units:
+                        found.append((x, cell_y - top, unit))
+        return found
@@ -0,0 +1,232 @@
+import heapq
+import time
+from array import array
+import numpy as np
+from pathfinding import *
+
+class DistanceField(object):
+    '''
+    Travel cost from every cell of a PassabilityGraph to the nearest of a set
+    of source cells, e.g. all of a player's bases. Worked out with a single
+    multi-source Dijkstra search, then kept up to date as sources are added
+    and removed: adding a source only revisits the cells it's now nearest
+    to, and removing one only revisits the cells it used to be nearest to.
+    Costs are kept in hundredths, like pathfinding searches.
+    '''
+    # Distance of cells no source can reach
+    UNREACHABLE = 2**31-1
+
+    def __init__(self, graph, sources = ()):
+        self.graph = graph
+        search = get_search(graph)
+        self.indptr = search.indptr
+        self.indices = search.indices
+        self.step_costs = search.step_costs
+        self.index_bits = search.index_bits
+
+        size = len(graph)
+        self.distance = array('i', [self.UNREACHABLE])*size
+        # Which source each cell is nearest to, or -1
+        self.nearest = array('i', [-1])*size
+        # Number of units at each source cell
+        self.sources = {}
+
+        for cell in sources:
+            self.sources[cell] = self.sources.get(cell, 0) + 1
+        self.recompute()
+
+    def recompute(self):
+        '''
+        Works out the whole field from scratch
+        '''
+        size = len(self.graph)
+        self.distance = array('i', [self.UNREACHABLE])*size
+        self.nearest = array('i', [-1])*size
+        frontier = []
+        for cell in self.sources:
+            if self.graph.passable[cell]:
+                self.distance[cell] = 0
+                self.nearest[cell] = cell
+                frontier.append(cell)
+        self.spread(frontier)
+
+    def spread(self, frontier):
+        '''
+        Dijkstra search outwards from the cells in frontier, which must
+        already have their distance and nearest source set, lowering the
+        distance of every cell it can
+        '''
+        indptr = self.indptr
+        indices = self.indices
+        step_costs = self.step_costs
+        distance = self.distance
+        nearest = self.nearest
+        index_bits = self.index_bits
+        mask = (1 << index_bits) - 1
+        heappush = heapq.heappush
+        heappop = heapq.heappop
+
+        frontier = [(distance[cell] << index_bits) | cell for cell in frontier]
+        heapq.heapify(frontier)
+        while frontier:
+            entry = heappop(frontier)
+            current = entry & mask
+            current_distance = entry >> index_bits
+            if current_distance > distance[current]:
+                continue
+            source = nearest[current]
+            for i in xrange(indptr[current], indptr[current+1]):
+                next_node = indices[i]
+                new_distance = current_distance + step_costs[i]
+                if new_distance < distance[next_node]:
+                    distance[next_node] = new_distance
+                    nearest[next_node] = source
+                    heappush(frontier, (new_distance << index_bits) | next_node)
+
+    def add_source(self, cell):
+        count = self.sources.get(cell, 0)
+        self.sources[cell] = count + 1
+        if count == 0 and self.graph.passable[cell]:
+            self.distance[cell] = 0
+            self.nearest[cell] = cell
+            self.spread([cell])
+
+    def remove_source(self, cell):
+        count = self.sources.get(cell, 0)
+        if count > 1:
+            self.sources[cell] = count - 1
+            return
+        elif count == 0:
+            return
+        del self.sources[cell]
+
+        # Forget every cell this source was nearest to, then fill them back in
+        # from the edge of the area the remaining sources still cover
+        affected = np.flatnonzero(self.nearest_array() == cell)
+        distance = self.distance
+        nearest = self.nearest
+        for i in affected.tolist():
+            distance[i] = self.UNREACHABLE
+            nearest[i] = -1
+        frontier = []
+        for current in affected.tolist():
+            best = self.UNREACHABLE
+            for i in xrange(self.indptr[current], self.indptr[current+1]):
+                neighbor = self.indices[i]
+                if nearest[neighbor] != -1 and distance[neighbor] + self.step_costs[i] < best:
+                    best = distance[neighbor] + self.step_costs[i]
+                    nearest[current] = nearest[neighbor]
+            if best != self.UNREACHABLE:
+                distance[current] = best
+                frontier.append(current)
+        self.spread(frontier)
+
+    def distance_array(self):
+        '''
+        Distances in hundredths as an int32 array, sharing memory with the
+        field, indexed by flat cell index
+        '''
+        return np.frombuffer(self.distance, dtype=np.int32)
+
+    def nearest_array(self):
+        '''
+        Nearest source of every cell as an int32 array, sharing memory with
+        the field, indexed by flat cell index
+        '''
+        return np.frombuffer(self.nearest, dtype=np.int32)
+
+    def costs(self):
+        '''
+        The field as an array of travel costs indexed [x, y], infinite where
+        no source can be reached
+        '''
+        distance = self.distance_array()
+        costs = distance.astype(np.float32)/COST_SCALE
+        costs[distance == self.UNREACHABLE] = np.inf
+        return costs.reshape(self.graph.world_width, self.graph.world_height)
+
+    def cost_at(self, x, y):
+        distance = self.distance[self.graph.index(x, y)]
+        if distance == self.UNREACHABLE:
+            return float('inf')
+        return float(distance)/COST_SCALE
+
+class DistanceFieldService(object):
+    '''
+    Keeps a DistanceField per player, measuring travel cost to that player's
+    nearest Base over the land or sea graph. Bases being built or destroyed
+    queue up incremental updates, which update() works through within a
+    frame's worth of time.
+    '''
+    # Time available for updates each frame, in seconds; one frame at 20 FPS
+    FRAME_BUDGET = 1.0/20
+
+    def __init__(self, game_map, land_or_sea = 'land'):
+        self.game_map = game_map
+        self.land_or_sea = land_or_sea
+        self.graph = game_map.get_graph(land_or_sea)
+        self.terrain_version = game_map.terrain_version
+        self.fields = {}
+        self.pending = []
+
+    def check_terrain(self):
+        '''
+        If the terrain has changed, rebuilds every field over the new graph
+        '''
+        if self.game_map.terrain_version != self.terrain_version:
+            self.terrain_version = self.game_map.terrain_version
+            self.graph = self.game_map.get_graph(self.land_or_sea)
+            for player_number, field in self.fields.items():
+                sources = []
+                for cell, count in field.sources.items():
+                    sources += [cell]*count
+                self.fields[player_number] = DistanceField(self.graph, sources)
+
+    def field(self, player, bases = ()):
+        '''
+        Gets the distance field for a player, building it from the given
+        bases the first time it's asked for
+        '''
+        self.check_terrain()
+        if player.number not in self.fields:
+            self.build_field(player.number, [(base.x, base.y) for base in bases if base.owner is player])
+        return self.fields[player.number]
+
+    def build_field(self, player_number, positions):
+        '''
+        Builds the distance field for a player from scratch, given the x, y
+        positions of their bases
+        '''
+        self.check_terrain()
+        self.fields[player_number] = DistanceField(
+            self.graph,
+            [self.graph.index(x, y) for x, y in positions]
+        )
+
+    def add_base(self, base):
+        self.pending.append((base.owner.number, True, self.graph.index(base.x, base.y)))
+
+    def remove_base(self, base):
+        self.pending.append((base.owner.number, False, self.graph.index(base.x, base.y)))
+
+    def update(self, budget = FRAME_BUDGET):
+        '''
+        Applies queued base changes until they're all done or the time budget
+        runs out. Returns True if nothing is left to do.
+        '''
+        deadline = time.time() + budget
+        self.check_terrain()
+        done = 0
+        for player_number, added, cell in self.pending:
+            field = self.fields.get(player_number)
+            if field is None:
+                field = self.fields[player_number] = DistanceField(self.graph)
+            if added:
+                field.add_source(cell)
+            else:
+                field.remove_source(cell)
+            done += 1
+            if time.time() >= deadline:
+                break
+        del self.pending[:done]
+        return self.pending == []
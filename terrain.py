@@ -0,0 +1,95 @@
+import numpy as np
+
+class TerrainStore(object):
+    '''
+    Compact storage for the terrain of a latitude-longitude grid: one
+    contiguous typed array per attribute, indexed [x, y] like GameMap.grid,
+    instead of one Python object per cell. Latitude and longitude only
+    depend on the row and column, so they are stored once per row and once
+    per column.
+    '''
+    def __init__(self, world_width, world_height, elevation, resource_density, latitudes, longitudes, glyphs, color_index, palette):
+        self.world_width = world_width
+        self.world_height = world_height
+        shape = (world_width, world_height)
+        self.elevation = np.ascontiguousarray(elevation, dtype=np.float32).reshape(shape)
+        self.resource_density = np.ascontiguousarray(resource_density, dtype=np.float32).reshape(shape)
+        self.latitudes = np.ascontiguousarray(latitudes, dtype=np.float32)
+        self.longitudes = np.ascontiguousarray(longitudes, dtype=np.float32)
+        self.glyphs = np.ascontiguousarray(glyphs, dtype=np.uint8).reshape(shape)
+        self.color_index = np.ascontiguousarray(color_index, dtype=np.uint8).reshape(shape)
+        # Colors the color indices refer to
+        self.palette = palette
+
+    @property
+    def latitude(self):
+        '''
+        Latitude of every cell, as a read-only view that takes no extra memory
+        '''
+        return np.broadcast_to(self.latitudes, (self.world_width, self.world_height))
+
+    @property
+    def longitude(self):
+        '''
+        Longitude of every cell, as a read-only view that takes no extra memory
+        '''
+        return np.broadcast_to(self.longitudes[:, np.newaxis], (self.world_width, self.world_height))
+
+    def window(self, array, x, y, width, height, fill = 0):
+        '''
+        Copies a width by height rectangle of one of the per-cell arrays,
+        starting from cell x, y. Columns wrap around east to west, and rows
+        off the top or bottom of the grid are filled with fill.
+        '''
+        x = x % self.world_width
+        columns = []
+        while width > 0:
+            end = min(x + width, self.world_width)
+            columns.append(array[x:end])
+            width -= end - x
+            x = 0
+        columns = np.concatenate(columns)
+
+        window = np.empty((len(columns), height), dtype=array.dtype)
+        window.fill(fill)
+        top, bottom = max(y, 0), min(y + height, self.world_height)
+        if top < bottom:
+            window[:, top-y:bottom-y] = columns[:, top:bottom]
+        return window
+
+    def palette_array(self):
+        '''
+        The palette as an array of r, g, b rows, one per color index
+        '''
+        return np.array([(color.r, color.g, color.b) for color in self.palette], dtype=np.int32)
+
+    def arrays(self):
+        '''
+        Returns the per-cell arrays, by name
+        '''
+        return {
+            'elevation': self.elevation,
+            'resource_density': self.resource_density,
+            'glyphs': self.glyphs,
+            'color_index': self.color_index,
+        }
+
+    def detach(self):
+        '''
+        Replaces the per-cell arrays with copies in memory, so that they no
+        longer refer to the map file they were loaded from (see
+        mapfile.read_map_arrays), and the file can be written over
+        '''
+        self.elevation = self.elevation.copy()
+        self.resource_density = self.resource_density.copy()
+        self.glyphs = self.glyphs.copy()
+        self.color_index = self.color_index.copy()
+
+    def nbytes(self):
+        '''
+        Total memory used by the terrain arrays, in bytes
+        '''
+        total = self.latitudes.nbytes + self.longitudes.nbytes
+        for array in self.arrays().values():
+            total += array.nbytes
+        return total
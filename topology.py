@@ -0,0 +1,82 @@
+import numpy as np
+
+# The game world is a latitude-longitude grid wrapped around a sphere: it
+# wraps around east to west, and instead of wrapping from top to bottom
+# (which would make a torus), moving past the top or bottom edge takes you
+# over the pole, to the same row, halfway around the world. Everything here
+# works from the x, y indices alone, so none of it has to be stored per cell.
+#
+# Cells can also be referred to by a single flat index, x*world_height + y,
+# which is the order the terrain arrays are stored in.
+
+ORTHOGONAL_COST = 1
+DIAGONAL_COST = 1.41
+
+# The eight directions a cell can be left in, and what each move costs
+NEIGHBOR_OFFSETS = (
+    (-1, -1), ( 0, -1), ( 1, -1),
+    (-1,  0),           ( 1,  0),
+    (-1,  1), ( 0,  1), ( 1,  1),
+)
+NEIGHBOR_COSTS = tuple(
+    DIAGONAL_COST if dx != 0 and dy != 0 else ORTHOGONAL_COST
+    for dx, dy in NEIGHBOR_OFFSETS
+)
+
+def cell_index(x, y, world_height):
+    '''
+    Flat index of the cell at x, y; works on arrays too
+    '''
+    return x*world_height + y
+
+def cell_coordinates(index, world_height):
+    '''
+    x, y of the cell with the given flat index; works on arrays too
+    '''
+    return index // world_height, index % world_height
+
+def wrap_cell(x, y, world_width, world_height):
+    '''
+    Takes x, y coordinates that may be off the edge of the grid, by at most
+    one row past either pole, and returns the cell they actually refer to.
+    '''
+    if y < 0:
+        y = -y-1
+        x += world_width/2
+    elif y >= world_height:
+        y = 2*world_height-y-1
+        x += world_width/2
+    return x % world_width, y
+
+def cell_neighbors(x, y, world_width, world_height):
+    '''
+    Returns the eight cells adjacent to x, y as a list of (x, y, cost)
+    '''
+    neighbors = []
+    for (dx, dy), cost in zip(NEIGHBOR_OFFSETS, NEIGHBOR_COSTS):
+        nx, ny = wrap_cell(x+dx, y+dy, world_width, world_height)
+        neighbors.append((nx, ny, cost))
+    return neighbors
+
+def neighbor_arrays(world_width, world_height, cells = None):
+    '''
+    Batched version of cell_neighbors. For an array of flat cell indices (all
+    cells if none are given), returns an array of shape (len(cells), 8) with
+    the flat index of each neighbor, and an array of the 8 move costs, in the
+    same order as NEIGHBOR_OFFSETS.
+    '''
+    if cells is None:
+        cells = np.arange(world_width*world_height, dtype=np.int32)
+    x, y = cell_coordinates(np.asarray(cells, dtype=np.int32), world_height)
+    offsets = np.array(NEIGHBOR_OFFSETS, dtype=np.int32)
+    nx = x[:, np.newaxis] + offsets[:, 0]
+    ny = y[:, np.newaxis] + offsets[:, 1]
+
+    # Crossing either pole flips to the other side of the world
+    over_pole = (ny < 0) | (ny >= world_height)
+    ny = np.where(ny < 0, -ny-1, ny)
+    ny = np.where(ny >= world_height, 2*world_height-ny-1, ny)
+    nx = np.where(over_pole, nx + world_width/2, nx) % world_width
+
+    neighbors = cell_index(nx, ny, world_height).astype(np.int32)
+    return neighbors, np.array(NEIGHBOR_COSTS, dtype=np.float32)
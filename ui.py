@@ -1,38 +1,205 @@
+import time
+import numpy as np
 import libtcodpy as libtcod
 from colors import *
 from menus import *
+from unit import *
         
 class GameView:
     '''
     UI panel used to display the game world to the player.
+    
+    The terrain under the camera is kept on its own console, the map layer,
+    which is only redrawn when it has to be: in full when the map, the
+    terrain or the size of the camera changes, and when the camera pans, by
+    shifting what's already there and drawing just the newly revealed
+    strip. Full redraws fill the whole layer from the terrain arrays in a
+    few bulk calls, rather than one call per cell. Objects are drawn over
+    it, and only the cells where an object appeared, moved, changed or went
+    away are touched on each frame.
     '''
     def __init__(self, width, height):
         self.width = width
         self.height = height
         self.console = libtcod.console_new(width, height)
+        # Terrain under the camera, and a spare console for shifting it
+        self.map_layer = libtcod.console_new(width, height)
+        self.spare_layer = libtcod.console_new(width, height)
+        # What the map layer was drawn for: map, terrain version and camera
+        self.layer_state = None
+        # Objects drawn over the map layer on the last frame, as
+        # (x, y) : (char, color) in camera coordinates
+        self.overlay = {}
+        
+        # Rendering statistics for the last frame: time taken in ms, and
+        # number of cells drawn one at a time
+        self.frame_time = 0
+        self.cells_drawn = 0
         
-    def refresh(self, gamemap, camera, objects):
+    def refresh(self, gamemap, camera, objects, unit_index = None):
         '''
         Refreshes and draws the map and list of objects in the main game view
-        from the perspective of the specified camera.
+        from the perspective of the specified camera, along with the units in
+        view in unit_index, if given. Returns True if anything on the view
+        changed.
+        '''
+        start = time.time()
+        self.cells_drawn = 0
+        overlay = self.compose_overlay(camera, objects, unit_index)
+        
+        if self.update_map_layer(gamemap, camera):
+            # The whole layer may have moved, so start again from it
+            libtcod.console_blit(self.map_layer, 0, 0, camera.width, camera.height, self.console, 0, 0)
+            for (x, y), (char, color) in overlay.items():
+                self.draw_object_cell(x, y, char, color)
+            changed = True
+        else:
+            changed = False
+            for position in self.overlay:
+                if position not in overlay:
+                    x, y = position
+                    libtcod.console_blit(self.map_layer, x, y, 1, 1, self.console, x, y)
+                    self.cells_drawn += 1
+                    changed = True
+            for position, (char, color) in overlay.items():
+                if self.overlay.get(position) != (char, color):
+                    x, y = position
+                    if position in self.overlay:
+                        libtcod.console_blit(self.map_layer, x, y, 1, 1, self.console, x, y)
+                    self.draw_object_cell(x, y, char, color)
+                    changed = True
+                    
+        self.overlay = overlay
+        self.frame_time = (time.time() - start)*1000
+        return changed
+        
+    def compose_overlay(self, camera, objects, unit_index = None):
+        '''
+        Works out which objects are visible, and where, as (x, y) : (char,
+        color) in camera coordinates. Later objects are drawn over earlier
+        ones, and objects over units. Units are looked up in unit_index, a
+        SpatialIndex, only over the area in view.
         '''
-        libtcod.console_clear(self.console)
-        self.draw_map(gamemap, camera)
+        overlay = {}
+        if unit_index != None:
+            left, top = camera.x - camera.width/2, camera.y - camera.height/2
+            for x, y, unit in unit_index.in_rect(left, top, camera.width, camera.height):
+                if unit.char != ' ':
+                    overlay[(x, y)] = (unit.char, unit.color)
         if objects != None:
             for object in objects:
-                self.draw_cartesian_object(object, camera)
+                if object.char != ' ':
+                    x, y = self.cartesian_to_camera(object.x, object.y, camera)
+                    if 0 <= x < camera.width and 0 <= y < camera.height:
+                        overlay[(x, y)] = (object.char, object.color)
+        return overlay
+        
+    def draw_object_cell(self, x, y, char, color):
+        libtcod.console_set_default_foreground(self.console, color)
+        libtcod.console_put_char(self.console, x, y, char, libtcod.BKGND_NONE)
+        self.cells_drawn += 1
+        
+    def update_map_layer(self, gamemap, camera):
+        '''
+        Brings the map layer up to date with the camera and the terrain,
+        redrawing as little as possible. Returns True if anything changed.
+        '''
+        state = (gamemap, gamemap.terrain_version, camera.x, camera.y, camera.width, camera.height)
+        if state == self.layer_state:
+            return False
+        old_state = self.layer_state
+        self.layer_state = state
+        
+        if old_state == None or old_state[:2] != state[:2] or old_state[4:] != state[4:]:
+            self.draw_map(gamemap, camera)
+            return True
+            
+        dx, dy = camera.x - old_state[2], camera.y - old_state[3]
+        if abs(dx) >= camera.width or abs(dy) >= camera.height:
+            self.draw_map(gamemap, camera)
+            return True
+        self.shift_map(gamemap, camera, dx, dy)
+        return True
         
-    
     def draw_map(self, gamemap, camera):
-        for x in range(camera.width):
-            for y in range(camera.height):
+        '''
+        Redraws the whole map layer in three calls, one each for characters,
+        foreground and background colors, from the visible window of the
+        terrain arrays
+        '''
+        terrain = gamemap.terrain
+        x, y = self.camera_to_cartesian(0, 0, camera)
+        glyphs = terrain.window(terrain.glyphs, x, y, self.width, self.height, ord(' '))
+        color_index = terrain.window(terrain.color_index, x, y, self.width, self.height)
+        colors = terrain.palette_array()[color_index]
+        
+        # Consoles are filled row by row, so the [x, y] arrays are transposed
+        libtcod.console_fill_char(self.map_layer, glyphs.T.ravel().astype(np.int32))
+        libtcod.console_fill_foreground(
+            self.map_layer, 
+            colors[:, :, 0].T.ravel(), 
+            colors[:, :, 1].T.ravel(), 
+            colors[:, :, 2].T.ravel()
+        )
+        black = np.zeros(self.width*self.height, dtype=np.int32)
+        libtcod.console_fill_background(self.map_layer, black, black, black)
+        
+    def shift_map(self, gamemap, camera, dx, dy):
+        '''
+        Moves the map layer to follow a camera pan of dx, dy cells, then draws
+        the strips along the edges that have come into view
+        '''
+        width, height = camera.width, camera.height
+        libtcod.console_blit(
+            self.map_layer, 
+            max(dx, 0), 
+            max(dy, 0), 
+            width - abs(dx), 
+            height - abs(dy), 
+            self.spare_layer, 
+            max(-dx, 0), 
+            max(-dy, 0)
+        )
+        self.map_layer, self.spare_layer = self.spare_layer, self.map_layer
+        
+        # Columns revealed on the left or right, over the whole height, then
+        # rows revealed at the top or bottom, in the columns not yet drawn
+        if dx > 0:
+            self.draw_map_cells(gamemap, camera, width-dx, width, 0, height)
+            columns = (0, width-dx)
+        elif dx < 0:
+            self.draw_map_cells(gamemap, camera, 0, -dx, 0, height)
+            columns = (-dx, width)
+        else:
+            columns = (0, width)
+        if dy > 0:
+            self.draw_map_cells(gamemap, camera, columns[0], columns[1], height-dy, height)
+        elif dy < 0:
+            self.draw_map_cells(gamemap, camera, columns[0], columns[1], 0, -dy)
+            
+    def draw_map_cells(self, gamemap, camera, x_start, x_end, y_start, y_end):
+        '''
+        Draws a rectangle of the map layer, in camera coordinates
+        '''
+        glyphs = gamemap.glyphs
+        color_index = gamemap.color_index
+        palette = gamemap.palette
+        for x in range(x_start, x_end):
+            for y in range(y_start, y_end):
                 pos_x, pos_y = self.camera_to_cartesian(x, y, camera)
                 if pos_y < 0 or pos_y >= gamemap.world_height:
-                    libtcod.console_put_char(self.console, x, y, ' ', libtcod.BKGND_NONE)
+                    libtcod.console_put_char_ex(self.map_layer, x, y, ' ', WHITE, BLACK)
                 else:
                     pos_x = pos_x % gamemap.world_width
-                    libtcod.console_set_default_foreground(self.console, gamemap.grid[pos_x][pos_y].color)
-                    libtcod.console_put_char(self.console, x, y, gamemap.grid[pos_x][pos_y].char, libtcod.BKGND_NONE)
+                    libtcod.console_put_char_ex(
+                        self.map_layer, 
+                        x, 
+                        y, 
+                        int(glyphs[pos_x, pos_y]), 
+                        palette[color_index[pos_x, pos_y]], 
+                        BLACK
+                    )
+        self.cells_drawn += (x_end - x_start)*(y_end - y_start)
         
     def camera_to_cartesian(self, x, y, camera):
         '''
@@ -92,15 +259,32 @@ class GameUI:
         
         self.paused = False
         self.loading = False
+        # How far through loading or saving the background worker is, in
+        # LOADING_TEXT cells, or None if it can't tell
+        self.loading_progress = None
         self.cursor = None
         self.camera = None
+        
+        # The GUI background is only drawn again when the layout changes, and
+        # the badges when they're turned on or off
+        self.chrome_dirty = True
+        self.badges = None
+        
+        # Frame scheduler to tell when something on screen has changed, set
+        # by the game controller
+        self.scheduler = None
+        # Game state last seen by cycle, to notice changes that need a redraw
+        self.seen_state = None
     
         # Main console
-        libtcod.console_set_custom_font(game_font, libtcod.FONT_TYPE_GREYSCALE | libtcod.FONT_LAYOUT_TCOD)
-        libtcod.console_init_root(self.screen_width, self.screen_height, 'Thermonuclear Go', False)
+        self.init_root(game_font)
         # Libtcod consoles for GUI
         self.current_menu = MainMenu(screen_width, screen_height)
         
+    def init_root(self, game_font):
+        libtcod.console_set_custom_font(game_font, libtcod.FONT_TYPE_GREYSCALE | libtcod.FONT_LAYOUT_TCOD)
+        libtcod.console_init_root(self.screen_width, self.screen_height, 'Thermonuclear Go', False)
+        
     def create_main_menu(self):
         self.current_menu = MainMenu(self.screen_width, self.screen_height)
         
@@ -112,6 +296,7 @@ class GameUI:
         self.infobar = Infobar(self.max_camera_width, self.infobar_height)
         self.sidemenu = SideMenu(self.sidemenu_width, self.max_camera_height)
         self.gui_background = libtcod.console_new(self.screen_width, self.screen_height)
+        self.invalidate_chrome()
         self.current_menu = None
         
     def refresh_all(self, game_object, game_ui):
@@ -119,8 +304,9 @@ class GameUI:
             self.render_all(
                 game_object.game_map, 
                 game_ui.camera, 
-                game_object.armies|game_object.fleets|game_object.bases|game_object.missiles|game_object.resources|game_object.interface_objects, 
-                game_ui.cursor
+                game_object.interface_objects, 
+                game_ui.cursor, 
+                game_object.unit_index
             )
         else:
             self.render_current_menu()
@@ -129,19 +315,15 @@ class GameUI:
     # While the game is running, render a solid background to use as border between other GUI elements
     def refresh_gui_background(self, console):
     
+        self.background_color = DARK_GRAY
+        libtcod.console_set_default_background(console, self.background_color)
         libtcod.console_clear(console)
         
-        self.background_color = DARK_GRAY
-        for x in range(self.screen_width):
-            for y in range(self.screen_height):
-                libtcod.console_set_char_background(
-                    console, 
-                    x, 
-                    y, 
-                    self.background_color
-                )
-                
-        if self.paused == True:
+    def draw_badges(self, console):
+        '''
+        Draws the PAUSED and LOADING badges on the top border, if they're on
+        '''
+        if self.paused == True and self.camera != None:
             for x in range(12):
                 libtcod.console_set_char_background(
                     console, 
@@ -165,12 +347,17 @@ class GameUI:
                 
         if self.loading == True:
             
+            # The badge fills up with TEAL from the left as loading goes on
             for x in xrange(13):
+                if self.loading_progress != None and x < self.loading_progress:
+                    badge_color = TEAL
+                else:
+                    badge_color = DARK_TEAL
                 libtcod.console_set_char_background(
                     console, 
                     15+x, 
                     0, 
-                    DARK_TEAL
+                    badge_color
                 )
                 libtcod.console_put_char(
                     console, 
@@ -186,10 +373,64 @@ class GameUI:
                     WHITE
                  )
                  
+    def render_chrome(self):
+        '''
+        Draws the GUI background onto the root console, but only after the
+        layout has changed; the rest of the time it's still there from the
+        last time. The badges are drawn over it whenever they change, after
+        restoring the top border from the cached background.
+        '''
+        if self.chrome_dirty:
+            self.refresh_gui_background(self.gui_background)
+            libtcod.console_blit(
+                self.gui_background, 
+                0, 
+                0, 
+                self.screen_width, 
+                self.screen_height, 
+                0, 
+                0, 
+                0
+            )
+            self.chrome_dirty = False
+            self.badges = None
+            
+        badges = (self.paused, self.loading, self.loading_progress, self.camera != None and self.camera.width)
+        if badges != self.badges:
+            if self.badges != None:
+                libtcod.console_blit(self.gui_background, 0, 0, self.screen_width, 1, 0, 0, 0)
+            self.draw_badges(0)
+            self.badges = badges
+            
+    def set_loading_progress(self, fraction):
+        '''
+        Shows how far through loading the game is on the LOADING badge;
+        fraction is between 0 and 1, or None if it isn't known
+        '''
+        if fraction != None:
+            fraction = int(fraction*len(self.LOADING_TEXT))
+        if fraction != self.loading_progress:
+            self.loading_progress = fraction
+            self.mark_dirty()
+            
+    def invalidate_chrome(self):
+        '''
+        Marks the GUI background to be drawn again on the next frame; called
+        whenever the layout changes
+        '''
+        self.chrome_dirty = True
+        self.mark_dirty()
+        
+    def mark_dirty(self):
+        '''
+        Asks for the screen to be drawn again on the next frame
+        '''
+        if self.scheduler != None:
+            self.scheduler.mark_dirty()
+                 
     def force_gui_refresh(self):
-        libtcod.console_clear(self.gui_background)
-        self.refresh_gui_background(self.gui_background)
-        libtcod.console_blit(self.gui_background, 0, 0, self.screen_width, self.screen_height, 0, 0, 0)
+        self.invalidate_chrome()
+        self.render_chrome()
         
     def render_current_menu(self):
         # If a main menu is active, blit its contents to the root console
@@ -207,25 +448,17 @@ class GameUI:
             )
 
     # Rendering the main view and GUI elements
-    def render_all(self, gamemap = None, camera = None, objects = None, cursor = None):
-        # blit the contents of the GUI background to the root console
-        self.refresh_gui_background(self.gui_background)
-        libtcod.console_blit(
-            self.gui_background, 
-            0, 
-            0, 
-            self.screen_width, 
-            self.screen_height, 
-            0, 
-            0, 
-            0
-        )
+    def render_all(self, gamemap = None, camera = None, objects = None, cursor = None, unit_index = None):
+        # Draw the GUI background and badges on the root console, if they've
+        # changed since the last frame
+        self.render_chrome()
         # blit the contents of the game_view to the root console
         if gamemap != None and camera != None:
             self.game_view.refresh(
                 gamemap, 
                 camera, 
-                objects
+                objects, 
+                unit_index
             )
             libtcod.console_blit(
                 self.game_view.console, 
@@ -272,6 +505,7 @@ class GameUI:
             camera.width = self.max_camera_width - self.sidemenu.width
         else:
             camera.width = self.max_camera_width
+        self.invalidate_chrome()
     
     def toggle_infobar(self, camera):
         self.infobar.show = not self.infobar.show
@@ -279,10 +513,46 @@ class GameUI:
             camera.height = self.max_camera_height - self.infobar.height
         else:
             camera.height = self.max_camera_height
+        self.invalidate_chrome()
 
     def cycle(self):
         '''
-        Periodic UI events governed by the main game loop
+        Periodic UI events governed by the main game loop. Also checks for
+        anything that changes what's on screen without going through the UI,
+        and if so asks for a redraw.
         '''
         if self.cursor != None:
+            char = self.cursor.char
             self.cursor.blink()
+            if self.cursor.char != char:
+                self.mark_dirty()
+                
+        if self.current_menu == None and self.infobar.show and self.infobar.reader != None:
+            if self.infobar.reader.pending() > 0:
+                self.mark_dirty()
+                
+        state = (self.paused, self.loading, Unit.position_version, Unit.appearance_version)
+        game_object = self.game_object
+        if game_object != None:
+            state += (game_object.active_player, game_object.round)
+            if game_object.game_map != None:
+                state += (game_object.game_map.terrain_version,)
+        if state != self.seen_state:
+            self.seen_state = state
+            self.mark_dirty()
+            
+class HeadlessUI(GameUI):
+    '''
+    GameUI with a null renderer, for running games without a window: there's
+    no root console, and nothing is ever drawn or flushed. The panels are
+    still created, as off-screen consoles, since the game keeps state in
+    them, such as the camera bounds and the infobar's message reader.
+    '''
+    def init_root(self, game_font):
+        pass
+        
+    def refresh_all(self, game_object, game_ui):
+        pass
+        
+    def render_chrome(self):
+        pass
@@ -1,43 +1,157 @@
 from colors import *
 from player import *
+from unitstore import *
+
+def store_column(name, from_store = int, to_store = None):
+    '''
+    Property for a unit field kept in a UnitStore column, converted to and
+    from its stored form by from_store and to_store
+    '''
+    def get(self):
+        return from_store(getattr(self.store, name)[self.id])
+    def set(self, value):
+        if to_store != None:
+            value = to_store(value)
+        getattr(self.store, name)[self.id] = value
+    return property(get, set)
 
 class Unit(object):
     '''
-    Basic unit object, used for other game objects.
+    Basic unit object, used for other game objects. A unit is only a handle
+    onto its row in the unit store, where its fields are kept (see
+    unitstore.py); whatever's the same for every unit of a class is a class
+    attribute. Once the unit has been swept, its fields can no longer be
+    used (see id).
     '''
+    __slots__ = ('handle', 'unit_list')
     MAX_MOVEMENT = 0
+    SUPPLY_COST = 0
     ATTACK_CHAR = '@'
     DEFEND_CHAR = '@'
     SUPPORT_CHAR = '@'
     MOVE_CHAR = '@'
     HOLD_CHAR = '@'
     DEFAULT_CHAR = '@'
+    # Units are drawn in their owner's color, unless they have one of their
+    # own
+    COLOR = None
+    name = 'Unit'
+    movement_type = None
+    # Every unit's fields
+    store = UnitStore()
+    # Bumped whenever any unit appears, moves or disappears, so anything
+    # that depends on where units are (like the UI) knows to update
+    position_version = 0
+    # Bumped whenever any unit's char changes, e.g. with a new order, so the
+    # UI knows to redraw
+    appearance_version = 0
+    # Unique id for the next unit created, used to refer to units in saves
+    next_uid = 1
     def __init__(self, x, y, unit_list, player = no_player):
+        Unit.position_version += 1
+        self.handle = self.store.handle(self.store.add(type(self), x, y, player, self))
+        self.uid = Unit.next_uid
+        Unit.next_uid += 1
         unit_list.add(self)
         self.unit_list = unit_list
         player.owned_objects.add(self)
-        self.x = x
-        self.y = y
-        self.char = self.DEFAULT_CHAR
-        self.color = player.color
-        self.name = 'Unit'
-        owner = player
-        self.movement = self.MAX_MOVEMENT
-        self.movement_type = None
-        self.order = None
-        self.wait = 5
-        self.supply_cost = 0
-        self.active = False
+        player.update_movement(0, self.MAX_MOVEMENT)
+        for listener in self.store.listeners:
+            listener.add(self)
+        
+    @property
+    def id(self):
+        '''
+        The unit's row in the store. Raises StaleUnitError once the unit has
+        been swept, rather than handing back a row another unit may have
+        since been given.
+        '''
+        return self.store.row(self.handle)
+    
+    uid = store_column('uid')
+    supply_cost = store_column('supply_cost')
+    wait = store_column('wait')
+    active = store_column('active', bool)
+    order = store_column('order', lambda code: ORDERS[code], ORDERS.index)
+    
+    @property
+    def char(self):
+        return chr(self.store.char[self.id])
+    
+    @char.setter
+    def char(self, char):
+        Unit.appearance_version += 1
+        self.store.char[self.id] = ord(char)
+    
+    @property
+    def x(self):
+        return int(self.store.x[self.id])
+    
+    @x.setter
+    def x(self, x):
+        self.place(x, self.y)
+    
+    @property
+    def y(self):
+        return int(self.store.y[self.id])
     
+    @y.setter
+    def y(self, y):
+        self.place(self.x, y)
+    
+    @property
+    def movement(self):
+        return int(self.store.movement[self.id])
+    
+    @movement.setter
+    def movement(self, movement):
+        id = self.id
+        if self.store.alive[id]:
+            self.owner.update_movement(self.movement, movement)
+        self.store.movement[id] = movement
+    
+    @property
+    def owner(self):
+        return self.store.players[self.store.owner[self.id]]
+    
+    @property
+    def alive(self):
+        return self.store.valid(self.handle)
+    
+    @property
+    def color(self):
+        if self.COLOR != None:
+            return self.COLOR
+        return self.owner.color
+    
+    def place(self, x, y):
+        '''
+        Puts the unit at x, y, and tells anything indexing units by position
+        '''
+        Unit.position_version += 1
+        id = self.id
+        old_x, old_y = self.x, self.y
+        self.store.x[id] = x
+        self.store.y[id] = y
+        for listener in self.store.listeners:
+            listener.move(self, old_x, old_y)
+        
     # Basic movement on the game grid
     def move(self, x, y):
-        self.x += x
-        self.y += y
+        self.place(self.x + x, self.y + y)
         self.movement -= 10
         
     def kill(self):
-        self.owner.owned_objects.remove(self)
-        self.unit_list.remove(self)
+        '''
+        Kills the unit. It stays in its unit list and its owner's objects,
+        drawn as a blank, until the next sweep takes it out of them (see
+        GameObject.clean_dead_objects). Killing a unit that's already dead
+        does nothing.
+        '''
+        if not self.store.valid(self.handle):
+            return
+        Unit.position_version += 1
+        self.store.kill(self.id)
         
     def blink(self):
         if self.wait > 0:
@@ -69,43 +183,39 @@ class Unit(object):
             
     
 class Base(Unit):
+    __slots__ = ()
     DEFAULT_CHAR = '#'
-    def __init__(self, x, y, unit_list, player = no_player):
-        super(Base, self).__init__(x, y, unit_list, player)
-        self.supply_cost = -1
+    SUPPLY_COST = -1
         
         
 class ResourceNode(Unit):
+    __slots__ = ()
     DEFAULT_CHAR = '^'
-    def __init__(self, x, y, unit_list, player = no_player):
-        super(ResourceNode, self).__init__(x, y, unit_list, player)
-        self.color = GOLD
+    COLOR = GOLD
         
 class Army(Unit):
+    __slots__ = ()
     MAX_MOVEMENT = 100
+    SUPPLY_COST = 1
     ATTACK_CHAR = '>'
     DEFEND_CHAR = 'X'
     SUPPORT_CHAR = '$'
     MOVE_CHAR = '/'
     HOLD_CHAR = '*'
     DEFAULT_CHAR = '&'
-    def __init__(self, x, y, unit_list, player):
-        super(Army, self).__init__(x, y, unit_list, player)
-        self.name = 'Army'
-        self.movement_type = 'land'
-        self.supply_cost = 1
+    name = 'Army'
+    movement_type = 'land'
         
         
 class Fleet(Unit):
+    __slots__ = ()
     MAX_MOVEMENT = 100
+    SUPPLY_COST = 1
     ATTACK_CHAR = '<'
     DEFEND_CHAR = '@'
     SUPPORT_CHAR = 'S'
     MOVE_CHAR = '\\'
     HOLD_CHAR = '*'
     DEFAULT_CHAR = 'V'
-    def __init__(self, x, y, unit_list, player):
-        super(Fleet, self).__init__(x, y, unit_list, player)
-        self.name = 'Fleet'
-        self.movement_type = 'sea'
-        self.supply_cost = 1
\ No newline at end of file
+    name = 'Fleet'
+    movement_type = 'sea'
\ No newline at end of file
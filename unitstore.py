@@ -0,0 +1,303 @@
+import numpy as np
+
+# Orders a unit can be given, by the code they're stored as
+ORDERS = [None, 'attack', 'defend', 'support', 'move', 'hold', 'wait']
+
+class StaleUnitError(Exception):
+    '''
+    Raised when a unit's fields are used after it's been swept, since its
+    row may by then belong to another unit
+    '''
+    pass
+
+class UnitStore(object):
+    '''
+    Keeps the fields of every unit in columns, one numpy array per field,
+    with a row per unit. A unit's id is its row. Unit objects are only
+    handles onto a row (see unit.Unit), so a unit costs a few dozen bytes
+    instead of a whole instance dict, and operations over all of a player's
+    units at once, like resetting movement at the start of their turn, work
+    on whole columns instead of looping over objects.
+
+    Killing a unit only marks its row dead and leaves a tombstone; sweep
+    clears every tombstone in one pass, and puts the rows on a free list for
+    new units to reuse. Each row has a generation, bumped whenever it's
+    freed, so a handle (see handle) made from the row and its generation
+    only ever refers to the one unit: once that unit is swept, the handle
+    is no longer valid, even after the row has been reused.
+    '''
+    COLUMNS = (
+        ('uid', np.uint32),
+        ('x', np.int32),
+        ('y', np.int32),
+        # Code for the unit's owner; see player_code
+        ('owner', np.int16),
+        # Code for the unit's class; see kind_code
+        ('kind', np.int16),
+        ('movement', np.int32),
+        # Index into ORDERS
+        ('order', np.int8),
+        ('supply_cost', np.int8),
+        # Character the unit is drawn as, as a character code
+        ('char', np.uint8),
+        # Frames left until the next blink
+        ('wait', np.int8),
+        ('active', np.bool_),
+        ('alive', np.bool_),
+        # Set for units killed since the last sweep
+        ('tombstone', np.bool_),
+        # Number of times the row has been freed
+        ('generation', np.uint32),
+    )
+    INITIAL_CAPACITY = 256
+    # Bits of a handle that hold the row; the rest hold its generation
+    ROW_BITS = 24
+    ROW_MASK = (1 << ROW_BITS) - 1
+
+    def __init__(self, capacity = INITIAL_CAPACITY):
+        self.size = 0
+        self.capacity = capacity
+        for name, dtype in self.COLUMNS:
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+        # Unit object for each row in use
+        self.units = np.empty(capacity, dtype=object)
+        # Rows freed by sweep, to be reused before new rows are added
+        self.free = []
+        # Unit classes by kind code, and the MAX_MOVEMENT of each
+        self.kinds = []
+        self.kind_codes = {}
+        self.max_movement = np.zeros(0, dtype=np.int32)
+        # Players by code, and codes given back by release_players, to be
+        # given out again
+        self.players = []
+        self.player_codes = {}
+        self.free_player_codes = []
+        # Indexes kept up to date as units are created, moved and killed;
+        # see subscribe
+        self.listeners = []
+
+    def subscribe(self, listener):
+        '''
+        Has listener told about every unit created, moved or killed from now
+        on, through its add(unit), move(unit, old_x, old_y) and remove(unit)
+        methods, like a SpatialIndex
+        '''
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def kind_code(self, unit_class):
+        '''
+        Code for a unit class in the kind column, given out the first time
+        the class is seen
+        '''
+        code = self.kind_codes.get(unit_class)
+        if code == None:
+            code = self.kind_codes[unit_class] = len(self.kinds)
+            self.kinds.append(unit_class)
+            self.max_movement = np.append(self.max_movement, np.int32(unit_class.MAX_MOVEMENT))
+        return code
+
+    def player_code(self, player):
+        '''
+        Code for a player in the owner column, given out the first time the
+        player is seen. Players are told apart by identity rather than
+        number, since each game has its own player 1.
+        '''
+        code = self.player_codes.get(player)
+        if code == None:
+            if self.free_player_codes != []:
+                code = self.free_player_codes.pop()
+                self.players[code] = player
+            else:
+                code = len(self.players)
+                self.players.append(player)
+            self.player_codes[player] = code
+        return code
+
+    def release_players(self, players):
+        '''
+        Gives back the codes of players who no longer own any units, living
+        or awaiting a sweep, so that a new game's players can reuse them
+        '''
+        for player in players:
+            code = self.player_codes.get(player)
+            if code == None:
+                continue
+            owned = self.owner[:self.size] == code
+            if (owned & (self.alive[:self.size] | self.tombstone[:self.size])).any():
+                continue
+            del self.player_codes[player]
+            self.players[code] = None
+            self.free_player_codes.append(code)
+
+    def grow(self):
+        '''
+        Doubles the number of rows there's room for
+        '''
+        self.capacity *= 2
+        for name, dtype in self.COLUMNS:
+            column = np.zeros(self.capacity, dtype=dtype)
+            column[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, column)
+        units = np.empty(self.capacity, dtype=object)
+        units[:self.size] = self.units[:self.size]
+        self.units = units
+
+    def add(self, unit_class, x, y, player, unit = None):
+        '''
+        Adds a row for a new unit of the given class, filled in from the
+        class's defaults, and returns its id. A freed row is reused if there
+        is one. unit is the Unit object for the row, if there is one.
+        '''
+        if self.free != []:
+            id = self.free.pop()
+        else:
+            if self.size == self.capacity:
+                self.grow()
+            id = self.size
+            self.size += 1
+        self.x[id] = x
+        self.y[id] = y
+        self.owner[id] = self.player_code(player)
+        self.kind[id] = self.kind_code(unit_class)
+        self.movement[id] = unit_class.MAX_MOVEMENT
+        self.order[id] = 0
+        self.supply_cost[id] = unit_class.SUPPLY_COST
+        self.char[id] = ord(unit_class.DEFAULT_CHAR)
+        self.wait[id] = 5
+        self.active[id] = False
+        self.alive[id] = True
+        self.units[id] = unit
+        return id
+
+    def handle(self, id):
+        '''
+        Handle for the unit in a row: the row, with its generation in the
+        bits above ROW_BITS
+        '''
+        return (int(self.generation[id]) << self.ROW_BITS) | id
+
+    def valid(self, handle):
+        '''
+        Whether a handle still refers to a living unit
+        '''
+        id = handle & self.ROW_MASK
+        return id < self.size and int(self.generation[id]) == handle >> self.ROW_BITS and bool(self.alive[id])
+
+    def row(self, handle):
+        '''
+        Row a handle refers to, whether its unit is alive or only awaiting
+        the next sweep. Raises StaleUnitError if the unit has been swept.
+        '''
+        id = handle & self.ROW_MASK
+        if self.generation.item(id) != handle >> self.ROW_BITS:
+            raise StaleUnitError('unit in row ' + str(id) + ' has been swept')
+        return id
+
+    def unit(self, handle):
+        '''
+        Unit object a handle refers to, or None if it's dead or swept
+        '''
+        if self.valid(handle):
+            return self.units[handle & self.ROW_MASK]
+        return None
+
+    def kill(self, ids):
+        '''
+        Kills the units in a row or array of rows: they're marked dead, with
+        no movement, drawn as a blank, and left with a tombstone until the
+        next sweep. Their movement comes off their owners' unit counters, a
+        player at a time. Returns the number of units killed.
+        '''
+        ids = np.unique(np.atleast_1d(ids))
+        ids = ids[self.alive[ids]]
+        if len(ids) == 0:
+            return 0
+        owners = self.owner[ids]
+        movement = self.movement[ids]
+        movement_left = np.bincount(owners, weights=movement, minlength=len(self.players))
+        idle_units = np.bincount(owners[movement > 0], minlength=len(self.players))
+        for code in np.flatnonzero(movement_left != 0):
+            self.players[code].movement_left -= int(movement_left[code])
+        for code in np.flatnonzero(idle_units):
+            self.players[code].idle_units -= int(idle_units[code])
+        self.movement[ids] = 0
+        self.char[ids] = ord(' ')
+        self.alive[ids] = False
+        self.tombstone[ids] = True
+        return len(ids)
+
+    def tombstoned(self):
+        '''
+        Units killed and awaiting the next sweep, as an array of Unit
+        objects
+        '''
+        return self.units[np.flatnonzero(self.tombstone[:self.size])]
+
+    def sweep(self):
+        '''
+        Clears every tombstone in one pass, telling the listeners the units
+        are gone, and frees their rows for reuse. A swept row's fields are
+        left as they were until it's reused. Returns the swept units, as an
+        array of Unit objects.
+        '''
+        ids = np.flatnonzero(self.tombstone[:self.size])
+        dead = self.units[ids]
+        if len(ids) == 0:
+            return dead
+        for listener in self.listeners:
+            for unit in dead:
+                listener.remove(unit)
+        self.tombstone[ids] = False
+        self.generation[ids] += 1
+        self.units[ids] = None
+        self.free.extend(ids.tolist())
+        return dead
+
+    def in_area(self, x, y, radius, world_width, players):
+        '''
+        Rows of the living units of the given players within radius cells of
+        x, y, wrapping east/west over world_width
+        '''
+        codes = [self.player_code(player) for player in players]
+        mask = self.living() & np.in1d(self.owner[:self.size], codes)
+        dx = (self.x[:self.size] - x) % world_width
+        dx = np.minimum(dx, world_width - dx)
+        dy = self.y[:self.size] - y
+        mask &= dx*dx + dy*dy <= radius*radius
+        return np.flatnonzero(mask)
+
+    def living(self, player = None):
+        '''
+        Mask over the store's rows of the units that are alive, and owned by
+        the given player if there is one
+        '''
+        mask = self.alive[:self.size].copy()
+        if player != None:
+            mask &= self.owner[:self.size] == self.player_code(player)
+        return mask
+
+    def reset_movement(self, player = None):
+        '''
+        Gives every living unit, or every living unit of a player, its full
+        movement back
+        '''
+        mask = self.living(player)
+        self.movement[:self.size][mask] = self.max_movement[self.kind[:self.size][mask]]
+
+    def movement_counters(self, player = None):
+        '''
+        Total movement left over every living unit, or every living unit of
+        a player, and the number of those units with any movement left
+        '''
+        movement = self.movement[:self.size][self.living(player)]
+        return int(movement.sum()), int(np.count_nonzero(movement > 0))
+
+    def nbytes(self):
+        '''
+        Bytes used by the columns for the rows in use
+        '''
+        return sum(getattr(self, name)[:self.size].nbytes for name, dtype in self.COLUMNS)
@@ -0,0 +1,216 @@
+import os
+import hashlib
+import numpy as np
+
+# The Doryen Library - Documentation:
+# http://roguecentral.org/doryen/data/libtcod/doc/1.5.1/index2.html
+import libtcodpy as libtcod
+from colors import *
+from sphere import *
+
+# Glyph and color used for any elevation outside of the known bands
+DEFAULT_GLYPH = '#'
+DEFAULT_COLOR = WHITE
+
+def grid_latitudes(world_height):
+    '''
+    Latitude in degrees of every row of the grid
+    '''
+    return np.arange(world_height, dtype=np.float64)*180/world_height-90
+
+def grid_longitudes(world_width):
+    '''
+    Longitude in degrees of every column of the grid
+    '''
+    return np.arange(world_width, dtype=np.float64)*360/world_width-180
+
+def build_palette(elevations):
+    '''
+    Turns an elevation table (see GridCoordinate.ELEVATIONS) into a list of
+    bands, highest first, as (max, min, glyph, color index) plus the list of
+    colors the indices refer to. Color index 0 is always the default color.
+    '''
+    palette = [DEFAULT_COLOR]
+    bands = []
+    for elev_range in sorted(elevations, reverse=True):
+        max_, min_ = elev_range
+        elev_info = elevations[elev_range]
+        if elev_info['color'] not in palette:
+            palette.append(elev_info['color'])
+        bands.append((max_, min_, elev_info['char'], palette.index(elev_info['color'])))
+    return bands, palette
+
+def sample_noise(noise, x, y, z, detail = None):
+    '''
+    Samples 3d noise at every point given by the flat coordinate arrays x, y,
+    z. Uses fbm noise if a detail level (number of octaves) is given, plain
+    noise otherwise. libtcod only samples one point per call, so this is the
+    one part of world generation that can't be vectorized; everything else
+    is worked out up front so the loop does nothing but call into libtcod.
+    '''
+    values = np.empty(len(x), dtype=np.float32)
+    points = zip(x.tolist(), y.tolist(), z.tolist())
+    if detail is None:
+        for i, point in enumerate(points):
+            values[i] = libtcod.noise_get(noise, point)
+    else:
+        for i, point in enumerate(points):
+            values[i] = libtcod.noise_get_fbm(noise, point, detail)
+    return values
+
+def classify_elevation(elevation, bands):
+    '''
+    Returns the glyph (as a character code) and color index arrays for an
+    array of elevations, given the bands from build_palette
+    '''
+    # Compare at double precision, same as comparing a single cell's
+    # elevation against the band limits
+    elevation = np.asarray(elevation, dtype=np.float64)
+    glyphs = np.empty(elevation.shape, dtype=np.uint8)
+    glyphs.fill(ord(DEFAULT_GLYPH))
+    color_index = np.zeros(elevation.shape, dtype=np.uint8)
+    for max_, min_, char, color in bands:
+        band = (elevation <= max_) & (elevation > min_)
+        glyphs[band] = ord(char)
+        color_index[band] = color
+    return glyphs, color_index
+
+def new_noise(seed):
+    '''
+    Creates the world and resource noise generators for a seed. The same
+    seed always gives the same noise. Returns the two noise generators and
+    the random number generator they were made with, which should be
+    deleted along with them.
+    '''
+    rng = libtcod.random_new_from_seed(seed)
+    world_noise = libtcod.noise_new(3, libtcod.NOISE_DEFAULT_HURST, libtcod.NOISE_DEFAULT_LACUNARITY, rng)
+    resource_noise = libtcod.noise_new(3, libtcod.NOISE_DEFAULT_HURST, libtcod.NOISE_DEFAULT_LACUNARITY, rng)
+    return world_noise, resource_noise, rng
+
+def generate_terrain(world_width, world_height, world_noise, resource_noise,
+    landmass_size, detail, resource_distribution, elevations):
+    '''
+    Generates the terrain for a whole latitude-longitude grid in batched
+    passes. Returns a dict of arrays, all indexed [x, y] like GameMap.grid:
+    latitude and longitude in degrees, the 3d points the elevation noise was
+    sampled at, elevation, resource density, glyph and color index (into
+    the returned palette).
+    '''
+    la, lo = np.meshgrid(
+        grid_latitudes(world_height),
+        grid_longitudes(world_width)
+    )
+
+    # Sampling 3d noise to get the shape of the landmasses
+    sample_x, sample_y, sample_z = spherical_to_cartesian_array(la, lo, landmass_size)
+    elevation = sample_noise(
+        world_noise,
+        sample_x.ravel(),
+        sample_y.ravel(),
+        sample_z.ravel(),
+        detail
+    ).reshape(la.shape)
+
+    # Sampling 3d noise to find out where to spawn resource nodes; only land
+    # has resources, so there's no need to sample anywhere else
+    land = elevation > 0
+    resource_density = np.zeros(la.shape, dtype=np.float32)
+    x, y, z = spherical_to_cartesian_array(la[land], lo[land], resource_distribution)
+    resource_density[land] = sample_noise(resource_noise, x, y, z)
+
+    bands, palette = build_palette(elevations)
+    glyphs, color_index = classify_elevation(elevation, bands)
+
+    return {
+        'latitude': la,
+        'longitude': lo,
+        'sample_x': sample_x,
+        'sample_y': sample_y,
+        'sample_z': sample_z,
+        'elevation': elevation,
+        'resource_density': resource_density,
+        'glyphs': glyphs,
+        'color_index': color_index,
+        'palette': palette,
+    }
+
+def finish_terrain(elevation, resource_density, elevations):
+    '''
+    Works out the rest of the terrain from elevation and resource density
+    alone, e.g. after loading them from the terrain cache. Returns a dict
+    like generate_terrain's, minus the noise sample points.
+    '''
+    world_width, world_height = elevation.shape
+    la, lo = np.meshgrid(
+        grid_latitudes(world_height),
+        grid_longitudes(world_width)
+    )
+    bands, palette = build_palette(elevations)
+    glyphs, color_index = classify_elevation(elevation, bands)
+    return {
+        'latitude': la,
+        'longitude': lo,
+        'elevation': elevation,
+        'resource_density': resource_density,
+        'glyphs': glyphs,
+        'color_index': color_index,
+        'palette': palette,
+    }
+
+class TerrainCache(object):
+    '''
+    On-disk cache of generated terrain. Entries are keyed on everything that
+    goes into generating a map: the seed, the size and the generation
+    constants, so a map is only ever generated once, and generating it again
+    just loads the stored elevation and resource density.
+    '''
+    # Bump whenever world generation changes in a way that changes its output,
+    # so maps cached by older versions are never used
+    GENERATOR_VERSION = 1
+
+    def __init__(self, directory = 'map_cache'):
+        self.directory = directory
+
+    def key(self, parameters):
+        '''
+        Cache key for a tuple of generation parameters
+        '''
+        return hashlib.sha1(repr((self.GENERATOR_VERSION,) + tuple(parameters))).hexdigest()
+
+    def path(self, parameters):
+        return os.path.join(self.directory, self.key(parameters) + '.npz')
+
+    def load(self, parameters):
+        '''
+        Returns the cached elevation and resource density arrays for a set of
+        parameters, or None if they aren't cached
+        '''
+        path = self.path(parameters)
+        if not os.path.exists(path):
+            return None
+        try:
+            cached = np.load(path)
+            if str(cached['parameters']) != repr(tuple(parameters)):
+                return None
+            return cached['elevation'], cached['resource_density']
+        except (IOError, ValueError, KeyError):
+            # A damaged entry is as good as a missing one
+            return None
+
+    def store(self, parameters, elevation, resource_density):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = self.path(parameters)
+        # Written under a temporary name and renamed, so a half-written entry
+        # is never picked up
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'wb') as cache_file:
+            np.savez(
+                cache_file,
+                parameters = np.array(repr(tuple(parameters))),
+                elevation = elevation,
+                resource_density = resource_density
+            )
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(temporary_path, path)